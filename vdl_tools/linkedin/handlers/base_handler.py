@@ -37,10 +37,10 @@ def load_organization(id: str, config: dict, cache: LinkedInCache, raw_cache: Li
     return None, None
 
 
-def load_organization_no_cache(id: str):
+def load_organization_no_cache(id: str, session=None):
     try:
         log.warn(f"({id}) Loading using direct query")
-        res = dq.get_organization(id)
+        res = dq.get_organization(id, session=session)
         if res:
             return res
     except Exception as ex:
@@ -1,8 +1,14 @@
-import requests
-import json
+from concurrent.futures import ThreadPoolExecutor
 import gzip
+import json
+import queue
+import threading
 import time
 
+import orjson
+import requests
+from requests.adapters import HTTPAdapter
+
 from vdl_tools.shared_tools.tools.logger import logger
 
 
@@ -10,6 +16,10 @@ from vdl_tools.linkedin.handlers.coresignal_query import create_esl_dsl_query
 
 MAX_N_TIMES_PROCESSING = 10
 SECONDS_BETWEEN_REQUESTS = 60
+MAX_DOWNLOAD_WORKERS = 4
+# Max number of parsed results waiting to be consumed, keeps memory flat
+# when the consumer is slower than the downloads
+MAX_QUEUED_RESULTS = 1000
 
 
 def get_headers(api_key):
@@ -83,43 +93,146 @@ def get_processed_filenames(
     return data_request_files
 
 
-def retrieve_bulk_results(request_id, filepart_names, api_key):
-    logger.info("Retrieving bulks results for %s filenames", len(filepart_names))
-    results = []
-    for i, filename in enumerate(filepart_names):
-        file_part = requests.get(
-            f"https://api.coresignal.com/cdapi/v1/bulk_collect/{request_id}/files/{filename}",
-            headers=get_headers(api_key),
-            timeout=360,
-        )
-        gzipped_bytes = file_part.content
-        decompressed_bytes = gzip.decompress(gzipped_bytes)
-        decompressed_string = decompressed_bytes.decode('utf-8').strip()
+def _make_http_session(max_workers):
+    http_session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers)
+    http_session.mount("https://", adapter)
+    return http_session
+
+
+def iter_file_part_results(request_id, filename, api_key, http_session=None):
+    """Streams the results of one gzipped JSONL file part.
+
+    The part is decompressed while it downloads and parsed line by line, so
+    only one line is held in memory at a time.
+    """
+    http_session = http_session or requests
+    with http_session.get(
+        f"https://api.coresignal.com/cdapi/v1/bulk_collect/{request_id}/files/{filename}",
+        headers=get_headers(api_key),
+        timeout=360,
+        stream=True,
+    ) as file_part:
+        if not file_part.ok:
+            logger.warning(
+                "Error retrieving file part %s: %s - %s",
+                filename,
+                file_part.status_code,
+                file_part.content,
+            )
+            file_part.raise_for_status()
 
         # It's set up as JSONL data (jsons split by new line)
-        for json_string in decompressed_string.split('\n'):
-            results.append(json.loads(json_string))
-        if i % 100 == 0:
-            logger.info("Processed %s / %s filenames", i, len(filepart_names))    
-    return results
+        with gzip.GzipFile(fileobj=file_part.raw) as lines:
+            for line in lines:
+                line = line.strip()
+                if line:
+                    yield orjson.loads(line)
 
 
-def get_bulk_organization_results(
+class _PartFailed:
+    """Put on the results queue by a download thread whose file part failed."""
+
+    def __init__(self, filename, error):
+        self.filename = filename
+        self.error = error
+
+
+def iter_bulk_results(
+    request_id,
+    filepart_names,
+    api_key,
+    max_workers=MAX_DOWNLOAD_WORKERS,
+    max_queued_results=MAX_QUEUED_RESULTS,
+):
+    """Yields the results of all the file parts of a bulk request.
+
+    File parts are downloaded concurrently by `max_workers` threads sharing a pooled
+    session. Parsed results go through a bounded queue, so at most `max_queued_results`
+    are held in memory regardless of how many companies were requested.
+    Results from different parts can be interleaved.
+
+    If a file part fails to download or parse, its error is raised by the generator
+    once the results before it were consumed, so the companies of that part are not
+    silently treated as missing.
+    """
+    logger.info("Retrieving bulks results for %s filenames", len(filepart_names))
+    if not filepart_names:
+        return
+
+    results_queue = queue.Queue(maxsize=max_queued_results)
+    stop_event = threading.Event()
+    done_marker = object()
+    http_session = _make_http_session(max_workers)
+
+    def _put(item):
+        # Stop waiting if the consumer went away
+        while not stop_event.is_set():
+            try:
+                results_queue.put(item, timeout=1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _download_part(filename):
+        if stop_event.is_set():
+            return
+        try:
+            for result in iter_file_part_results(request_id, filename, api_key, http_session):
+                if not _put(result):
+                    return
+        except Exception as ex:
+            logger.exception("Error processing file part %s: %s", filename, ex)
+            _put(_PartFailed(filename, ex))
+            return
+        _put(done_marker)
+
+    n_done = 0
+    with http_session, ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for filename in filepart_names:
+            executor.submit(_download_part, filename)
+
+        try:
+            while n_done < len(filepart_names):
+                item = results_queue.get()
+                if isinstance(item, _PartFailed):
+                    raise item.error
+                if item is done_marker:
+                    n_done += 1
+                    if n_done % 100 == 0:
+                        logger.info("Processed %s / %s filenames", n_done, len(filepart_names))
+                    continue
+                yield item
+        finally:
+            # Must be set before the executor waits for the workers
+            stop_event.set()
+
+
+def retrieve_bulk_results(request_id, filepart_names, api_key, max_workers=MAX_DOWNLOAD_WORKERS):
+    """All the results of a bulk request in a list, use `iter_bulk_results` to keep memory flat."""
+    return list(iter_bulk_results(request_id, filepart_names, api_key, max_workers=max_workers))
+
+
+def iter_bulk_organization_results(
     linkedin_ids,
     api_key=None,
     config=None,
     wait_time=SECONDS_BETWEEN_REQUESTS,
     max_iterations=MAX_N_TIMES_PROCESSING,
+    max_workers=MAX_DOWNLOAD_WORKERS,
 ):
+    """Same as `get_bulk_organization_results` but yields the companies as their
+    file parts are downloaded instead of collecting them in a list."""
     if not (config and config.get('linkedin', {}).get('coresignal_api_key') or api_key):
         raise Exception("Must provide api_key or config")
-    
+
     if not api_key:
         api_key = config['coresignal_api_key']
 
     request_id = make_bulk_request_company(linkedin_ids, api_key)
     if not request_id:
-        return []
+        return
     filepart_names = get_processed_filenames(
         request_id,
         api_key,
@@ -127,9 +240,26 @@ def get_bulk_organization_results(
         max_iterations=max_iterations
     )
     if not filepart_names:
-        return []
-    results = retrieve_bulk_results(request_id, filepart_names, api_key)
-    return results
+        return
+    yield from iter_bulk_results(request_id, filepart_names, api_key, max_workers=max_workers)
+
+
+def get_bulk_organization_results(
+    linkedin_ids,
+    api_key=None,
+    config=None,
+    wait_time=SECONDS_BETWEEN_REQUESTS,
+    max_iterations=MAX_N_TIMES_PROCESSING,
+):
+    return list(
+        iter_bulk_organization_results(
+            linkedin_ids,
+            api_key=api_key,
+            config=config,
+            wait_time=wait_time,
+            max_iterations=max_iterations,
+        )
+    )
 
 
 if __name__ == '__main__':
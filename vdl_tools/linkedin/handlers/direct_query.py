@@ -1,14 +1,42 @@
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
 import vdl_tools.shared_tools.tools.log_utils as log
 
 HEADERS = {
     'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/114.0.0.0 Safari/537.36'
 }
 
+# LinkedIn answers 999 when it thinks it is being scraped
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504, 999)
+
+
+def make_session(pool_size: int = 10, max_retries: int = 3, backoff_factor: float = 2):
+    """Creates a pooled session that backs off exponentially on rate limits and server errors.
+
+    The last response is returned instead of raising once the retries are exhausted,
+    so `get_organization` handles it like any other failed request.
+    """
+    retry = Retry(
+        total=max_retries,
+        status_forcelist=RETRY_STATUS_CODES,
+        backoff_factor=backoff_factor,
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session = requests.Session()
+    session.headers.update(HEADERS)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
 
-def get_organization(id: str):
+def get_organization(id: str, session: requests.Session = None):
     url = f'https://www.linkedin.com/company/{id}'
-    data = requests.get(url, headers=HEADERS, timeout=60)
+    session = session or requests
+    data = session.get(url, headers=HEADERS, timeout=60)
     if ('authwall' in data.url) or ('/login' in data.url):
         log.warn(f"Failed to send GET request for organization {id}. Redirected to {data.url}")
         return None
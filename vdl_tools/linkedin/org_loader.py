@@ -1,9 +1,14 @@
+from concurrent.futures import ProcessPoolExecutor as ProcessPool
+from concurrent.futures import ThreadPoolExecutor as ThreadPool
 import json
 import urllib
 
 from more_itertools import chunked
+import numpy as np
+import orjson
 import pandas as pd
 from vdl_tools.scrape_enrich.scraper.scrape_websites import extract_website_name
+from vdl_tools.shared_tools.database_cache.bulk_upsert import bulk_upsert
 from vdl_tools.shared_tools.database_cache.database_models.linkedin_orgs import LinkedInOrganization
 from vdl_tools.shared_tools.database_cache.database_utils import get_session
 from vdl_tools.shared_tools.tools.logger import logger as log
@@ -12,7 +17,8 @@ from vdl_tools.shared_tools.tools.text_similarity import similar, jaccard_simila
 from vdl_tools.linkedin.cache import LinkedInCache, LinkedInRawDataCache
 from vdl_tools.linkedin.utils.linkedin_url import extract_linkedin_id
 import vdl_tools.linkedin.handlers.base_handler as bh
-from vdl_tools.linkedin.handlers.coresignal_bulk import get_bulk_organization_results
+import vdl_tools.linkedin.handlers.direct_query as dq
+from vdl_tools.linkedin.handlers.coresignal_bulk import iter_bulk_organization_results
 import vdl_tools.linkedin.processors.coresignal_processor as csp
 from vdl_tools.linkedin.handlers.coresignal_query import (
     get_company,
@@ -32,6 +38,13 @@ log.setLevel(logging.INFO)
 SCRAPING_DATASOURCE = "linkedin_scraping"
 CORESIGNAL_DATASOURCE = "coresignal"
 
+# Number of LinkedIn ids sent in each Coresignal bulk request
+BULK_REQUEST_SIZE = 200
+# Number of bulk results written per commit as they stream in
+N_PER_BULK_COMMIT = 500
+# Number of concurrent requests when scraping the LinkedIn pages directly
+HTML_MAX_WORKERS = 5
+
 
 
 def get_org_cache_item(li_id: str, cache: LinkedInCache, raw_cache: LinkedInRawDataCache):
@@ -191,6 +204,35 @@ def process_multi_source_result(result):
     return processed_result_dict
 
 
+def _iter_bulk_processed_results(bulk_results, linkedin_ids_to_urls):
+    """Yields `(original_sent_url, processed_result_dict)` for the bulk results
+    that can be matched to one of the urls we sent."""
+    for result in bulk_results:
+        original_sent_url = None
+        # now we only have the coresignal processed result--any of these could be what we sent
+        # Try each to see if we sent it and if we did, select that url
+        potential_ids = [
+            result['canonical_shorthand_name'],
+            result["company_shorthand_name"],
+            result['source_id']
+        ]
+        for potential_id in potential_ids:
+            original_sent_url = linkedin_ids_to_urls.get(str(potential_id))
+            if not original_sent_url:
+                # Sometimes the linkedin_id is url encoded
+                original_sent_url = linkedin_ids_to_urls.get(urllib.parse.unquote(str(potential_id)))
+            if original_sent_url:
+                break
+        if not original_sent_url:
+            log.warning("No originally sent url found for %s", result["company_shorthand_name"])
+            continue
+
+        processed_result_dict = process_result(result)
+        processed_result_dict['original_id'] = original_sent_url
+        processed_result_dict['linkedin_id'] = extract_linkedin_id(original_sent_url)
+        yield original_sent_url, processed_result_dict
+
+
 def scrape_organizations_psql(
     urls: pd.Series,
     session,
@@ -199,6 +241,10 @@ def scrape_organizations_psql(
     n_per_commit: int = 10,
     max_errors=MAX_ERRORS,
     include_raw_html: bool = False,
+    bulk_request_size: int = BULK_REQUEST_SIZE,
+    n_per_bulk_commit: int = N_PER_BULK_COMMIT,
+    html_max_workers: int = HTML_MAX_WORKERS,
+    parse_max_workers: int = None,
 ) -> pd.DataFrame:
 
     log.info("Received %s LinkedIn urls for scraping", len(urls))
@@ -243,110 +289,125 @@ def scrape_organizations_psql(
     # Try getting bulk results here
 
     if linkedin_ids:
-        found_in_bulk_results = []
+        found_in_bulk_results = set()
+        result_columns = [col.key for col in KEY_COLUMNS]
 
         # Need to map the returned results to the original urls we are sent.
         # The returned results don't have a concept of that, so need to do something....
         linkedin_ids_to_urls = {linkedin_id: original_url for original_url, linkedin_id in urls_ids}
 
-        for chunk in chunked(linkedin_ids, 200):
-            chunk_bulk_results = get_bulk_organization_results(
+        for chunk in chunked(linkedin_ids, bulk_request_size):
+            chunk_bulk_results = iter_bulk_organization_results(
                 linkedin_ids=chunk,
                 api_key=api_key,
             )
-
-            chunk_processed_results = []
-            for result in chunk_bulk_results:
-                original_sent_url = None
-                # now we only have the coresignal processed result--any of these could be what we sent
-                # Try each to see if we sent it and if we did, select that url
-                potential_ids = [
-                    result['canonical_shorthand_name'],
-                    result["company_shorthand_name"],
-                    result['source_id']
-                ]
-                for potential_id in potential_ids:
-                    original_sent_url = linkedin_ids_to_urls.get(str(potential_id))
-                    if not original_sent_url:
-                        # Sometimes the linkedin_id is url encoded
-                        original_sent_url = linkedin_ids_to_urls.get(urllib.parse.unquote(str(potential_id)))
-                    if original_sent_url:
-                        break
-                if not original_sent_url:
-                    log.warning("No originally sent url found for %s", result["company_shorthand_name"])
-                    continue
-
-                processed_result_dict = process_result(result)
-                processed_result_dict['original_id'] = original_sent_url
-                processed_result_dict['linkedin_id'] = extract_linkedin_id(original_sent_url)
-
-                chunk_processed_results.append(original_sent_url)
-
-                sql_obj = LinkedInOrganization(**processed_result_dict)
-                session.merge(sql_obj)
-                res.append(sql_obj.to_dict())
-
-            log.info("Committing %s companies from bulk retrieval", len(chunk_processed_results))
-            found_in_bulk_results.extend(chunk_processed_results)
-            session.commit()
+            processed_results = _iter_bulk_processed_results(chunk_bulk_results, linkedin_ids_to_urls)
+
+            # Results are written as they stream in from the file parts, only the
+            # returned columns are kept so the raw results don't accumulate
+            for commit_chunk in chunked(processed_results, n_per_bulk_commit):
+                chunk_processed_results, chunk_rows = zip(*commit_chunk)
+                log.info("Committing %s companies from bulk retrieval", len(chunk_processed_results))
+                bulk_upsert(session, LinkedInOrganization, chunk_rows, return_rows=False)
+                res.extend({col: row.get(col) for col in result_columns} for row in chunk_rows)
+                found_in_bulk_results.update(chunk_processed_results)
+                session.commit()
             log.info("Got %s of %s bulk results", len(found_in_bulk_results), len(linkedin_ids))
 
         unfound_rows = [x for x in unfound_rows if x[0] not in found_in_bulk_results]
 
-    commit_group = []
-    idx = 0
-    len_unfound = len(unfound_rows)
-    log.info("%s unfound through Coresignal, using HTML processing", len_unfound)
-    for url, linkedin_id in unfound_rows:
-        idx = idx + 1
-        log.warn(f'({idx} / {len_unfound}) Processing {url}')
-        try:
-            data = bh.load_organization_no_cache(linkedin_id)
-            if data:
-                result = process_org_data(linkedin_id, 'html', data)
-                result['original_id'] = url
-                result['hq_location'] = result.pop('hq location')
-
-                result['linkedin_id'] = linkedin_id
-                result['raw_html'] = data
-                result['num_errors'] = 0
-                result["datasource"] = SCRAPING_DATASOURCE
-            else:
-                result = {
-                    'linkedin_id': linkedin_id,
-                    'original_id': url,
-                    'num_errors': 1,
-                }
-
-            commit_group.append(result)
-        except KeyboardInterrupt:
-            log.warn("Received KeyboardInterrupt, returning the currently scraped data...")
-            break
-        except Exception as ex:
-            log.warn(f'Error processing website {url}: {ex}')
-
-        if len(commit_group) % n_per_commit == 0:
-            for row in commit_group:
-                if row['num_errors']:
-                    row['num_errors'] += found_keys_to_errors.get(row['linkedin_id'], 0)
-                sql_obj = LinkedInOrganization(**row)
-                session.merge(sql_obj)
-                res.append(sql_obj.to_dict())
-            session.commit()
-            commit_group = []
-
-    # Final one
-    for row in commit_group:
-        if row['num_errors']:
-            row['num_errors'] += found_keys_to_errors.get(row['linkedin_id'], 0)
-        webpage_obj = sql_obj = LinkedInOrganization(**row)
-        session.merge(webpage_obj)
-        res.append(webpage_obj.to_dict())
-    session.commit()
+    log.info("%s unfound through Coresignal, using HTML processing", len(unfound_rows))
+    res.extend(
+        _scrape_organizations_html(
+            unfound_rows,
+            session,
+            n_per_commit=n_per_commit,
+            max_workers=html_max_workers,
+            parse_max_workers=parse_max_workers,
+        )
+    )
 
     return pd.DataFrame(res)
 
 
+def _process_org_html(url_id_html):
+    """Parses a scraped organization page. Runs in a worker process."""
+    url, linkedin_id, data = url_id_html
+    try:
+        result = process_org_data(linkedin_id, 'html', data)
+    except Exception as ex:
+        log.warn(f'Error processing website {url}: {ex}')
+        return None
+
+    result['original_id'] = url
+    result['hq_location'] = result.pop('hq location')
+
+    result['linkedin_id'] = linkedin_id
+    result['raw_html'] = data
+    result['num_errors'] = 0
+    result["datasource"] = SCRAPING_DATASOURCE
+    return result
+
+
+def _scrape_organizations_html(
+    urls_ids: list[tuple[str, str]],
+    session,
+    n_per_commit: int = 10,
+    max_workers: int = HTML_MAX_WORKERS,
+    parse_max_workers: int = None,
+) -> list[dict]:
+    """Scrapes the LinkedIn pages of the organizations directly.
+
+    Pages are fetched by `max_workers` threads sharing a pooled session that backs off
+    on rate limits, and parsed in a process pool. Each group of `n_per_commit` parsed
+    organizations is upserted and committed, the ids that could not be loaded
+    are upserted as errors all at once at the end.
+    """
+    res = []
+    error_rows = []
+    len_unfound = len(urls_ids)
+    n_processed = 0
+    http_session = dq.make_session(pool_size=max_workers)
+
+    def _load_html(url_id):
+        url, linkedin_id = url_id
+        return url, linkedin_id, bh.load_organization_no_cache(linkedin_id, session=http_session)
+
+    with (
+        http_session,
+        ThreadPool(max_workers=max_workers) as executor,
+        ProcessPool(max_workers=parse_max_workers) as parse_executor,
+    ):
+        for chunk in chunked(urls_ids, n_per_commit):
+            try:
+                loaded = list(executor.map(_load_html, chunk))
+                to_parse = [x for x in loaded if x[2]]
+                error_rows.extend(
+                    {
+                        'linkedin_id': linkedin_id,
+                        'original_id': url,
+                        'num_errors': 1,
+                    }
+                    for url, linkedin_id, data in loaded if not data
+                )
+
+                commit_group = [x for x in parse_executor.map(_process_org_html, to_parse) if x]
+                # num_errors are added to the stored count by the upsert
+                res.extend(bulk_upsert(session, LinkedInOrganization, commit_group))
+                session.commit()
+            except KeyboardInterrupt:
+                log.warn("Received KeyboardInterrupt, returning the currently scraped data...")
+                break
+
+            n_processed += len(chunk)
+            log.info("Processed %s / %s organizations through HTML", n_processed, len_unfound)
+
+    log.info("Storing %s organizations that could not be loaded", len(error_rows))
+    res.extend(bulk_upsert(session, LinkedInOrganization, error_rows))
+    session.commit()
+    return res
+
+
 def get_organizations_by_coresignal_id(
     coresignal_ids: list[int],
     session,
@@ -403,6 +464,7 @@ def get_organizations_by_coresignal_id(
             process_function = process_multi_source_result
 
         for chunk in chunked(unfound_ids, n_per_commit):
+            chunk_rows = []
             for coresignal_id in chunk:
                 process_function = process_result
 
@@ -428,11 +490,9 @@ def get_organizations_by_coresignal_id(
                         continue
 
                 processed_result_dict = process_function(result)
-
-                sql_obj = LinkedInOrganization(**processed_result_dict)
-                session.merge(sql_obj)
-                res.append(sql_obj.to_dict())
+                chunk_rows.append(processed_result_dict)
                 found_results.append(result)
+            res.extend(bulk_upsert(session, LinkedInOrganization, chunk_rows))
             session.commit()
 
     return pd.DataFrame(res)
@@ -538,30 +598,83 @@ def dedupe_group(group):
     return chosen_id
 
 
-def dedupe_df(df, on_key):
-    duplicate_mask = df.duplicated(subset=on_key, keep=False)
-    non_dupes = df[~duplicate_mask]
-    dupes = df[duplicate_mask].copy()
+DEDUPE_FEATURES = {
+    'num_followers': ('followers', 0),
+    'num_employees': ('employees_count', 0),
+    'last_response_code': ('last_response_code', None),
+}
+
+
+def _get_dedupe_features(df):
+    """Returns the columns used to pick between duplicates.
+
+    Uses the columns already in `df` when they are there, otherwise parses `raw_html`
+    once, only keeping the fields that are needed.
+    """
+    features = pd.DataFrame(index=df.index)
+    missing = [x for x in DEDUPE_FEATURES if x not in df.columns]
+    for column in DEDUPE_FEATURES:
+        if column not in missing:
+            features[column] = df[column]
 
-    dupes['raw_html'] = dupes['raw_html'].apply(json.loads)
+    if missing:
+        parsed = [orjson.loads(x) for x in df['raw_html']]
+        for column in missing:
+            key, default = DEDUPE_FEATURES[column]
+            features[column] = [x.get(key, default) for x in parsed]
 
-    dupes['num_followers'] = dupes['raw_html'].apply(lambda x: x.get('followers', 0))
-    dupes['num_employees'] = dupes['raw_html'].apply(lambda x: x.get('employees_count', 0))
-    dupes['last_updated'] = dupes['raw_html'].apply(lambda x: x.get('last_updated', None))
-    dupes['last_response_code'] = dupes['raw_html'].apply(lambda x: x.get('last_response_code', None))
+    for column in ['num_followers', 'num_employees']:
+        features[column] = pd.to_numeric(features[column], errors='coerce').fillna(0)
+    return features
 
-    dupes = dupes[dupes['last_response_code'] == 200]
 
-    grouped_dupes = dupes.groupby(on_key)
+def dedupe_df(df, on_key):
+    """Keeps one organization for each value of `on_key`.
 
-    chosen_rows = []
+    Among duplicates with a 200 `last_response_code`, the organization that has both the
+    most followers and the most employees wins. If no single organization has the most
+    votes, the one with the most followers wins. Same choice as `dedupe_group`, but made
+    for all the groups at once.
+    """
+    duplicate_mask = df.duplicated(subset=on_key, keep=False)
+    non_dupes = df[~duplicate_mask]
+    dupes = df[duplicate_mask]
+    dupes = dupes[dupes[on_key].notnull()]
+    if dupes.empty:
+        return non_dupes
+
+    features = _get_dedupe_features(dupes)
+    features[on_key] = dupes[on_key]
+    features['coresignal_id'] = dupes['coresignal_id']
+    features = features[features['last_response_code'] == 200]
+
+    grouped = features.groupby(on_key)
+    is_max_followers = features['num_followers'] == grouped['num_followers'].transform('max')
+    is_max_employees = features['num_employees'] == grouped['num_employees'].transform('max')
+    features['dupe_vote'] = is_max_followers.astype(int) + is_max_employees.astype(int)
+
+    is_max_dupe_vote = features['dupe_vote'] == features.groupby(on_key)['dupe_vote'].transform('max')
+    n_max_dupe_vote = is_max_dupe_vote.groupby(features[on_key]).transform('sum')
+    # A unique best vote wins, otherwise the most followers win
+    features['dedupe_score'] = features['num_followers'].where(n_max_dupe_vote != 1, features['dupe_vote'])
+
+    chosen_ids = (
+        features
+        .sort_values([on_key, 'dedupe_score'], ascending=[True, False], kind='mergesort')
+        .groupby(on_key, sort=False)
+        .head(1)
+        ['coresignal_id']
+    )
 
-    for _, group in grouped_dupes:
-        chosen_id = dedupe_group(group)
-        chosen_row = df[df['coresignal_id'] == chosen_id]
-        chosen_rows.append(chosen_row)
-    non_dupes = pd.concat([non_dupes, *chosen_rows])
-    return non_dupes
+    # Take every row of `df` with a chosen id, keeping the index
+    id_positions = df.groupby('coresignal_id', sort=False).indices
+    chosen_positions = [
+        id_positions[x] for x in chosen_ids if x in id_positions
+    ]
+    if not chosen_positions:
+        return non_dupes
+    chosen_rows = df.iloc[np.concatenate(chosen_positions)]
+    return pd.concat([non_dupes, chosen_rows])
 
 
 def get_organizations_by_search(
@@ -2,6 +2,7 @@ import json
 
 from more_itertools import chunked
 import pandas as pd
+from vdl_tools.shared_tools.database_cache.bulk_upsert import bulk_upsert
 from vdl_tools.shared_tools.database_cache.database_models.linkedin_people import LinkedInPerson
 from vdl_tools.shared_tools.tools.logger import logger
 
@@ -67,6 +68,7 @@ def get_people_profile(
     logger.info("Found %s previously queried results in our cache", len(found_rows))
     for chunk in chunked(unfound_rows, n_per_commit):
         chunk_processed_results = []
+        chunk_rows = []
         for url, linkedin_id in chunk:
             result = cs_query.get_profile(linkedin_id, api_key)
 
@@ -95,10 +97,11 @@ def get_people_profile(
                 processed_profile['original_id'] = url
                 res.append(processed_profile)
 
-            sql_obj = LinkedInPerson(**result_clean)
-            session.merge(sql_obj)
+            chunk_rows.append(result_clean)
 
         logger.info("Committing %s pepole", len(chunk_processed_results))
+        # num_errors are added to the stored count by the upsert
+        bulk_upsert(session, LinkedInPerson, chunk_rows, return_rows=False)
         newly_found.extend(chunk_processed_results)
         session.commit()
         logger.info("Got %s of %s results", len(newly_found), len(unfound_rows))
@@ -1,10 +1,123 @@
-from typing import Any, Dict
+from typing import Any, Dict, TypedDict
 import pandas as pd
 import numpy as np
 from .attr_types import ATTR_TYPE, RENDER_TYPE
 
 
-def calculate_attr_types(df: pd.DataFrame) -> Dict[str, ATTR_TYPE]:
+class ColumnProfile(TypedDict):
+    """
+    Summary of a column, computed once per data frame by `profile_frame` and
+    shared by the attribute and layout calculations.
+    """
+    attrType: ATTR_TYPE
+    renderType: RENDER_TYPE
+    # number of empty values
+    missing: int
+    fillRate: float
+    # number of distinct non-empty values, None if the values are not hashable
+    unique: int | None
+    # number of distinct "|" separated values of string columns
+    tags: int | None
+    # for number columns
+    min: Any
+    max: Any
+
+
+def _is_number_column(column: pd.Series) -> bool:
+    return column.dtype == np.number or column.dtype == np.int64
+
+
+def _distinct_strings(column: pd.Series) -> pd.Series:
+    # the `str` of the values is what the types are inferred from
+    return pd.Series(pd.unique(column.astype(str)), dtype=object)
+
+
+def _count_tags(distinct_str: pd.Series) -> int:
+    """Number of distinct "|" separated values."""
+    if not distinct_str.str.contains("|", regex=False).any():
+        return len(distinct_str)
+    return int(distinct_str.str.split("|", regex=False).explode().nunique())
+
+
+def profile_column(column: pd.Series) -> ColumnProfile:
+    """
+    Computes the attribute type, render type, cardinality, fill rate and range
+    of a column in a single pass over its distinct values.
+
+    Parameters
+    ----------
+    column: Series. The column to be analyzed.
+
+    Returns
+    -------
+    `ColumnProfile`: The summary of the column.
+    """
+    missing = int(column.isnull().sum())
+    profile: ColumnProfile = {
+        "attrType": "string",
+        "renderType": "text",
+        "missing": missing,
+        "fillRate": 1 - missing / len(column) if len(column) else 0.0,
+        "unique": None,
+        "tags": None,
+        "min": None,
+        "max": None,
+    }
+
+    if _is_number_column(column):
+        profile["min"] = column.min()
+        profile["max"] = column.max()
+        profile["unique"] = int(column.nunique())
+        profile["attrType"] = _detect_number_attr_type(profile["min"], profile["max"])
+        profile["renderType"] = _render_type(profile["attrType"], None)
+        return profile
+
+    try:
+        profile["unique"] = int(column.nunique())
+    except TypeError:
+        # lists are not hashable
+        pass
+
+    distinct_str = _distinct_strings(column)
+    if distinct_str.str.contains("|", regex=False).any():
+        profile["attrType"] = "liststring"
+    profile["tags"] = _count_tags(distinct_str)
+    profile["renderType"] = _render_type(profile["attrType"], profile["tags"])
+    return profile
+
+
+def profile_frame(df: pd.DataFrame) -> Dict[str, ColumnProfile]:
+    """
+    Profiles all the columns of the data frame, see `profile_column`.
+
+    Parameters
+    ----------
+    df: DataFrame. The data frame to be analyzed.
+
+    Returns
+    -------
+    `Dict[str, ColumnProfile]`: A dictionary with the column names as keys and
+    the column profiles as values.
+    """
+    return {column: profile_column(df[column]) for column in df.columns.values}
+
+
+def get_column_profile(
+    df: pd.DataFrame, column: str, profile: Dict[str, ColumnProfile] = None
+) -> ColumnProfile:
+    """
+    Returns the profile of the column, profiling it from the data frame when it
+    is missing from `profile`, e.g. when the column was added after the
+    profile was computed.
+    """
+    if profile is not None and column in profile:
+        return profile[column]
+    return profile_column(df[column])
+
+
+def calculate_attr_types(
+    df: pd.DataFrame, profile: Dict[str, ColumnProfile] = None
+) -> Dict[str, ATTR_TYPE]:
     """
     Calculates the attribute types of the columns of the given data frame.
     Based on the data type of the column, the attribute type is determined. If
@@ -28,33 +141,30 @@ def calculate_attr_types(df: pd.DataFrame) -> Dict[str, ATTR_TYPE]:
     ----------
     df: DataFrame. The data frame to be analyzed.
 
+    profile: Dict[str, ColumnProfile], optional. The profile of the data frame,
+    the columns missing from it are profiled from the data frame.
+
     Returns
     -------
     `Dict[str, ATTR_TYPE]`: A dictionary with the column names as keys and the
     attribute types as values.
     """
-    attr_types = dict()
-    # for each column, determine the type of attribute it is
-    for column in df.columns.values:
-        if df[column].dtype == np.number or df[column].dtype == np.int64:
-            attr_types[column] = _detect_number_column(df, column)
-        elif df[column].apply(lambda x: "|" in str(x)).any():
-            attr_types[column] = "liststring"
-        else:
-            attr_types[column] = "string"
-
-    return attr_types
+    return {
+        column: get_column_profile(df, column, profile)["attrType"]
+        for column in df.columns.values
+    }
 
 
 def _detect_number_column(df: pd.DataFrame, column: str) -> ATTR_TYPE:
-    if df[column].min() >= 1800 and df[column].max() <= 2100:
+    return _detect_number_attr_type(df[column].min(), df[column].max())
+
+
+def _detect_number_attr_type(min: Any, max: Any) -> ATTR_TYPE:
+    if min >= 1800 and max <= 2100:
         return "year"
-    if df[column].min() >= 1000000000 and df[column].max() <= 9999999999:
+    if min >= 1000000000 and max <= 9999999999:
         return "timestamp"
 
-    min = df[column].min()
-    max = df[column].max()
-
     if max - min == 1:
         return "float"
 
@@ -65,7 +175,9 @@ def _detect_number_column(df: pd.DataFrame, column: str) -> ATTR_TYPE:
 
 
 def calculate_render_type(
-    df: pd.DataFrame, attr_types: Dict[str, ATTR_TYPE]
+    df: pd.DataFrame,
+    attr_types: Dict[str, ATTR_TYPE],
+    profile: Dict[str, ColumnProfile] = None,
 ) -> Dict[str, RENDER_TYPE]:
     """
     Calculates the render types of the columns of the given data frame. Based
@@ -99,6 +211,9 @@ def calculate_render_type(
     ATTR_TYPE]. A dictionary with the column names as keys and the attribute
     types as values.
 
+    profile: Dict[str, ColumnProfile], optional. The profile of the data frame,
+    the columns missing from it are profiled from the data frame.
+
     Returns
     -------
     `Dict[str, RENDER_TYPE]`: A dictionary with the column names as keys and
@@ -107,34 +222,37 @@ def calculate_render_type(
     render_types = dict()
     # for each column, determine the type of attribute it is
     for column in df.columns.values:
-        if (
-            attr_types[column] == "integer"
-            or attr_types[column] == "float"
-            or attr_types[column] == "year"
-        ):
-            render_types[column] = "histogram"
-        elif (
-            attr_types[column] == "liststring"
-            or attr_types[column] == "string"
-        ):
-            render_types[column] = _detect_string_render_type(df, column)
-        else:
-            render_types[column] = "text"
+        tags = None
+        if attr_types[column] == "liststring" or attr_types[column] == "string":
+            if profile is not None and column in profile:
+                tags = profile[column]["tags"]
+            if tags is None:
+                tags = _count_tags(_distinct_strings(df[column]))
+        render_types[column] = _render_type(attr_types[column], tags)
 
     return render_types
 
 
-def _detect_string_render_type(df: pd.DataFrame, column: str) -> RENDER_TYPE:
-    str_set = set()
-    df[column].apply(lambda x: str_set.update(str(x).split("|")))
+def _render_type(attr_type: ATTR_TYPE, tags: int | None) -> RENDER_TYPE:
+    if (
+        attr_type == "integer"
+        or attr_type == "float"
+        or attr_type == "year"
+    ):
+        return "histogram"
+    elif attr_type == "liststring" or attr_type == "string":
+        return _detect_string_render_type(tags)
+    return "text"
+
 
-    if len(str_set) > 100:
+def _detect_string_render_type(n_tags: int) -> RENDER_TYPE:
+    if n_tags > 100:
         return "tag-cloud"
-    elif len(str_set) > 80:
+    elif n_tags > 80:
         return "tag-cloud_3"
-    elif len(str_set) > 60:
+    elif n_tags > 60:
         return "tag-cloud_2"
-    elif len(str_set) > 40:  # typical string length rather than number of tags
+    elif n_tags > 40:  # typical string length rather than number of tags
         return "wide-tag-cloud"
     else:
         return "horizontal-bars"
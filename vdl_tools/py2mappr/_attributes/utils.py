@@ -1,20 +1,33 @@
-from typing import List, Tuple, Union
+from typing import Dict, List, Tuple, Union
 import pandas as pd
 import numpy as np
 import warnings
+from .calculate import ColumnProfile, get_column_profile
 
 images = ["image", "picture", "photo", "img", "img_url", "imgurl"]
 labels = ["originallabel", "name", "title", "label"]
 
 
-def _find_most_filled_column(df: pd.DataFrame, column_names: List[str]) -> str:
-    non_empty = df[column_names]
-    non_empty = non_empty.isnull().sum()
+def _find_most_filled_column(
+    df: pd.DataFrame,
+    column_names: List[str],
+    profile: Dict[str, ColumnProfile] = None,
+) -> str:
+    if profile is not None:
+        non_empty = pd.Series(
+            [get_column_profile(df, col, profile)["missing"] for col in column_names],
+            index=column_names,
+        )
+    else:
+        non_empty = df[column_names]
+        non_empty = non_empty.isnull().sum()
 
     return non_empty.sort_values(ascending=True).index[0]
 
 
-def find_node_image_attr(df: pd.DataFrame) -> str:
+def find_node_image_attr(
+    df: pd.DataFrame, profile: Dict[str, ColumnProfile] = None
+) -> str:
     """
     Finds the most likely column to be used as the image attribute for nodes.
     The column is determined by the following criteria:
@@ -28,6 +41,9 @@ def find_node_image_attr(df: pd.DataFrame) -> str:
     ----------
     df: DataFrame. The data frame to be analyzed.
 
+    profile: Dict[str, ColumnProfile], optional. The profile of the data frame,
+    used instead of scanning the columns again.
+
     Returns
     -------
     `str`: The name of the column that is most likely to be used as the image
@@ -41,10 +57,12 @@ def find_node_image_attr(df: pd.DataFrame) -> str:
     if len(match_columns) == 0:
         return None
 
-    return _find_most_filled_column(df, match_columns)
+    return _find_most_filled_column(df, match_columns, profile)
 
 
-def find_node_label_attr(df: pd.DataFrame) -> str:
+def find_node_label_attr(
+    df: pd.DataFrame, profile: Dict[str, ColumnProfile] = None
+) -> str:
     """
     Finds the most likely column to be used as the label attribute for nodes.
     The column is determined by the following criteria:
@@ -58,6 +76,9 @@ def find_node_label_attr(df: pd.DataFrame) -> str:
     ----------
     df: DataFrame. The data frame to be analyzed.
 
+    profile: Dict[str, ColumnProfile], optional. The profile of the data frame,
+    used instead of scanning the columns again.
+
     Returns
     -------
     `str`: The name of the column that is most likely to be used as the label
@@ -70,10 +91,14 @@ def find_node_label_attr(df: pd.DataFrame) -> str:
     if len(match_columns) == 0:
         return None
 
-    return _find_most_filled_column(df, match_columns)
+    return _find_most_filled_column(df, match_columns, profile)
 
 
-def find_node_size_attr(df: pd.DataFrame, exclude: List[str] = []) -> str:
+def find_node_size_attr(
+    df: pd.DataFrame,
+    exclude: List[str] = [],
+    profile: Dict[str, ColumnProfile] = None,
+) -> str:
     """
     Finds the most likely column to be used as the size attribute for nodes.
     The column is determined by the following criteria:
@@ -88,6 +113,9 @@ def find_node_size_attr(df: pd.DataFrame, exclude: List[str] = []) -> str:
 
     exclude: List[str]. A list of column names to exclude from the search.
 
+    profile: Dict[str, ColumnProfile], optional. The profile of the data frame,
+    used instead of scanning the columns again.
+
     Returns
     -------
     `str`: The name of the column that is most likely to be used as the size
@@ -102,10 +130,12 @@ def find_node_size_attr(df: pd.DataFrame, exclude: List[str] = []) -> str:
     if len(columns) == 0:
         return None
 
-    return _find_most_filled_column(df, columns)
+    return _find_most_filled_column(df, columns, profile)
 
 
-def find_node_color_attr(df: pd.DataFrame) -> str:
+def find_node_color_attr(
+    df: pd.DataFrame, profile: Dict[str, ColumnProfile] = None
+) -> str:
     """
     Finds the most likely column to be used as the color attribute for nodes.
     The column is determined by the following criteria:
@@ -118,26 +148,35 @@ def find_node_color_attr(df: pd.DataFrame) -> str:
     ----------
     df: DataFrame. The data frame to be analyzed.
 
+    profile: Dict[str, ColumnProfile], optional. The profile of the data frame,
+    used instead of scanning the columns again.
+
     Returns
     -------
     `str`: The name of the column that is most likely to be used as the color
     attribute for nodes.
     """
-    # columns that contain lists cause nunique() to fail
-    cols_nunique = []
-    for each_col in df.columns:
-        try:
-            df[each_col].nunique()
-            cols_nunique.append(each_col)
-        except TypeError:
-            continue
-    unique_counts = df[cols_nunique].nunique()
+    if profile is not None:
+        unique_counts = pd.Series(
+            {col: get_column_profile(df, col, profile)["unique"] for col in df.columns},
+            dtype=object,
+        ).dropna().astype(int)
+    else:
+        # columns that contain lists cause nunique() to fail
+        cols_nunique = []
+        for each_col in df.columns:
+            try:
+                df[each_col].nunique()
+                cols_nunique.append(each_col)
+            except TypeError:
+                continue
+        unique_counts = df[cols_nunique].nunique()
     lowest_distinct = unique_counts.min()
     lowest_distinct_columns = unique_counts[
         unique_counts == lowest_distinct
     ].index.tolist()
 
-    return _find_most_filled_column(df, lowest_distinct_columns)
+    return _find_most_filled_column(df, lowest_distinct_columns, profile)
 
 
 def find_node_xy_attr(
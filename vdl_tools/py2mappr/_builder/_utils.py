@@ -1,16 +1,36 @@
 from typing import Any, List
+import json
 import markdown
-from markdown3_newtab import NewTabExtension
+import numpy as np
+
+
+class NpEncoder(json.JSONEncoder):
+    """
+    Special json encoder for numpy types
+    """
+
+    def default(self, obj):
+        if isinstance(obj, np.integer):
+            return int(obj)
+        if isinstance(obj, np.floating):
+            return float(obj)
+        if isinstance(obj, np.ndarray):
+            return obj.tolist()
+        return super(NpEncoder, self).default(obj)
+
+
+MD_EXTENSIONS = ["fenced_code", "markdown3_newtab"]
+# tab_length is set to 80 to prevent the markdown parser from
+# converting indented text to code blocks
+MD_TAB_LENGTH = 80
 
 
 def md_to_html(md: str) -> str:
     if md is None:
         return ""
 
-    # tab_length is set to 80 to prevent the markdown parser from
-    # converting indented text to code blocks
     return markdown.markdown(
-        md, extensions=["fenced_code", NewTabExtension()], tab_length=80
+        md, extensions=MD_EXTENSIONS, tab_length=MD_TAB_LENGTH
     )
 
 
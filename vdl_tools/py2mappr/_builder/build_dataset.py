@@ -1,10 +1,11 @@
 from collections import defaultdict
 from pathlib import Path
 import pandas as pd
-from typing import Any, List, Dict, TypedDict
+from typing import Any, Callable, List, Dict, TypedDict
 
 from vdl_tools.py2mappr._core.config import AttributeConfig, WeightedAttributeConfig, default_attr_config
 from vdl_tools.py2mappr._builder._utils import md_to_html
+from vdl_tools.py2mappr._builder.render_markdown import MarkdownRenderer
 import copy
 
 from vdl_tools.py2mappr._db.geoquery import GeoItem, query_latlon
@@ -75,6 +76,53 @@ def build_attrDescriptors(
     return attrDescriptors
 
 
+def attr_value(val: Any, attr_type: str) -> Any:
+    """
+    Validate a datapoint attribute value based on the attribute type.
+
+    Parameters
+    ----------
+    val : Any. The attribute value.
+
+    attr_type : str. The attribute type.
+
+    Returns
+    -------
+    Any. The value to be written, missing values are replaced by "".
+    """
+    if attr_type == "liststring":
+        # check if value is string type
+        if isinstance(val, str):
+            # put string into a list
+            return [val]
+        elif not isinstance(val, list):
+            return ""
+        return val
+    elif (
+        attr_type == "float"
+        or attr_type == "integer"
+        or attr_type == "year"
+    ):
+        return val if not pd.isna(val) else ""
+    return val if type(val) is list or not pd.isna(val) else ""
+
+
+def renders_markdown(
+    key: str,
+    dpAttribTypes: Dict[str, str],
+    dpRenderTypes: Dict[str, str],
+    exclude_md_attrs: List[str] = [],
+) -> bool:
+    """
+    Whether the values of the attribute are converted from markdown to html.
+    """
+    return (
+        dpAttribTypes[key] == "string"
+        and dpRenderTypes[key] == "text"
+        and key not in exclude_md_attrs
+    )
+
+
 def __build_datapoint(
     dp: pd.Series,
     dpAttribTypes: Dict[str, str],
@@ -82,33 +130,16 @@ def __build_datapoint(
     exclude_md_attrs: List[str] = [],
     weighted_attributes: List[WeightedAttributeConfig] = [],
     geodata: dict[str, list] | None = None,
+    render_md: Callable[[str], str] = md_to_html,
 ) -> Datapoint:
     attrs: Dict[str, Any] = dict(dp)
 
     # validate the attr vals based on type.
     for key, val in attrs.items():
-        if dpAttribTypes[key] == "liststring":
-            # check if value is string type
-            if isinstance(val, str):
-                # put string into a list
-                attrs[key] = [val]
-            elif not isinstance(val, list):
-                attrs[key] = ""
-        elif (
-            dpAttribTypes[key] == "float"
-            or dpAttribTypes[key] == "integer"
-            or dpAttribTypes[key] == "year"
-        ):
-            attrs[key] = val if not pd.isna(val) else ""
-        else:
-            attrs[key] = val if type(val) is list or not pd.isna(val) else ""
-
-        if (
-            dpAttribTypes[key] == "string"
-            and dpRenderTypes[key] == "text"
-            and key not in exclude_md_attrs
-        ):
-            attrs[key] = md_to_html(attrs[key])
+        attrs[key] = attr_value(val, dpAttribTypes[key])
+
+        if renders_markdown(key, dpAttribTypes, dpRenderTypes, exclude_md_attrs):
+            attrs[key] = render_md(attrs[key])
 
     # merge attrs with template
     datapoint_result = {
@@ -123,29 +154,24 @@ def __build_datapoint(
     return datapoint_result
 
 
-def build_datapoints(
+def build_geodata(
     df_datapoints: pd.DataFrame,
-    dpAttribTypes: Dict[str, str],
-    dpRenderTypes: Dict[str, str],
-    exclude_md_attrs: List[str] = [],
-    weighted_attributes: Dict[int, List[WeightedAttributeConfig]] = {},
     geodata_latlon: tuple[str, str] | None = None,
-) -> List[Dict[str, Any]]:
+) -> Dict[str, List[Dict[str, Any]]]:
     """
-    Build the datapoints for the dataset.
+    Query the geo areas the datapoints fall into.
 
     Parameters
     ----------
     df_datapoints : pd.DataFrame. The dataframe containing the datapoints.
 
-    dpAttribTypes : Dict[str, str]. The attribute types for the datapoints.
+    geodata_latlon : tuple[str, str], optional. Names of the latitude and
+    longitude attributes.
 
-    dpRenderTypes : Dict[str, str]. The render types for the datapoints.
     Returns
     -------
-    List[Dict[str, Any]] The datapoints for the dataset.
+    Dict[str, List[Dict[str, Any]]] The geo areas per datapoint id.
     """
-
     geodata = defaultdict(list)
     if geodata_latlon is not None:
         lat, lon = geodata_latlon
@@ -159,11 +185,83 @@ def build_datapoints(
                         'level': detail_level,
                         'polygon_id': node_item.osm_id
                     })
+    return geodata
+
+
+def prepare_markdown(
+    df_datapoints: pd.DataFrame,
+    dpAttribTypes: Dict[str, str],
+    dpRenderTypes: Dict[str, str],
+    exclude_md_attrs: List[str] = [],
+    md_renderer: MarkdownRenderer | None = None,
+) -> MarkdownRenderer:
+    """
+    Render the distinct values of all the markdown attributes at once.
+
+    Parameters
+    ----------
+    df_datapoints : pd.DataFrame. The dataframe containing the datapoints.
+
+    dpAttribTypes : Dict[str, str]. The attribute types for the datapoints.
+
+    dpRenderTypes : Dict[str, str]. The render types for the datapoints.
+
+    exclude_md_attrs : List[str], optional. Names of the attributes to be
+    excluded from markdown render.
+
+    md_renderer : MarkdownRenderer, optional. The renderer to prepare, by
+    default a new one without on-disk cache.
+
+    Returns
+    -------
+    MarkdownRenderer. The renderer with the values rendered.
+    """
+    md_renderer = md_renderer or MarkdownRenderer(cache_path=None)
+    for key in df_datapoints.columns:
+        if renders_markdown(key, dpAttribTypes, dpRenderTypes, exclude_md_attrs):
+            values = df_datapoints[key]
+            # lists and other unhashable values are rendered per datapoint
+            is_str = values.map(lambda x: isinstance(x, str))
+            md_renderer.prepare(values[is_str].unique())
+    return md_renderer
+
+
+def build_datapoints(
+    df_datapoints: pd.DataFrame,
+    dpAttribTypes: Dict[str, str],
+    dpRenderTypes: Dict[str, str],
+    exclude_md_attrs: List[str] = [],
+    weighted_attributes: Dict[int, List[WeightedAttributeConfig]] = {},
+    geodata_latlon: tuple[str, str] | None = None,
+    md_renderer: MarkdownRenderer | None = None,
+) -> List[Dict[str, Any]]:
+    """
+    Build the datapoints for the dataset.
+
+    Parameters
+    ----------
+    df_datapoints : pd.DataFrame. The dataframe containing the datapoints.
+
+    dpAttribTypes : Dict[str, str]. The attribute types for the datapoints.
+
+    dpRenderTypes : Dict[str, str]. The render types for the datapoints.
+
+    md_renderer : MarkdownRenderer, optional. Renderer for the markdown
+    attributes, by default one without on-disk cache.
+    Returns
+    -------
+    List[Dict[str, Any]] The datapoints for the dataset.
+    """
+
+    geodata = build_geodata(df_datapoints, geodata_latlon)
+    md_renderer = prepare_markdown(
+        df_datapoints, dpAttribTypes, dpRenderTypes, exclude_md_attrs, md_renderer
+    )
 
     datapoints = [
         __build_datapoint(dp, dpAttribTypes, dpRenderTypes, exclude_md_attrs,
                           weighted_attributes[dp["id"]] if dp["id"] in weighted_attributes else [],
-                          geodata)
+                          geodata, md_renderer)
         for _, dp in df_datapoints.iterrows()
     ]
 
@@ -1,4 +1,5 @@
-from typing import Any, List, Dict
+from typing import Any, List, Dict, Union
+import pandas as pd
 from vdl_tools.py2mappr._layout import Layout
 
 from vdl_tools.py2mappr._core.config import ProjectConfig
@@ -13,8 +14,8 @@ from ._utils import md_to_html
 def build_settings(
     snapshots: List[Layout] = [],
     playerSettings: ProjectConfig = {},
-    datapoints: List[Dict[str, Any]] = [],
-    links: List[Dict[str, Any]] = [],
+    datapoints: Union[List[Dict[str, Any]], pd.DataFrame] = [],
+    links: Union[List[Dict[str, Any]], pd.DataFrame] = [],
 ) -> Dict[str, Any]:
     """
     Builds the settings.json file for the project.
@@ -27,6 +28,13 @@ def build_settings(
     playerSettings: ProjectConfig, optional. The player settings to be added to
     the project. The default is empty dict.
 
+    datapoints: List[Dict[str, Any]] | pd.DataFrame, optional. The datapoints
+    to validate the snapshots against, or a boolean frame of the attribute
+    values that are missing when the data files were streamed.
+
+    links: List[Dict[str, Any]] | pd.DataFrame, optional. Same as `datapoints`
+    for the links.
+
     Returns
     -------
     Dict[str, Any]. The settings file data for the project.
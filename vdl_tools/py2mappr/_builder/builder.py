@@ -5,7 +5,6 @@ import shutil
 import json
 import os
 import pandas as pd
-import numpy as np
 from vdl_tools.py2mappr._core.config import AttributeConfig, WeightedAttributeConfig
 from vdl_tools.py2mappr._core.project import OpenmapprProject
 from vdl_tools.py2mappr._validation.validate_links import validate_source_target
@@ -18,22 +17,10 @@ from .build_network import (
     build_linkAttrDescriptors,
 )
 from .build_settings import build_settings
-from ._utils import flatten
-
-
-class NpEncoder(json.JSONEncoder):
-    """
-    Special json encoder for numpy types
-    """
-
-    def default(self, obj):
-        if isinstance(obj, np.integer):
-            return int(obj)
-        if isinstance(obj, np.floating):
-            return float(obj)
-        if isinstance(obj, np.ndarray):
-            return obj.tolist()
-        return super(NpEncoder, self).default(obj)
+from .render_markdown import MarkdownRenderer, RENDERER_VERSION
+from .fingerprint import BuildManifest, fingerprint, fingerprint_frame
+from . import stream_json
+from ._utils import flatten, NpEncoder
 
 
 def __noop_printer(*args, **kwargs):
@@ -70,6 +57,7 @@ def __write_dataset_file(
     exclude_md_attrs: List[str] = [],
     datapoint_weighted_attrs: List[WeightedAttributeConfig] = [],
     geodata_latlon: tuple[str, str] | None = None,
+    stream: bool = False,
 ):
     """
     Writes the dataset file `nodes.json` to the output directory
@@ -90,9 +78,32 @@ def __write_dataset_file(
     geodata_latlon: Tuple(str, str) , optional
         Names of attributes for Latitude and Longitude, if geolayout is present.
         Will be populated via geo database if passed.
+    stream : bool, optional
+        Whether to stream the file column by column with compact separators,
+        see `stream_json.write_dataset`. Returns a frame of missing attribute
+        values instead of the datapoints.
     """
     # collect datapoint attributes
     datapointAttribs = build_attrDescriptors(df_datapoints, datapointAttrs)
+    # markdown rendered by previous builds is kept in the working directory
+    md_renderer = MarkdownRenderer()
+
+    if stream:
+        with open(Path(out_data_dir) / "nodes.json", mode="w+") as f:
+            missing_attrs = stream_json.write_dataset(
+                f,
+                df_datapoints,
+                datapointAttribs,
+                exclude_md_attrs,
+                datapoint_weighted_attrs,
+                geodata_latlon,
+                md_renderer,
+            )
+        _debug_print(
+            f"\t- streamed {len(df_datapoints)} datapoints where attr={list(datapointAttrs.keys())}"
+        )
+        return missing_attrs
+
     datapointAttrTypes = {row["id"]: row["attrType"] for row in datapointAttribs}
     datapointRenderTypes = {row["id"]: row["renderType"] for row in datapointAttribs}
 
@@ -104,6 +115,7 @@ def __write_dataset_file(
         exclude_md_attrs,
         datapoint_weighted_attrs,
         geodata_latlon,
+        md_renderer,
     )
 
     _debug_print(
@@ -125,6 +137,7 @@ def __write_network_file(
     df_links: pd.DataFrame,
     linkAttrs: Dict[str, Any],
     out_data_dir: Path,
+    stream: bool = False,
 ):
     """
     Writes the network file `links.json` to the output directory
@@ -147,7 +160,28 @@ def __write_network_file(
 
     out_data_dir : Path
         The output directory to write the file to
+
+    stream : bool, optional
+        Whether to stream the file column by column with compact separators,
+        see `stream_json.write_network`. Returns a frame of missing attribute
+        values instead of the links.
     """
+    if stream:
+        with open(out_data_dir / "links.json", mode="w") as f:
+            missing_attrs = stream_json.write_network(
+                f,
+                df_datapoints,
+                datapointAttrs,
+                df_links,
+                linkAttrs,
+                build_nodeAttrDescriptors(),
+                build_linkAttrDescriptors(linkAttrs),
+            )
+        _debug_print(
+            f"\t- streamed {len(df_datapoints)} nodes and {len(df_links)} links"
+        )
+        return missing_attrs
+
     # collect nodes
     nodes = build_nodes(df_datapoints, datapointAttrs)
     _debug_print(
@@ -211,11 +245,23 @@ def __write_settings_file(
 
     out_data_dir : Path
         The output directory to write the file to
+
+    Returns
+    -------
+    bool
+        Whether the file was written, it is left untouched when its content
+        did not change
     """
     data = build_settings(snapshots, playerSettings, datapoints, links)
-    with open(out_data_dir / "settings.json", mode="w") as f:
-        json.dump(data, f, indent=4, cls=NpEncoder)
-    return data
+    content = json.dumps(data, indent=4, cls=NpEncoder)
+
+    # only touch the file if it changed, so it is not uploaded again
+    settings_path = out_data_dir / "settings.json"
+    if settings_path.exists() and settings_path.read_text() == content:
+        return False
+    with open(settings_path, mode="w") as f:
+        f.write(content)
+    return True
 
 
 def __add_analytics(index_path: str, gtag_id: str = "", gtm_id: str = ""):
@@ -247,7 +293,7 @@ def __add_analytics(index_path: str, gtag_id: str = "", gtm_id: str = ""):
         index_tmpl = index_tmpl.replace("<!-- #{gtag} -->", ga_template)
         f.write(index_tmpl)
 
-    _debug_print(f"\t- gtag added")
+    _debug_print("\t- gtag added")
 
     if not gtm_id:
         return
@@ -264,7 +310,7 @@ def __add_analytics(index_path: str, gtag_id: str = "", gtm_id: str = ""):
         index_tmpl = index_tmpl.replace("<!-- #{gtmtag} -->", gtm_template)
         f.write(index_tmpl)
 
-    _debug_print(f"\t- gtm tag added")
+    _debug_print("\t- gtm tag added")
 
 
 def __extract_sentence(text: str):
@@ -292,6 +338,35 @@ def __extract_sentence(text: str):
     return clear_text
 
 
+def __find_images(index_path: str) -> List[Path]:
+    """
+    Finds the images in the project folder of the index.html file
+    """
+    return [
+        *list(Path(index_path).parent.rglob("*.jpg")),
+        *list(Path(index_path).parent.rglob("*.jpeg")),
+        *list(Path(index_path).parent.rglob("*.png")),
+        *list(Path(index_path).parent.rglob("*.gif")),
+    ]
+
+
+def __template_contents() -> Dict[str, str]:
+    """
+    Contents of the templates the index.html and run_local.sh files are built
+    from
+    """
+    return {
+        name: (template_path / name).read_text()
+        for name in [
+            "index.html",
+            "run_local.sh",
+            "ga_template.html",
+            "gtm_template.html",
+            "og_template.html",
+        ]
+    }
+
+
 def __set_opengraph_tags(index_path: str, player_settings: Dict[str, Any]):
     """
     Sets the opengraph tags (`og:title`, `og:description`, `og:image`) in the
@@ -313,12 +388,7 @@ def __set_opengraph_tags(index_path: str, player_settings: Dict[str, Any]):
     description = __extract_sentence(player_settings.get("headerSubtitle"))
 
     # find if there is an image in the project folder
-    images = [
-        *list(Path(index_path).parent.rglob("*.jpg")),
-        *list(Path(index_path).parent.rglob("*.jpeg")),
-        *list(Path(index_path).parent.rglob("*.png")),
-        *list(Path(index_path).parent.rglob("*.gif")),
-    ]
+    images = __find_images(index_path)
 
     image_url = (
         player_settings.get("sharingLogoUrl") or images[0].name
@@ -339,7 +409,7 @@ def __set_opengraph_tags(index_path: str, player_settings: Dict[str, Any]):
         index_tmpl = index_tmpl.replace("<!-- #{opengraph} -->", og_template)
         f.write(index_tmpl)
 
-    _debug_print(f"\t- opengraph tags modified")
+    _debug_print("\t- opengraph tags modified")
 
 
 def build_map(
@@ -348,9 +418,11 @@ def build_map(
     start=False,
     PORT=8080,
     detach: List[Layout] = [],
+    force: bool = False,
 ):
     """
-    Builds the map and saves it to the output folder
+    Builds the map and saves it to the output folder. Files whose inputs did
+    not change since the last build into the same folder are kept as they are.
 
     Parameters
     ----------
@@ -370,6 +442,9 @@ def build_map(
 
     detach : List[Layout], optional
         The list of layouts to detach from the project, by default empty list
+
+    force : bool, optional
+        Whether to regenerate all the files, by default False
     Returns
     -------
     str
@@ -379,23 +454,38 @@ def build_map(
     if not _debug_print:
         _debug_print = _printer(project)
     # create folders and copy the index file
-    _debug_print(f">> creating folders")
+    _debug_print(">> creating folders")
 
     out_dir = Path(os.getcwd()) / out_folder
     out_data_dir = out_dir / "data"
+    os.makedirs(Path(out_data_dir), exist_ok=True)
 
-    shutil.rmtree(out_data_dir, ignore_errors=True)
-    os.makedirs(Path(out_data_dir))
+    # files whose inputs did not change since the last build are kept
+    manifest = BuildManifest(out_dir)
+    if force:
+        manifest.clear()
 
     # copy the index and run scripts to out directory
-    shutil.copy(template_path / "index.html", out_dir)
-    _debug_print(f"\t- copied {out_dir}/index.html")
+    templates_fp = fingerprint(
+        __template_contents(),
+        project.publish_settings.get("gtag_id"),
+        project.publish_settings.get("gtm_id"),
+        project.configuration,
+        sorted(str(x) for x in __find_images(out_dir / "index.html")),
+    )
+    templates_current = manifest.is_current("templates", templates_fp)
+    if templates_current:
+        _debug_print("\t- index.html and run_local.sh are up to date\n")
+    else:
+        manifest.invalidate("templates")
+        shutil.copy(template_path / "index.html", out_dir)
+        _debug_print(f"\t- copied {out_dir}/index.html")
 
-    shutil.copy(template_path / "run_local.sh", out_dir)
-    _debug_print(f"\t- copied {out_dir}/run_local.sh\n")
+        shutil.copy(template_path / "run_local.sh", out_dir)
+        _debug_print(f"\t- copied {out_dir}/run_local.sh\n")
 
     # write the files
-    _debug_print(f">> building dataset")
+    _debug_print(">> building dataset")
     exclude_md_attrs = [
         [snapshot.settings["labelAttr"], snapshot.settings["labelHoverAttr"]]
         for snapshot in project.snapshots
@@ -409,52 +499,101 @@ def build_map(
         geolayout = geosnapshot[0]
         latlon = (geolayout.x_axis, geolayout.y_axis)
 
-    out_nodes = __write_dataset_file(
-        project.dataFrame,
+    datapoints_fp = fingerprint_frame(project.dataFrame)
+    nodes_fp = fingerprint(
+        datapoints_fp,
         project.attributes,
-        out_data_dir,
         flatten(exclude_md_attrs),
         project.weighted_attributes,
         latlon,
+        project.stream_json,
+        RENDERER_VERSION,
     )
-    _debug_print(f"\t- new dataset file written to {out_data_dir / 'nodes.json'}.\n")
+    if manifest.is_current("nodes", nodes_fp):
+        out_nodes = stream_json.dataset_missing_attrs(project.dataFrame)
+        _debug_print(f"\t- dataset file {out_data_dir / 'nodes.json'} is up to date.\n")
+    else:
+        manifest.invalidate("nodes")
+        out_nodes = __write_dataset_file(
+            project.dataFrame,
+            project.attributes,
+            out_data_dir,
+            flatten(exclude_md_attrs),
+            project.weighted_attributes,
+            latlon,
+            stream=project.stream_json,
+        )
+        manifest.update("nodes", nodes_fp, [out_data_dir / "nodes.json"])
+        _debug_print(f"\t- new dataset file written to {out_data_dir / 'nodes.json'}.\n")
 
-    _debug_print(f">> building network")
+    _debug_print(">> building network")
     if project.network is not None:
-        out_links = __write_network_file(
-            project.dataFrame,
+        links_fp = fingerprint(
+            datapoints_fp,
             project.attributes,
             project.network,
             project.network_attributes,
-            out_data_dir,
-        )
-        _debug_print(
-            f"\t- new network file written to {out_data_dir / 'links.json'}.\n"
+            project.stream_json,
         )
+        if manifest.is_current("links", links_fp):
+            out_links = stream_json.network_missing_attrs(project.network)
+            _debug_print(
+                f"\t- network file {out_data_dir / 'links.json'} is up to date.\n"
+            )
+        else:
+            manifest.invalidate("links")
+            out_links = __write_network_file(
+                project.dataFrame,
+                project.attributes,
+                project.network,
+                project.network_attributes,
+                out_data_dir,
+                stream=project.stream_json,
+            )
+            manifest.update("links", links_fp, [out_data_dir / "links.json"])
+            _debug_print(
+                f"\t- new network file written to {out_data_dir / 'links.json'}.\n"
+            )
     else:
         out_links = []
-        _debug_print(f"\t- no network found, proceeding without it\n")
+        manifest.invalidate("links")
+        (out_data_dir / "links.json").unlink(missing_ok=True)
+        _debug_print("\t- no network found, proceeding without it\n")
 
-    _debug_print(f">> building settings")
+    _debug_print(">> building settings")
     publish_snapshots = [
         snapshot for snapshot in project.snapshots if snapshot not in detach
     ]
-    __write_settings_file(
+    settings_written = __write_settings_file(
         publish_snapshots,
         project.configuration,
         out_nodes,
         out_links,
         out_data_dir,
     )
-    _debug_print(
-        f"\t- new settings file written to {out_data_dir / 'settings.json'}.\n"
-    )
+    # settings.json is compared by content, its fingerprint is not needed
+    manifest.update("settings", None, [out_data_dir / "settings.json"])
+    if settings_written:
+        _debug_print(
+            f"\t- new settings file written to {out_data_dir / 'settings.json'}.\n"
+        )
+    else:
+        _debug_print(
+            f"\t- settings file {out_data_dir / 'settings.json'} is up to date.\n"
+        )
+
+    if not templates_current:
+        if project.publish_settings.get("gtag_id"):
+            gtag_id = project.publish_settings.get("gtag_id")
+            gtm_id = project.publish_settings.get("gtm_id")
+            __add_analytics(out_dir / "index.html", gtag_id, gtm_id)
 
-    if project.publish_settings.get("gtag_id"):
-        gtag_id = project.publish_settings.get("gtag_id")
-        gtm_id = project.publish_settings.get("gtm_id")
-        __add_analytics(out_dir / "index.html", gtag_id, gtm_id)
+        __set_opengraph_tags(out_dir / "index.html", project.configuration)
+        manifest.update(
+            "templates", templates_fp, [out_dir / "index.html", out_dir / "run_local.sh"]
+        )
 
-    __set_opengraph_tags(out_dir / "index.html", project.configuration)
+    # remove the files of previous builds that this one did not write
+    manifest.prune(out_data_dir)
 
     return out_dir
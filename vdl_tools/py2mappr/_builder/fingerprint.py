@@ -0,0 +1,150 @@
+"""
+Fingerprints of the build inputs, used to skip regenerating the files of the
+output directory whose inputs did not change since the last build.
+"""
+import hashlib
+import json
+from pathlib import Path
+from typing import Any, Dict, List, Union
+
+import pandas as pd
+
+import vdl_tools
+from vdl_tools.py2mappr._builder._utils import NpEncoder
+
+DEFAULT_MANIFEST_PATH = Path(".cache") / "py2mappr" / "build_manifest.json"
+
+
+def _json_default(obj: Any) -> Any:
+    try:
+        return NpEncoder().default(obj)
+    except TypeError:
+        return repr(obj)
+
+
+def fingerprint_frame(df: pd.DataFrame) -> str:
+    """
+    Content hash of a DataFrame, including its index, column names and types.
+
+    Object columns are hashed by the `repr` of their values, so lists are
+    supported and a value changing type (`1` to `"1"`) changes the hash.
+    """
+    h = hashlib.sha256()
+    h.update(repr(list(df.columns)).encode("utf-8"))
+    h.update(repr([str(x) for x in df.dtypes]).encode("utf-8"))
+    h.update(pd.util.hash_pandas_object(df.index.to_series(), index=False).values.tobytes())
+    for _, column in df.items():
+        if column.dtype == object:
+            column = column.map(lambda x: f"{type(x).__name__}:{x!r}")
+        h.update(pd.util.hash_pandas_object(column, index=False).values.tobytes())
+    return h.hexdigest()
+
+
+def fingerprint(*parts: Any) -> str:
+    """
+    Hash of the build inputs. DataFrames are hashed with `fingerprint_frame`,
+    anything else by its json representation. The package version is included
+    so that upgrading the builder regenerates the files.
+    """
+    h = hashlib.sha256(vdl_tools.__version__.encode("utf-8"))
+    for part in parts:
+        if isinstance(part, pd.DataFrame):
+            part = fingerprint_frame(part)
+        h.update(json.dumps(part, sort_keys=True, default=_json_default).encode("utf-8"))
+    return h.hexdigest()
+
+
+def _file_state(path: Path) -> List[int]:
+    """Modification time and size of a file, a file rewritten or modified
+    outside of the build changes it."""
+    stat = path.stat()
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+class BuildManifest:
+    """
+    Fingerprints of the inputs of the files generated by the last build of an
+    output directory, along with the state of the files it wrote. Stored in
+    the working directory next to the markdown cache.
+
+    Parameters
+    ----------
+    out_dir : Path. The output directory of the build.
+
+    manifest_path : Path | str, optional. The file the fingerprints of all the
+    output directories are stored in.
+    """
+
+    def __init__(
+        self,
+        out_dir: Path,
+        manifest_path: Union[Path, str] = DEFAULT_MANIFEST_PATH,
+    ):
+        self.out_dir = Path(out_dir).resolve()
+        self.manifest_path = Path(manifest_path)
+        self._manifest = self._load()
+        self._entries: Dict[str, Dict[str, Any]] = self._manifest.setdefault(str(self.out_dir), {})
+
+    def _load(self) -> Dict[str, Dict[str, Any]]:
+        if not self.manifest_path.exists():
+            return {}
+        try:
+            with open(self.manifest_path, "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _relative(self, path: Path) -> str:
+        return Path(path).resolve().relative_to(self.out_dir).as_posix()
+
+    def save(self):
+        self.manifest_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.manifest_path, "w") as f:
+            json.dump(self._manifest, f, indent=4)
+
+    def is_current(self, name: str, fp: str) -> bool:
+        """Whether the files of `name` were built from the same inputs and were
+        not modified or removed since."""
+        entry = self._entries.get(name)
+        if not isinstance(entry, dict) or entry.get("fingerprint") != fp:
+            return False
+        for rel_path, state in entry["files"].items():
+            path = self.out_dir / rel_path
+            if not path.is_file() or _file_state(path) != state:
+                return False
+        return True
+
+    def invalidate(self, name: str):
+        """Forgets the fingerprint of `name` before its files are rewritten, so
+        that an interrupted build is not mistaken for a current one."""
+        if self._entries.pop(name, None) is not None:
+            self.save()
+
+    def clear(self):
+        self._entries.clear()
+        self.save()
+
+    def update(self, name: str, fp: str, files: List[Path]):
+        """Records the files written for `name` and the fingerprint of their inputs."""
+        self._entries[name] = {
+            "fingerprint": fp,
+            "files": {self._relative(x): _file_state(Path(x)) for x in files},
+        }
+        self.save()
+
+    def prune(self, directory: Path):
+        """Removes the files of `directory` that no entry of the manifest
+        accounts for, left over from previous builds."""
+        directory = Path(directory).resolve()
+        known = {
+            rel_path
+            for entry in self._entries.values()
+            if isinstance(entry, dict)
+            for rel_path in entry["files"]
+        }
+        for path in sorted(directory.rglob("*"), reverse=True):
+            if path.is_dir():
+                if not any(path.iterdir()):
+                    path.rmdir()
+            elif self._relative(path) not in known:
+                path.unlink()
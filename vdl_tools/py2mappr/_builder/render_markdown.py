@@ -0,0 +1,143 @@
+"""
+Markdown rendering for the datapoint attributes.
+
+Each distinct value is rendered once per build, values rendered by previous
+builds are read from an on-disk cache keyed by the hash of their content, and
+the remaining ones are rendered across a process pool when there are enough
+of them to make it worthwhile.
+"""
+import hashlib
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, Iterable, Union
+
+import markdown
+
+from vdl_tools.py2mappr._builder._utils import MD_EXTENSIONS, MD_TAB_LENGTH, md_to_html
+
+DEFAULT_CACHE_PATH = Path(".cache") / "py2mappr" / "markdown.sqlite"
+# below this many values, starting the worker processes costs more than it saves
+MIN_PARALLEL_RENDER = 500
+# SQLite's default limit on the number of host parameters is 999
+_QUERY_SIZE = 900
+# part of the cache key, so that html rendered by other markdown versions or
+# with other options is not reused
+RENDERER_VERSION = (
+    f"markdown-{markdown.__version__}"
+    f";extensions={','.join(MD_EXTENSIONS)}"
+    f";tab_length={MD_TAB_LENGTH}"
+)
+
+
+def content_hash(md: str) -> str:
+    return hashlib.sha256(f"{RENDERER_VERSION}\n{md}".encode("utf-8")).hexdigest()
+
+
+class MarkdownRenderer:
+    """
+    Memoized `md_to_html`.
+
+    Call `prepare` with all the values to be rendered first, they are
+    deduplicated and rendered in bulk. Calling the renderer then looks the
+    value up and only falls back to rendering values that were not prepared.
+
+    Parameters
+    ----------
+    cache_path : Path | str | None, optional. SQLite file used to keep the
+    rendered html between builds, by default `.cache/py2mappr/markdown.sqlite`
+    in the working directory. None keeps the rendered values in memory only.
+
+    max_workers : int, optional. Number of processes to render with, by default
+    the number of CPUs.
+    """
+
+    def __init__(
+        self,
+        cache_path: Union[Path, str, None] = DEFAULT_CACHE_PATH,
+        max_workers: int = None,
+    ):
+        self.cache_path = Path(cache_path) if cache_path else None
+        self.max_workers = max_workers
+        self._rendered: Dict[str, str] = {}
+
+    def __call__(self, md: str) -> str:
+        try:
+            return self._rendered[md]
+        except (KeyError, TypeError):
+            # not prepared or not hashable
+            return md_to_html(md)
+
+    def _connect(self) -> sqlite3.Connection:
+        self.cache_path.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(self.cache_path)
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS markdown (hash TEXT PRIMARY KEY, html TEXT NOT NULL)"
+        )
+        return conn
+
+    def _load_cached(self, hashes: Dict[str, str]) -> Dict[str, str]:
+        """Returns the cached html by content hash."""
+        found = {}
+        conn = self._connect()
+        try:
+            hash_list = list(hashes)
+            for start in range(0, len(hash_list), _QUERY_SIZE):
+                chunk = hash_list[start:start + _QUERY_SIZE]
+                placeholders = ", ".join("?" * len(chunk))
+                rows = conn.execute(
+                    f"SELECT hash, html FROM markdown WHERE hash IN ({placeholders})",
+                    chunk,
+                )
+                found.update(rows)
+        finally:
+            conn.close()
+        return found
+
+    def _store_cached(self, rendered: Dict[str, str]):
+        conn = self._connect()
+        try:
+            with conn:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO markdown (hash, html) VALUES (?, ?)",
+                    rendered.items(),
+                )
+        finally:
+            conn.close()
+
+    def _render(self, values: list) -> list:
+        if len(values) < MIN_PARALLEL_RENDER:
+            return [md_to_html(md) for md in values]
+
+        chunksize = max(1, len(values) // ((self.max_workers or 8) * 4))
+        with ProcessPoolExecutor(max_workers=self.max_workers) as executor:
+            return list(executor.map(md_to_html, values, chunksize=chunksize))
+
+    def prepare(self, values: Iterable[str]):
+        """
+        Renders the distinct string values that were not prepared yet.
+
+        Parameters
+        ----------
+        values : Iterable[str]. The values to be rendered, anything that is not
+        a string is skipped.
+        """
+        new_values = {
+            md for md in values if isinstance(md, str) and md not in self._rendered
+        }
+        if not new_values:
+            return
+
+        hashes = {content_hash(md): md for md in new_values}
+        if self.cache_path:
+            cached = self._load_cached(hashes)
+            self._rendered.update((hashes[key], html) for key, html in cached.items())
+            hashes = {key: md for key, md in hashes.items() if key not in cached}
+
+        if not hashes:
+            return
+
+        html_values = self._render(list(hashes.values()))
+        self._rendered.update(zip(hashes.values(), html_values))
+        if self.cache_path:
+            self._store_cached(dict(zip(hashes.keys(), html_values)))
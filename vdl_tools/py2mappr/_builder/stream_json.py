@@ -0,0 +1,342 @@
+"""
+Streaming writers for `nodes.json` and `links.json`.
+
+The default writers build every datapoint, node and link as a dict with
+`iterrows()` and dump the whole structure at once with `indent=4`, which uses
+the pure python encoder. The writers here convert the DataFrames column by
+column, a chunk of rows at a time, and write each chunk with the C encoder of
+the standard library and compact separators. The output is the same as the
+default writers apart from whitespace.
+"""
+from typing import Any, Dict, IO, Iterable, List, Tuple
+
+import pandas as pd
+
+from vdl_tools.py2mappr._core.config import AttributeConfig, WeightedAttributeConfig
+from vdl_tools.py2mappr._builder._utils import NpEncoder
+from vdl_tools.py2mappr._builder.build_dataset import (
+    attr_value,
+    build_geodata,
+    prepare_markdown,
+    renders_markdown,
+)
+from vdl_tools.py2mappr._builder.render_markdown import MarkdownRenderer
+from vdl_tools.py2mappr._builder.build_network import _from_keys, _to_keys
+from vdl_tools.py2mappr._validation.validate_links import validate_source_target_ids
+
+# number of rows converted and held in memory at a time
+CHUNK_SIZE = 5000
+
+# `encode` uses the C encoder as long as `indent` is not set
+_encoder = NpEncoder(separators=(",", ":"))
+
+
+def _encode(obj: Any) -> str:
+    return _encoder.encode(obj)
+
+
+def _iter_chunks(df: pd.DataFrame, chunk_size: int):
+    for start in range(0, len(df), chunk_size):
+        chunk = df.iloc[start:start + chunk_size]
+        # same row values `iterrows` gives
+        yield chunk, chunk.to_numpy()
+
+
+def _column(df: pd.DataFrame, values, key: str) -> List[Any]:
+    if key not in df.columns:
+        return [None] * len(values)
+    return list(values[:, df.columns.get_loc(key)])
+
+
+def _write_array(f: IO, rows: Iterable[List[Dict[str, Any]]]):
+    """Writes chunks of rows as a single json array."""
+    f.write("[")
+    first = True
+    for chunk_rows in rows:
+        if not chunk_rows:
+            continue
+        if not first:
+            f.write(",")
+        # strip the brackets of the chunk's own array
+        f.write(_encode(chunk_rows)[1:-1])
+        first = False
+    f.write("]")
+
+
+def _iter_datapoints(
+    df_datapoints: pd.DataFrame,
+    dpAttribTypes: Dict[str, str],
+    dpRenderTypes: Dict[str, str],
+    exclude_md_attrs: List[str],
+    weighted_attributes: Dict[int, List[WeightedAttributeConfig]],
+    geodata: Dict[str, List[Dict[str, Any]]],
+    md_renderer: MarkdownRenderer,
+    chunk_size: int,
+):
+    keys = list(df_datapoints.columns)
+    for chunk, values in _iter_chunks(df_datapoints, chunk_size):
+        columns = []
+        for j, key in enumerate(keys):
+            attr_type = dpAttribTypes[key]
+            column = [attr_value(val, attr_type) for val in values[:, j]]
+            if renders_markdown(key, dpAttribTypes, dpRenderTypes, exclude_md_attrs):
+                column = [md_renderer(val) for val in column]
+            columns.append(column)
+
+        rows = []
+        for dp_id, attr_values in zip(_column(chunk, values, "id"), zip(*columns)):
+            datapoint = {
+                "id": str(dp_id),
+                "attr": dict(zip(keys, attr_values)),
+                "geodata": geodata.get(str(dp_id), []) if geodata else [],
+            }
+            weights = weighted_attributes[dp_id] if dp_id in weighted_attributes else []
+            if len(weights) > 0:
+                datapoint["weightedAttr"] = weights
+            rows.append(datapoint)
+        yield rows
+
+
+def write_dataset(
+    f: IO,
+    df_datapoints: pd.DataFrame,
+    attrDescriptors: List[AttributeConfig],
+    exclude_md_attrs: List[str] = [],
+    weighted_attributes: Dict[int, List[WeightedAttributeConfig]] = {},
+    geodata_latlon: tuple[str, str] | None = None,
+    md_renderer: MarkdownRenderer | None = None,
+    chunk_size: int = CHUNK_SIZE,
+) -> pd.DataFrame:
+    """
+    Streams the dataset (`nodes.json`) to a file.
+
+    Parameters
+    ----------
+    f : IO. The file to write to.
+
+    df_datapoints : pd.DataFrame. The dataframe containing the datapoints.
+
+    attrDescriptors : List[AttributeConfig]. The attribute descriptors for the
+    datapoints.
+
+    exclude_md_attrs : List[str], optional. Names of the attributes to be
+    excluded from markdown render.
+
+    weighted_attributes : Dict[int, List[WeightedAttributeConfig]], optional.
+    Weights per values for specific attribute.
+
+    geodata_latlon : tuple[str, str], optional. Names of the latitude and
+    longitude attributes.
+
+    md_renderer : MarkdownRenderer, optional. Renderer for the markdown
+    attributes, by default one without on-disk cache.
+
+    chunk_size : int, optional. Number of rows converted at a time.
+
+    Returns
+    -------
+    pd.DataFrame. Boolean frame of the attribute values that are None, used to
+    validate the settings in place of the list of datapoints.
+    """
+    dpAttribTypes = {row["id"]: row["attrType"] for row in attrDescriptors}
+    dpRenderTypes = {row["id"]: row["renderType"] for row in attrDescriptors}
+    geodata = build_geodata(df_datapoints, geodata_latlon)
+    md_renderer = prepare_markdown(
+        df_datapoints, dpAttribTypes, dpRenderTypes, exclude_md_attrs, md_renderer
+    )
+
+    f.write('{"attrDescriptors":')
+    f.write(_encode(attrDescriptors))
+    f.write(',"datapoints":')
+    _write_array(
+        f,
+        _iter_datapoints(
+            df_datapoints,
+            dpAttribTypes,
+            dpRenderTypes,
+            exclude_md_attrs,
+            weighted_attributes,
+            geodata,
+            md_renderer,
+            chunk_size,
+        ),
+    )
+    f.write("}")
+
+    return dataset_missing_attrs(df_datapoints)
+
+
+def dataset_missing_attrs(df_datapoints: pd.DataFrame) -> pd.DataFrame:
+    """
+    Boolean frame of the datapoint attribute values that are None, used to
+    validate the settings in place of the list of datapoints.
+    """
+    # attribute values are never None once validated
+    return pd.DataFrame(False, index=df_datapoints.index, columns=df_datapoints.columns)
+
+
+def network_missing_attrs(df_links: pd.DataFrame) -> pd.DataFrame:
+    """
+    Boolean frame of the link attribute values that are None, used to
+    validate the settings in place of the list of links.
+    """
+    other_keys = [
+        at
+        for at in df_links.columns
+        if at.lower() not in ["id", "source", "target", "isdirectional"]
+    ]
+    none_mask = pd.DataFrame(
+        {at: [val is None for val in df_links[at]] for at in other_keys},
+        index=df_links.index,
+    )
+    if "OriginalLabel" not in none_mask.columns:
+        none_mask.insert(0, "OriginalLabel", False)
+    return none_mask
+
+
+def _iter_nodes(
+    df_datapoints: pd.DataFrame,
+    attr_map: Dict[str, AttributeConfig],
+    chunk_size: int,
+    node_ids: List[str],
+):
+    x_key = attr_map.get("OriginalX", "")
+    y_key = attr_map.get("OriginalY", "")
+    for chunk, values in _iter_chunks(df_datapoints, chunk_size):
+        xs = _column(chunk, values, x_key) if x_key in chunk.columns else [0] * len(chunk)
+        ys = _column(chunk, values, y_key) if y_key in chunk.columns else [0] * len(chunk)
+        rows = [
+            {
+                "dataPointId": f"{node_id}",
+                "id": f"{node_id}",
+                "attr": {
+                    "OriginalLabel": label or node_id or original_label or "Node",
+                    "OriginalX": x,
+                    "OriginalY": y,
+                },
+            }
+            for node_id, label, original_label, x, y in zip(
+                _column(chunk, values, "id"),
+                _column(chunk, values, "label"),
+                _column(chunk, values, "OriginalLabel"),
+                xs,
+                ys,
+            )
+        ]
+        node_ids.extend(node["id"] for node in rows)
+        yield rows
+
+
+def _iter_links(
+    df_links: pd.DataFrame,
+    attr_map: Dict[str, AttributeConfig],
+    source_key: str,
+    target_key: str,
+    chunk_size: int,
+    link_ends: Tuple[List[str], List[str]],
+):
+    other_keys = [
+        at
+        for at in df_links.columns
+        if at.lower() not in ["id", "source", "target", "isdirectional"]
+    ]
+    direction_key = attr_map.get("isDirectional", "")
+    sources, targets = link_ends
+    for chunk, values in _iter_chunks(df_links, chunk_size):
+        if direction_key in chunk.columns:
+            directions = _column(chunk, values, direction_key)
+        else:
+            directions = [False] * len(chunk)
+        other_columns = [_column(chunk, values, at) for at in other_keys]
+        other_rows = zip(*other_columns) if other_columns else [()] * len(chunk)
+
+        rows = []
+        for idx, source, target, is_directional, other_values in zip(
+            chunk.index,
+            _column(chunk, values, source_key),
+            _column(chunk, values, target_key),
+            directions,
+            other_rows,
+        ):
+            link = {
+                "id": f"{idx}",
+                "source": f"{int(source)}",
+                "target": f"{int(target)}",
+                "isDirectional": is_directional,
+                "attr": {
+                    "OriginalLabel": f"{idx}",
+                    **dict(zip(other_keys, other_values)),
+                },
+            }
+            sources.append(link["source"])
+            targets.append(link["target"])
+            rows.append(link)
+        yield rows
+
+
+def write_network(
+    f: IO,
+    df_datapoints: pd.DataFrame,
+    datapointAttrs: Dict[str, AttributeConfig],
+    df_links: pd.DataFrame,
+    linkAttrs: Dict[str, AttributeConfig],
+    nodeAttrDescriptors: List[Dict[str, Any]],
+    linkAttrDescriptors: List[Dict[str, Any]],
+    chunk_size: int = CHUNK_SIZE,
+) -> pd.DataFrame:
+    """
+    Streams the network (`links.json`) to a file.
+
+    Parameters
+    ----------
+    f : IO. The file to write to.
+
+    df_datapoints : pd.DataFrame. Dataframe of datapoints
+
+    datapointAttrs : Dict[str, AttributeConfig]. Attribute map for the nodes
+
+    df_links : pd.DataFrame. Dataframe of edges
+
+    linkAttrs : Dict[str, AttributeConfig]. Attribute map for the links
+
+    nodeAttrDescriptors : List[Dict[str, Any]]. Node attribute descriptors
+
+    linkAttrDescriptors : List[Dict[str, Any]]. Link attribute descriptors
+
+    chunk_size : int, optional. Number of rows converted at a time.
+
+    Returns
+    -------
+    pd.DataFrame. Boolean frame of the link attribute values that are None,
+    used to validate the settings in place of the list of links.
+
+    Exceptions
+    ----------
+    ValueError. If the dataframe does not contain the source and target keys.
+    """
+    source_key = next((k for k in _from_keys if k in df_links.columns), None)
+    target_key = next((k for k in _to_keys if k in df_links.columns), None)
+    if source_key is None or target_key is None:
+        raise ValueError(
+            f"Source or Target key not found in edge attributes. Keys found: {df_links.columns}"
+        )
+
+    node_ids, sources, targets = [], [], []
+    f.write('[{"id":"","networkInfo":{},"clusterInfo":{},"nodes":')
+    _write_array(f, _iter_nodes(df_datapoints, datapointAttrs, chunk_size, node_ids))
+    f.write(',"links":')
+    _write_array(
+        f,
+        _iter_links(
+            df_links, linkAttrs, source_key, target_key, chunk_size, (sources, targets)
+        ),
+    )
+    f.write(',"nodeAttrDescriptors":')
+    f.write(_encode(nodeAttrDescriptors))
+    f.write(',"linkAttrDescriptors":')
+    f.write(_encode(linkAttrDescriptors))
+    f.write("}]")
+
+    validate_source_target_ids(sources, targets, node_ids)
+
+    return network_missing_attrs(df_links)
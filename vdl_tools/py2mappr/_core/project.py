@@ -10,8 +10,10 @@ from .config import (
     default_net_attr_config,
 )
 from vdl_tools.py2mappr._attributes.calculate import (
+    ColumnProfile,
     calculate_attr_types,
     calculate_render_type,
+    profile_frame,
 )
 from vdl_tools.py2mappr._layout import Layout, LayoutSettings
 from pandas import DataFrame
@@ -69,18 +71,29 @@ class OpenmapprProject:
     snapshots : List[Layout]. The snapshots of the project.
 
     debug : bool. Whether to print debug messages.
+
+    stream_json : bool. Whether to stream the data files when building.
+
+    profile : Dict[str, ColumnProfile]. The column profiles of the data,
+    shared by the attribute and layout calculations.
+
+    network_profile : Dict[str, ColumnProfile]. The column profiles of the
+    network data.
     """
 
     dataFrame: DataFrame
     network: Union[DataFrame, None] = None
     network_attributes: Dict[str, AttributeConfig]
     attributes: Dict[str, AttributeConfig]
+    profile: Dict[str, ColumnProfile]
+    network_profile: Dict[str, ColumnProfile]
     weighted_attributes: Dict[int, List[WeightedAttributeConfig]]
     configuration: ProjectConfig
     publish_settings: PublishConfig = {}
     snapshots: List[Layout] = []
 
     debug: bool = False
+    stream_json: bool = False
 
     def __init__(
         self,
@@ -91,6 +104,8 @@ class OpenmapprProject:
         self.dataFrame = dataFrame
         self.network = networkDataFrame
         self.configuration = config
+        self.profile = {}
+        self.network_profile = {}
         self.attributes = self._set_attributes()
         self.weighted_attributes = {}
         if networkDataFrame is not None:
@@ -106,6 +121,18 @@ class OpenmapprProject:
         """
         self.debug = debug
 
+    def set_stream_json(self, stream_json: bool):
+        """
+        Set whether to stream `nodes.json` and `links.json` column by column
+        with compact separators instead of building them in memory. Meant for
+        large maps, the files only differ in whitespace.
+
+        Parameters
+        ----------
+        stream_json : bool. Whether to stream the data files.
+        """
+        self.stream_json = stream_json
+
     def set_data(self, dataFrame: DataFrame):
         """
         Set the data for the project. Once set, the attributes for all existing
@@ -241,8 +268,11 @@ class OpenmapprProject:
 
     def _set_attributes(self) -> Dict[str, AttributeConfig]:
         attributes = dict()
-        attr_types = calculate_attr_types(self.dataFrame)
-        render_types = calculate_render_type(self.dataFrame, attr_types)
+        self.profile = profile_frame(self.dataFrame)
+        attr_types = calculate_attr_types(self.dataFrame, self.profile)
+        render_types = calculate_render_type(
+            self.dataFrame, attr_types, self.profile
+        )
 
         for column in self.dataFrame.columns:
             attributes[column] = {
@@ -257,8 +287,11 @@ class OpenmapprProject:
 
     def _set_network_attributes(self) -> Dict[str, AttributeConfig]:
         attributes = dict()
-        attr_types = calculate_attr_types(self.network)
-        render_types = calculate_render_type(self.network, attr_types)
+        self.network_profile = profile_frame(self.network)
+        attr_types = calculate_attr_types(self.network, self.network_profile)
+        render_types = calculate_render_type(
+            self.network, attr_types, self.network_profile
+        )
 
         for column in self.network.columns:
             attributes[column] = {
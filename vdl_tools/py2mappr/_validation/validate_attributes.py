@@ -1,4 +1,5 @@
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Union
+import pandas as pd
 from .warn import warn
 
 
@@ -22,21 +23,37 @@ def validate_layout_setting(attr: str, layout_dict: Dict[str, Any]):
         warn(f"{layout_name}: {attr} is not set in layout")
 
 
+def count_missing_attrs(
+    attrs: List[str], datapoints: Union[List[Dict[str, Any]], pd.DataFrame]
+) -> int:
+    """
+    Counts the datapoints that miss one of the attributes. `datapoints` is
+    either the list of datapoints or a boolean frame of the attribute values
+    that are None, as returned by the streaming writers.
+    """
+    if isinstance(datapoints, pd.DataFrame):
+        if any(attr not in datapoints.columns for attr in attrs):
+            return len(datapoints)
+        return int(datapoints[attrs].any(axis=1).sum())
+
+    return len(
+        [datapoint for datapoint in datapoints if has_no_attrs(attrs, datapoint)]
+    )
+
+
 def validate_node_attributes(
     layout_name: str,
     attrs: List[str],
-    datapoints: List[Dict[str, Any]],
+    datapoints: Union[List[Dict[str, Any]], pd.DataFrame],
     type: str = "datapoints",
 ):
-    missed_dp = [
-        datapoint for datapoint in datapoints if has_no_attrs(attrs, datapoint)
-    ]
+    n_missed = count_missing_attrs(attrs, datapoints)
 
-    if len(missed_dp) == len(datapoints):
+    if n_missed == len(datapoints):
         warn(f"{layout_name}: Attributes {attrs} are missing for all {type}.")
-    elif len(missed_dp) > 0:
+    elif n_missed > 0:
         warn(
-            f"{layout_name}: {len(missed_dp)} {type} are missing one of {attrs} attributes."
+            f"{layout_name}: {n_missed} {type} are missing one of {attrs} attributes."
         )
 
 
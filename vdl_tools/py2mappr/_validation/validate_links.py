@@ -1,4 +1,4 @@
-from typing import List, Dict, Any
+from typing import Iterable, List, Dict, Any
 from .warn import warn
 
 
@@ -6,15 +6,25 @@ def any_id(datapoints: List[Dict[str, Any]], id: str):
     return any([datapoint["id"] == id for datapoint in datapoints])
 
 
+def validate_source_target_ids(
+    sources: Iterable[str], targets: Iterable[str], node_ids: Iterable[str]
+):
+    node_ids = set(node_ids)
+    n_invalid = sum(
+        1
+        for source, target in zip(sources, targets)
+        if source not in node_ids or target not in node_ids
+    )
+
+    if n_invalid > 0:
+        warn(f"{n_invalid} links have invalid source or target.")
+
+
 def validate_source_target(
     links: List[Dict[str, Any]], datapoints: List[Dict[str, Any]]
 ):
-    invalid_links = [
-        link
-        for link in links
-        if not any_id(datapoints, link["source"])
-        or not any_id(datapoints, link["target"])
-    ]
-
-    if len(invalid_links) > 0:
-        warn(f"{len(invalid_links)} links have invalid source or target.")
+    validate_source_target_ids(
+        [link["source"] for link in links],
+        [link["target"] for link in links],
+        [datapoint["id"] for datapoint in datapoints],
+    )
@@ -154,9 +154,12 @@ def show(PORT=8080, out_folder: Path = "data_out", detach: List[Layout] = []):
     publisher.run([publisher.local(out_folder, PORT=PORT)])
 
 
-def build(out_folder: Path = "data_out", detach: List[Layout] = []):
+def build(
+    out_folder: Path = "data_out", detach: List[Layout] = [], force: bool = False
+):
     """
-    Builds the current project.
+    Builds the current project. Files whose inputs did not change since the
+    last build into `out_folder` are kept as they are.
 
     Parameters
     ----------
@@ -166,6 +169,9 @@ def build(out_folder: Path = "data_out", detach: List[Layout] = []):
     detach: List[Layout], optional. The list of layouts to be detached from the
     project. The default is empty list.
 
+    force: bool, optional. Whether to regenerate all the files. The default is
+    False.
+
     Examples
     --------
     Building the current project:
@@ -174,7 +180,9 @@ def build(out_folder: Path = "data_out", detach: List[Layout] = []):
     >>> mappr.build()
     """
     project = get_project()
-    build_map(project, out_folder=out_folder, start=False, detach=detach)
+    build_map(
+        project, out_folder=out_folder, start=False, detach=detach, force=force
+    )
     publisher.set_player_directory(out_folder)
 
 
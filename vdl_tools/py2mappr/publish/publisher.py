@@ -26,11 +26,12 @@ def local(web_dir: pl.Path = None, PORT=8080) -> Callable[[Callable], None]:
 
 
 def s3(
-    bucket_name: str, web_dir: pl.Path = None
+    bucket_name: str, web_dir: pl.Path = None, force: bool = False
 ) -> Callable[[Callable], None]:
     """
     Decorator to upload local player files to the s3. Requires [aws] setting of
-    config.ini to be set.
+    config.ini to be set. Only the files that changed since the last upload are
+    uploaded, unless `force` is set.
     """
     from .s3_worker import s3_worker
 
@@ -40,7 +41,7 @@ def s3(
         return web_dir
 
     return lambda data: s3_worker(
-        path=get_web_dir(data), bucket_name=bucket_name
+        path=get_web_dir(data), bucket_name=bucket_name, force=force
     )
 
 
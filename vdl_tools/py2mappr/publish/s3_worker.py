@@ -1,11 +1,44 @@
+from concurrent.futures import ThreadPoolExecutor as ThreadPool
 import configparser
-import os
-from typing import Dict
+import gzip
+import hashlib
+import io
+import mimetypes
+from typing import Dict, List, Tuple
 from pathlib import Path
 import boto3
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
 import vdl_tools.shared_tools.s3_tools as s3_tools
 from vdl_tools.shared_tools.tools.config_utils import get_configuration
 
+MAX_UPLOAD_WORKERS = 8
+MULTIPART_THRESHOLD = 8 * 1024 * 1024
+MULTIPART_CHUNKSIZE = 8 * 1024 * 1024
+MULTIPART_CONCURRENCY = 4
+# served with `Content-Encoding: gzip`, browsers decompress them transparently
+COMPRESSED_EXTENSIONS = {"json", "html", "svg"}
+# stale objects under these prefixes are deleted after the upload
+PRUNE_PREFIXES = ("data/",)
+
+_file_mapping: Dict[str, str] = {
+    "html": "text/html",
+    "json": "application/json",
+    "sh": "text/x-shellscript",
+    "png": "image/png",
+    "jpg": "image/jpeg",
+    "jpeg": "image/jpeg",
+    "gif": "image/gif",
+    "svg": "image/svg+xml",
+}
+
+_transfer_config = TransferConfig(
+    multipart_threshold=MULTIPART_THRESHOLD,
+    multipart_chunksize=MULTIPART_CHUNKSIZE,
+    max_concurrency=MULTIPART_CONCURRENCY,
+)
+
+
 def __get_default_policy(bucket_name):
     return '''{
     "Version": "2012-10-17",
@@ -33,17 +66,105 @@ def has_publish_tags(data: str) -> bool:
     return "<title>openmappr | network exploration tool</title>" not in data
 
 
-def s3_worker(path: Path, bucket_name: str):
-    _file_mapping: Dict[str, str] = {
-        "html": "text/html",
-        "json": "application/json",
-        "sh": "text/x-shellscript",
-        "png": "image/png",
-        "jpg": "image/jpeg",
-        "jpeg": "image/jpeg",
-        "gif": "image/gif",
-        "svg": "image/svg+xml",
-    }
+def _content_type(path: Path) -> str:
+    ext = path.suffix.lstrip(".").lower()
+    if ext in _file_mapping:
+        return _file_mapping[ext]
+    return mimetypes.guess_type(path.name)[0] or "application/octet-stream"
+
+
+def _local_etag(body: bytes, part_size: int = MULTIPART_CHUNKSIZE) -> str:
+    """
+    The ETag S3 gives to `body` when uploaded in parts of `part_size` bytes:
+    the MD5 of the body for a single part upload, the MD5 of the parts' MD5s
+    followed by the number of parts for a multipart upload.
+    """
+    if len(body) < MULTIPART_THRESHOLD:
+        return hashlib.md5(body).hexdigest()
+
+    part_digests = [
+        hashlib.md5(body[start:start + part_size]).digest()
+        for start in range(0, len(body), part_size)
+    ]
+    return f"{hashlib.md5(b''.join(part_digests)).hexdigest()}-{len(part_digests)}"
+
+
+def _read_body(path: Path) -> Tuple[bytes, Dict[str, str]]:
+    """Reads the file, gzipping the types that compress well."""
+    with open(path, "rb") as f:
+        body = f.read()
+
+    extra_args = {"ContentType": _content_type(path)}
+    if path.suffix.lstrip(".").lower() in COMPRESSED_EXTENSIONS:
+        # mtime=0 so that the same content always gives the same bytes and ETag
+        body = gzip.compress(body, compresslevel=6, mtime=0)
+        extra_args["ContentEncoding"] = "gzip"
+    return body, extra_args
+
+
+def _list_etags(s3_client, bucket_name: str) -> Dict[str, str]:
+    etags = {}
+    paginator = s3_client.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=bucket_name):
+        for obj in page.get("Contents", []):
+            etags[obj["Key"]] = obj["ETag"].strip('"')
+    return etags
+
+
+def _local_files(path: Path) -> Dict[str, Path]:
+    """Files of the output folder by object key."""
+    files = {}
+    for full_path in sorted(Path(path).rglob("*")):
+        if not full_path.is_file() or full_path.name == ".DS_Store":
+            continue
+        files[full_path.relative_to(path).as_posix()] = full_path
+    return files
+
+
+def _upload(s3_client, bucket_name: str, key: str, body: bytes, extra_args: Dict[str, str]):
+    print(f"Putting {key} to {bucket_name}")
+    s3_client.upload_fileobj(
+        io.BytesIO(body),
+        bucket_name,
+        key,
+        ExtraArgs=extra_args,
+        Config=_transfer_config,
+    )
+
+
+def _prune(s3_client, bucket_name: str, keys: List[str]):
+    for start in range(0, len(keys), 1000):
+        chunk = keys[start:start + 1000]
+        print(f"Deleting {len(chunk)} stale objects from {bucket_name}")
+        s3_client.delete_objects(
+            Bucket=bucket_name,
+            Delete={"Objects": [{"Key": key} for key in chunk], "Quiet": True},
+        )
+
+
+def s3_worker(
+    path: Path,
+    bucket_name: str,
+    force: bool = False,
+    max_workers: int = MAX_UPLOAD_WORKERS,
+):
+    """
+    Uploads the output folder to the bucket, only the files whose content
+    differs from the object in the bucket are uploaded. Objects under the
+    `data/` folder of the bucket that are not in the output folder anymore are
+    deleted once the upload is done, so the published map is never missing
+    files.
+
+    Parameters
+    ----------
+    path : Path. The output folder of the build.
+
+    bucket_name : str. The bucket to publish to, created if it doesn't exist.
+
+    force : bool, optional. Whether to upload all the files, by default False
+
+    max_workers : int, optional. Number of concurrent uploads.
+    """
     ### Config Setup ###
     config = get_configuration()
     # load AWS settings from config file
@@ -55,6 +176,7 @@ def s3_worker(path: Path, bucket_name: str):
         aws_access_key_id=ACCESS_KEY,
         aws_secret_access_key=SECRET_KEY,
         region_name=REGION,
+        config=Config(max_pool_connections=max_workers * MULTIPART_CONCURRENCY),
     )
     
     # create bucket if it doesn't exist
@@ -70,41 +192,34 @@ def s3_worker(path: Path, bucket_name: str):
         Bucket=bucket_name, WebsiteConfiguration=website_configuration
     )
 
-    session = boto3.Session(
-        aws_access_key_id=ACCESS_KEY,
-        aws_secret_access_key=SECRET_KEY,
-        region_name=REGION,
-    )
-    s3 = session.resource("s3")
-    bucket = s3.Bucket(bucket_name)
+    remote_etags = _list_etags(S3_CLIENT, bucket_name)
+    local_files = _local_files(path)
 
+    def upload_if_changed(key: str) -> bool:
+        body, extra_args = _read_body(local_files[key])
+        if not force and remote_etags.get(key) == _local_etag(body):
+            return False
+        _upload(S3_CLIENT, bucket_name, key, body, extra_args)
+        return True
+
+    # the index goes last, so it never points to data that is not uploaded yet
+    keys = [key for key in local_files if key != "index.html"]
+    with ThreadPool(max_workers=max_workers) as executor:
+        uploaded = sum(executor.map(upload_if_changed, keys))
+    if "index.html" in local_files:
+        uploaded += upload_if_changed("index.html")
+    print(f"Uploaded {uploaded} changed files, {len(local_files) - uploaded} were up to date")
+
+    stale_keys = [
+        key
+        for key in remote_etags
+        if key.startswith(PRUNE_PREFIXES) and key not in local_files
+    ]
     try:
-        bucket.objects.filter(Prefix='data/').delete()
+        _prune(S3_CLIENT, bucket_name, stale_keys)
     except Exception as e:
         print(f"Error cleaning 'data/' folder in the bucket: {e}")
 
-    data_path = str(path)
-    for subdir, _, files in os.walk(path):
-        for file in files:
-            full_path = os.path.join(subdir, file)
-            with open(full_path, "rb") as data:
-                ext = full_path.split(".")[-1]
-                object_key = (
-                    full_path[len(data_path) + 1 :]
-                    if subdir == data_path
-                    else "%s/%s"
-                    % (os.path.basename(subdir), os.path.basename(full_path))
-                )
-
-                print(f"Putting {object_key} to {bucket_name}")
-                if 'DS_Store' in ext:
-                    continue
-                bucket.put_object(
-                    Key=object_key,
-                    Body=data,
-                    ContentType=_file_mapping[ext],
-                )
-
     print(
         "\nUpload complete. To view your map, go to http://%s.s3-website-%s.amazonaws.com/"
         % (bucket_name, REGION)
@@ -0,0 +1,16 @@
+import pandas as pd
+
+from vdl_tools.py2mappr._attributes.calculate import calculate_attr_types, profile_frame
+from vdl_tools.py2mappr._attributes.utils import find_node_color_attr, find_node_label_attr
+
+
+def test_columns_added_after_profiling_are_profiled_from_the_data():
+    df = pd.DataFrame({"id": [1, 2, 3], "group": ["a", "a", "b"]})
+    profile = profile_frame(df)
+    df["name"] = ["x", None, "z"]
+    df["label"] = ["x", "y", "z"]
+    df["flag"] = [1, 1, 1]
+
+    assert calculate_attr_types(df, profile) == calculate_attr_types(df)
+    assert find_node_label_attr(df, profile) == find_node_label_attr(df) == "label"
+    assert find_node_color_attr(df, profile) == find_node_color_attr(df) == "flag"
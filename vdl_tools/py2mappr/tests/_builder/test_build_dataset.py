@@ -1,6 +1,6 @@
 import pandas as pd
 
-from vdl_tools.py2mappr._builder.build_dataset import build_datapoints
+from vdl_tools.py2mappr._builder.build_dataset import build_datapoints, prepare_markdown
 
 
 def test_string_text_is_converted_from_md():
@@ -41,3 +41,16 @@ def test_string_default_not_converted_from_md():
 
     expected = "This is a **test**."
     assert expected == result[0]["attr"]["description"]
+
+
+def test_unhashable_text_values_are_left_to_render_per_datapoint():
+    df = pd.DataFrame({
+        "id": ["a", "b", "c"],
+        "description": ["*one*", ["not", "hashable"], "*one*"],
+    })
+    dpAttribTypes = {"id": "string", "description": "string"}
+    dpRenderTypes = {"id": "default", "description": "text"}
+
+    renderer = prepare_markdown(df, dpAttribTypes, dpRenderTypes)
+
+    assert renderer._rendered == {"*one*": "<p><em>one</em></p>"}
@@ -0,0 +1,24 @@
+from vdl_tools.py2mappr._builder.fingerprint import BuildManifest
+
+
+def test_manifest_tracks_written_files(tmp_path):
+    out_dir = tmp_path / "data_out"
+    (out_dir / "data").mkdir(parents=True)
+    nodes_path = out_dir / "data" / "nodes.json"
+    nodes_path.write_text("[]")
+    stale_path = out_dir / "data" / "links.json"
+    stale_path.write_text("[]")
+
+    manifest = BuildManifest(out_dir, manifest_path=tmp_path / "manifest.json")
+    manifest.update("nodes", "fp", [nodes_path])
+    assert BuildManifest(out_dir, manifest_path=tmp_path / "manifest.json").is_current("nodes", "fp")
+    assert not manifest.is_current("nodes", "other fp")
+
+    # files written by previous builds and not by this one are removed
+    manifest.prune(out_dir / "data")
+    assert nodes_path.exists()
+    assert not stale_path.exists()
+
+    # a file changed outside of the build is regenerated
+    nodes_path.write_text('[{"id": 1}]')
+    assert not manifest.is_current("nodes", "fp")
@@ -0,0 +1,21 @@
+from vdl_tools.py2mappr._builder._utils import md_to_html
+from vdl_tools.py2mappr._builder.render_markdown import MarkdownRenderer
+
+
+def test_rendered_values_are_reused_between_builds(tmp_path, monkeypatch):
+    cache_path = tmp_path / "markdown.sqlite"
+    values = ["This is **bold**.", "This is **bold**.", "*other*", None]
+
+    renderer = MarkdownRenderer(cache_path=cache_path)
+    renderer.prepare(values)
+    assert [renderer(x) for x in values] == [md_to_html(x) for x in values]
+
+    # a new build reads the html from the cache instead of rendering it
+    monkeypatch.setattr(
+        "vdl_tools.py2mappr._builder.render_markdown.md_to_html",
+        lambda md: "not cached",
+    )
+    renderer = MarkdownRenderer(cache_path=cache_path)
+    renderer.prepare(values)
+    assert renderer("*other*") == "<p><em>other</em></p>"
+    assert renderer("not prepared") == "not cached"
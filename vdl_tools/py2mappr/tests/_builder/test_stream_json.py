@@ -0,0 +1,65 @@
+import io
+import json
+
+import numpy as np
+import pandas as pd
+
+from vdl_tools.py2mappr._builder import stream_json
+from vdl_tools.py2mappr._builder.build_dataset import build_attrDescriptors, build_datapoints
+from vdl_tools.py2mappr._builder.build_network import build_links, build_linkAttrDescriptors
+
+
+def _compact(data):
+    return json.dumps(data, separators=(",", ":"))
+
+
+def test_dataset_matches_default_writer():
+    df = pd.DataFrame({
+        "id": ["a", "b", "c"],
+        "description": ["This is **bold**.", None, "é"],
+        "tags": [["x", "y"], "z", np.nan],
+        "score": [1e17, np.nan, 0.5],
+    })
+    attrs = {
+        "id": {"attrType": "string", "renderType": "default"},
+        "description": {"attrType": "string", "renderType": "text"},
+        "tags": {"attrType": "liststring", "renderType": "tags"},
+        "score": {"attrType": "float", "renderType": "histogram"},
+    }
+    descriptors = build_attrDescriptors(attrs, pd.DataFrame(attrs))
+    expected = {
+        "attrDescriptors": descriptors,
+        "datapoints": build_datapoints(
+            df,
+            {key: val["attrType"] for key, val in attrs.items()},
+            {key: val["renderType"] for key, val in attrs.items()},
+        ),
+    }
+
+    f = io.StringIO()
+    stream_json.write_dataset(f, df, descriptors, chunk_size=2)
+
+    assert f.getvalue() == _compact(expected)
+
+
+def test_links_match_default_writer():
+    df_links = pd.DataFrame({
+        "source": [0, 1, 2],
+        "target": [1, 2, 0],
+        "weight": [0.1, 0.2, None],
+    })
+    expected = build_links(df_links, {})
+
+    f = io.StringIO()
+    stream_json.write_network(
+        f,
+        pd.DataFrame({"id": [0, 1, 2]}),
+        {},
+        df_links,
+        {},
+        [],
+        build_linkAttrDescriptors({}),
+        chunk_size=2,
+    )
+
+    assert _compact(json.loads(f.getvalue())[0]["links"]) == _compact(expected)
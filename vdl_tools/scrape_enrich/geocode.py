@@ -15,6 +15,7 @@ Addresses that failed lookup have empty lat,long.
 # %% ###########
 # ## libraries and file paths
 import pathlib as pl
+from concurrent.futures import ThreadPoolExecutor as ThreadPool, as_completed
 import pandas as pd
 import numpy as np
 from vdl_tools.shared_tools.common_functions import (
@@ -27,12 +28,19 @@ from vdl_tools.shared_tools.common_functions import (
 # import os
 from vdl_tools.scrape_enrich.geocode_cache import GeocodeCache, get_component
 from geopy.geocoders import GoogleV3  # , Nominatim
+from geopy.exc import GeopyError
 from geopy.extra.rate_limiter import RateLimiter
-from vdl_tools.shared_tools.tools.config_utils import get_configuration
+from vdl_tools.shared_tools.tools.config_utils import get_configuration, get_configuration_value
 from vdl_tools.shared_tools.tools.unique_ids import make_uuid
 import json
 
 
+# Google's default quota for the geocoding API
+DEFAULT_MAX_QPS = 50
+DEFAULT_MAX_WORKERS = 16
+# number of geocoded addresses written to the index at a time
+GEOCODE_COMMIT_SIZE = 100
+
 geo_rename_dict = {
     "San Francisco Bay Area": "San Francisco, CA, United States",
     "Ireland": "Ireland, United Kingdom",
@@ -59,6 +67,141 @@ def get_api_info():
     return user, key
 
 
+def get_rate_info():
+    """Requests per second and number of concurrent requests for the geocoder"""
+    cfg = get_configuration()
+    max_qps = float(get_configuration_value(cfg, "geocode.max_qps", DEFAULT_MAX_QPS))
+    max_workers = int(get_configuration_value(cfg, "geocode.max_workers", DEFAULT_MAX_WORKERS))
+    return max_qps, max_workers
+
+
+def normalize_address(address):
+    """Collapse whitespace and strip stray separators so trivially different
+    spellings of an address share a single geocode lookup"""
+    return (
+        address
+        .str.replace(r"\s+", " ", regex=True)
+        .str.replace(r"\s*,\s*", ", ", regex=True)
+        .str.strip(" ,;")
+    )
+
+
+# Sometime the address is too long for the filesystem, --create a unique id for the address
+def _shorten_address(x):
+    if len(x) > 100:
+        hashed_address = make_uuid(x, "geocode", True)
+        return f"hashed_{hashed_address}"
+    return x
+
+
+def _location_data(data):
+    return {
+        'latitude': data.latitude,
+        'longitude': data.longitude,
+        'city': get_component(data, "locality"),
+        'state': get_component(data, "administrative_area_level_1"),
+        'country': get_component(data, "country"),
+        'raw': data.raw
+    }
+
+
+def _list_legacy_cache_keys(cache):
+    """Search keys of the items saved one file per address, listed once so that
+    addresses that were never cached don't cost a file stat and an S3 request each"""
+    cache_dir = cache._get_file_path("")
+    local_keys = set()
+    if cache_dir.exists():
+        local_keys = {
+            fp.relative_to(cache_dir).as_posix()
+            for fp in cache_dir.rglob("*.json")
+        }
+    return local_keys | set(cache._cached_keys)
+
+
+def _load_legacy_cache_items(cache, raw_addresses):
+    """Get items saved one file per address before the geocode index existed
+
+    raw_addresses : dict of index key to the addresses as given, which the
+        legacy items were saved under
+    Returns: dict of index key to location data. The legacy errors are not
+        loaded, they include failed requests so the addresses are geocoded again
+    """
+    legacy_keys = _list_legacy_cache_keys(cache)
+    found = {}
+    for key, variants in raw_addresses.items():
+        cache_ids = [_shorten_address(x) for x in variants]
+        for cache_id in cache_ids:
+            if cache.create_search_key(cache_id) not in legacy_keys:
+                continue
+            cache_item = cache.get_cache_item(cache_id)
+            if cache_item:
+                found[key] = json.loads(cache_item)
+                break
+    return found
+
+
+def _geocode_missing(cache, addresses, commit_every=GEOCODE_COMMIT_SIZE):
+    """Geocode addresses concurrently, storing results in the index as they come in
+
+    addresses : dict of index key to address
+    Returns: dict of index key to location data for the addresses that were found
+
+    Only the addresses the geocoder has no result for are stored as errors, the
+    requests that failed (quota, timeout, server error) are not stored so that
+    they are retried on the next run.
+    """
+    print("set up google api")
+    USER, KEY = get_api_info()
+    max_qps, max_workers = get_rate_info()
+
+    geolocator = GoogleV3(user_agent=USER, api_key=KEY)
+    # RateLimiter is thread safe, it spaces out the start of the requests so
+    # that the concurrent workers together stay within the quota
+    geocodeRL = RateLimiter(
+        geolocator.geocode,
+        min_delay_seconds=1 / max_qps,
+        error_wait_seconds=max(5.0, 1 / max_qps),
+        # raise after the retries rather than return None, which would be stored as not found
+        swallow_exceptions=False,
+    )
+
+    print(f"geocoding {len(addresses)} addresses with {max_workers} workers at {max_qps} requests/s")
+    found = {}
+    pending_items = {}
+    n_failed = 0
+    executor = ThreadPool(max_workers=max_workers)
+    futures = {executor.submit(geocodeRL, x): key for key, x in addresses.items()}
+    try:
+        for future in as_completed(futures):
+            key = futures[future]
+            try:
+                data = future.result()
+            except GeopyError as e:
+                print(f"(Geocode) request failed for {addresses[key]}: {e!r}")
+                n_failed += 1
+                continue
+            location_data = _location_data(data) if data else None
+            if location_data:
+                found[key] = location_data
+            pending_items[key] = location_data
+            if len(pending_items) >= commit_every:
+                cache.store_index_items(pending_items)
+                pending_items = {}
+    except KeyboardInterrupt:
+        print("(Geocode) Received Keyboard Interrupt, exiting gracefully...")
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+        cache.store_index_items(pending_items)
+        cache.push_index()
+
+    n_errors = len(addresses) - len(found) - n_failed
+    if n_errors:
+        print(f"{n_errors} addresses could not be geocoded")
+    if n_failed:
+        print(f"{n_failed} geocode requests failed, they will be retried on the next run")
+    return found
+
+
 def geocode_addresses(df, address, test=None, use_cached_result=True):
     """
     get lat long from address
@@ -67,6 +210,9 @@ def geocode_addresses(df, address, test=None, use_cached_result=True):
     address : column name of address
     test : sample size for testing
 
+    Addresses are normalized and deduplicated, looked up in bulk in the
+    geocode index and only the misses are sent to the geocoder.
+
     Returns: df with added columns of latitude, longitude, city, state, country
     """
     cache = GeocodeCache()
@@ -80,92 +226,56 @@ def geocode_addresses(df, address, test=None, use_cached_result=True):
     for string1, string2 in geo_rename_dict.items():  # spell corrections for geocoding
         df.loc[:, address] = df[address].str.replace(string1, string2)
     # remove records with no address
-    df_w_geo: pd.DataFrame = df[df[address].apply(lambda x: x != "")]  # .copy()
+    df_w_geo: pd.DataFrame = df[df[address] != ""]
     df_w_geo = df_w_geo.reset_index(drop=True)  # trying to avoid slice error...
 
-    # Sometime the address is too long for the filesystem, --create a unique id for the address
-    def _shorten_address(x):
-        if len(x) > 100:
-            hashed_address = make_uuid(x, "geocode", True)
-            return f"hashed_{hashed_address}"
-        return x
-
-    def load_cache_item(x):
-        x = _shorten_address(x)
-        cache_item = cache.get_cache_item(x)
-        if cache_item:
-            return json.loads(cache_item)
-        return None
-
-    # split dataframe and fill cached data
-    if use_cached_result:
-        df_w_geo['location'] = df_w_geo[address].apply(load_cache_item)
-    else:
-        df_w_geo['location'] = None
-
-    has_missing_items = len(df_w_geo[df_w_geo['location'].isnull()]) > 0
-
-    if has_missing_items:
-        print("set up google api")
-        USER, KEY = get_api_info()
-
-        geolocator = GoogleV3(user_agent=USER, api_key=KEY)
-
-        geocodeRL = RateLimiter(
-            geolocator.geocode, min_delay_seconds=1 / 50
-        )  # auto rate limiter
-
-        def geocode_query(x):
-            if x['location']:
-                return x['location']
-
-            data = geocodeRL(x[address])
-            if not data:
-                cache.save_as_error(x[address])
-                return None
-
-            location_data = {
-                'latitude': data.latitude,
-                'longitude': data.longitude,
-                'city': get_component(data, "locality"),
-                'state': get_component(data, "administrative_area_level_1"),
-                'country': get_component(data, "country"),
-                'raw': data.raw
-            }
-            cache.store_item(_shorten_address(x[address]), json.dumps(location_data))
-            return location_data
-
-        print("getting lat/longs with geocode auto rate limiter and S3 cache")
-        index_to_geocode = {}
-        for i, row in df_w_geo.iterrows():
-            try:
-                # Set the value of the 'location' column to the geocode_query result
-                index_to_geocode[i] = geocode_query(row)
-            except KeyboardInterrupt:
-                print("(Geocode) Received Keyboard Interrupt, exiting gracefully...")
-                break
+    # one lookup per distinct address
+    normalized = normalize_address(df_w_geo[address])
+    index_keys = normalized.str.casefold()
+    is_first = ~index_keys.duplicated()
+    addresses = dict(zip(index_keys[is_first], normalized[is_first]))
+    print(f"{len(addresses)} distinct addresses for {len(df_w_geo)} records")
 
-        df_w_geo['location'] = df_w_geo.index.map(index_to_geocode)
+    locations = {}
+    if use_cached_result:
+        cache.pull_index()
+        # addresses the geocoder had no result for come back as None, they are not geocoded again
+        locations = cache.get_index_items(list(addresses), include_errors=True)
+        # legacy items were saved under the address as given, before normalizing
+        is_uncached = ~index_keys.isin(list(locations))
+        raw_addresses = (
+            df_w_geo.loc[is_uncached, address]
+            .groupby(index_keys[is_uncached], sort=False)
+            .unique()
+            .to_dict()
+        )
+        legacy_locations = _load_legacy_cache_items(cache, raw_addresses)
+        if legacy_locations:
+            # move them to the index so the next run finds them there
+            cache.store_index_items(legacy_locations)
+            locations.update(legacy_locations)
+        n_errors = sum(x is None for x in locations.values())
+        print(
+            f"{len(locations) - n_errors} addresses found in the geocode cache, "
+            f"{n_errors} known to fail"
+        )
+
+    missing_addresses = {k: x for k, x in addresses.items() if k not in locations}
+    if missing_addresses:
+        locations.update(_geocode_missing(cache, missing_addresses))
 
     print("getting address components")
-    df_w_geo["Latitude"] = df_w_geo["location"].apply(
-        lambda x: x['latitude'] if x else ""
-    )
-    df_w_geo["Longitude"] = df_w_geo["location"].apply(
-        lambda x: x['longitude'] if x else ""
-    )
-
-    df_w_geo["city"] = df_w_geo["location"].apply(
-        lambda x: x['city'] if x else None
-    )
-    df_w_geo["state"] = df_w_geo["location"].apply(
-        lambda x: x['state'] if x else None
-    )
-    df_w_geo["country"] = df_w_geo["location"].apply(
-        lambda x: x['country'] if x else None
+    location_df = pd.DataFrame.from_dict(
+        {k: x for k, x in locations.items() if x is not None},
+        orient="index",
+        columns=["latitude", "longitude", "city", "state", "country"],
     )
+    location_df = location_df.reindex(index_keys).reset_index(drop=True)
+    df_w_geo["Latitude"] = location_df["latitude"].astype(object).fillna("")
+    df_w_geo["Longitude"] = location_df["longitude"].astype(object).fillna("")
+    for col in ["city", "state", "country"]:
+        df_w_geo[col] = location_df[col].astype(object).where(location_df[col].notnull(), None)
 
-    df_w_geo.drop("location", axis=1, inplace=True)
     return df_w_geo
 
 
@@ -1,13 +1,22 @@
 # -*- coding: utf-8 -*-
 import pathlib as pl
 import datetime as dt
+import json
+import sqlite3
 import pandas as pd
+from more_itertools import chunked
 import vdl_tools.shared_tools.tools.config_utils as config_tools
 from vdl_tools.shared_tools.cache import Cache
+from vdl_tools.shared_tools.tools.logger import logger
 
 S3_DEFAULT_BUCKET_NAME = 'geocode-cache'
 S3_DEFAULT_BUCKET_REGION = 'us-east-1'
 DEFAULT_FILE_CACHE_DIRECTORY = '.cache/geocode'
+# All geocode results in a single SQLite file, so lookups don't cost a file read
+# and an S3 GET per address
+INDEX_KEY = '_index/geocode_index.sqlite'
+# SQLite's default limit on the number of host parameters is 999
+INDEX_QUERY_SIZE = 900
 
 # %%
 def get_component(gc_data, component_type):
@@ -67,6 +76,123 @@ class GeocodeCache(Cache):
     def create_search_key(self, id: str) -> str:
         return f'{id}.json'
 
+    @property
+    def index_path(self) -> pl.Path:
+        return self._get_file_path(INDEX_KEY)
+
+    def _connect_index(self) -> sqlite3.Connection:
+        self.index_path.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(self.index_path)
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS geocode ('
+            'key TEXT PRIMARY KEY, '
+            'data TEXT, '
+            'is_error INTEGER NOT NULL DEFAULT 0, '
+            'date_updated TEXT NOT NULL)'
+        )
+        return conn
+
+    def pull_index(self):
+        """Merges the index stored in S3 into the local one.
+
+        Entries are merged rather than the file replaced, so results geocoded
+        locally but not pushed yet are kept. The newest entry wins.
+        """
+        if INDEX_KEY not in self._cached_keys:
+            return
+
+        remote_path = self.index_path.with_suffix('.remote')
+        remote_path.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            self.client.download_file(self.bucket, INDEX_KEY, str(remote_path))
+        except Exception as e:
+            logger.error(e)
+            logger.error('Failed to download the geocode index from "%s"', self.bucket)
+            return
+
+        conn = self._connect_index()
+        try:
+            conn.execute('ATTACH DATABASE ? AS remote', (str(remote_path),))
+            with conn:
+                conn.execute(
+                    'INSERT INTO geocode SELECT * FROM remote.geocode WHERE true '
+                    'ON CONFLICT(key) DO UPDATE SET '
+                    'data = excluded.data, '
+                    'is_error = excluded.is_error, '
+                    'date_updated = excluded.date_updated '
+                    'WHERE excluded.date_updated > geocode.date_updated'
+                )
+            conn.execute('DETACH DATABASE remote')
+        finally:
+            conn.close()
+            remote_path.unlink(missing_ok=True)
+
+    def push_index(self):
+        """Merges the S3 index into the local one and uploads the result."""
+        self.pull_index()
+        try:
+            logger.info('Saving geocode index to s3 bucket "%s"', self.bucket)
+            self.client.upload_file(str(self.index_path), self.bucket, INDEX_KEY)
+            self._cached_keys.add(INDEX_KEY)
+        except Exception as e:
+            logger.error(e)
+            logger.error('Failed to store the geocode index in "%s"', self.bucket)
+
+    def get_index_items(self, keys: list[str], include_errors: bool = False) -> dict[str, dict]:
+        """Looks up many keys in the local index at once.
+
+        Parameters
+        ----------
+        keys : list[str]
+            Index keys, the normalized and casefolded addresses.
+        include_errors : bool
+            Return the keys stored as errors with a None value instead of
+            leaving them out.
+
+        Returns
+        -------
+        dict[str, dict]
+            Geocode results by key. Keys that are missing or expired are left out.
+        """
+        last_valid_date = dt.datetime.now(dt.timezone.utc) - dt.timedelta(days=self.cache_validity_days)
+        found = {}
+        conn = self._connect_index()
+        try:
+            for keys_chunk in chunked(keys, INDEX_QUERY_SIZE):
+                placeholders = ', '.join('?' * len(keys_chunk))
+                rows = conn.execute(
+                    f'SELECT key, data, is_error FROM geocode WHERE key IN ({placeholders}) '
+                    'AND (is_error = 0 OR ?) AND date_updated > ?',
+                    (*keys_chunk, include_errors, last_valid_date.isoformat()),
+                )
+                found.update({
+                    key: None if is_error else json.loads(data)
+                    for key, data, is_error in rows
+                })
+        finally:
+            conn.close()
+        return found
+
+    def store_index_items(self, items: dict[str, dict]):
+        """Stores geocode results in the local index, a None value marks the key as an error."""
+        if not items:
+            return
+
+        date_updated = dt.datetime.now(dt.timezone.utc).isoformat()
+        conn = self._connect_index()
+        try:
+            with conn:
+                conn.executemany(
+                    'INSERT OR REPLACE INTO geocode (key, data, is_error, date_updated) '
+                    'VALUES (?, ?, ?, ?)',
+                    [
+                        (key, json.dumps(value) if value else None, int(not value), date_updated)
+                        for key, value in items.items()
+                    ],
+                )
+        finally:
+            conn.close()
+
 # %%
 if __name__ == "__main__":
     val = [
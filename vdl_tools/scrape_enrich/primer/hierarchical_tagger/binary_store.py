@@ -0,0 +1,126 @@
+"""
+Single file store of named numpy arrays and a json header, used to save
+HierarchicalTagger models.
+
+The file starts with a magic string and the length of the json header,
+followed by the header and the raw buffers of the arrays, each aligned so
+that it can be memory mapped. Processes loading the same file with
+`mmap_mode="r"` share the pages of the arrays instead of each holding a copy.
+"""
+import json
+import struct
+
+import numpy as np
+from scipy.sparse import csr_matrix
+
+MAGIC = b"VDLHTAG1"
+# offsets of the array buffers are multiples of this
+ALIGNMENT = 64
+
+
+def _aligned(offset):
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+
+def csr_to_arrays(name, matrix):
+    """Arrays of a csr_matrix, to be stored with write_store."""
+    matrix = csr_matrix(matrix)
+    return {
+        f"{name}.data": matrix.data,
+        f"{name}.indices": matrix.indices,
+        f"{name}.indptr": matrix.indptr,
+        f"{name}.shape": np.array(matrix.shape, dtype=np.int64),
+    }
+
+
+def csr_from_arrays(name, arrays):
+    """csr_matrix stored with csr_to_arrays, sharing the (mapped) buffers."""
+    return csr_matrix(
+        (arrays[f"{name}.data"], arrays[f"{name}.indices"], arrays[f"{name}.indptr"]),
+        shape=tuple(int(x) for x in arrays[f"{name}.shape"]),
+        copy=False,
+    )
+
+
+def ragged_to_arrays(name, lists, dtype):
+    """Arrays of a list of lists of numbers, to be stored with write_store."""
+    lengths = np.fromiter((len(x) for x in lists), dtype=np.int64, count=len(lists))
+    indptr = np.zeros(len(lists) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=indptr[1:])
+    values = np.fromiter(
+        (value for x in lists for value in x), dtype=dtype, count=int(indptr[-1])
+    )
+    return {f"{name}.values": values, f"{name}.indptr": indptr}
+
+
+def ragged_from_arrays(name, arrays):
+    """List of arrays stored with ragged_to_arrays."""
+    values = arrays[f"{name}.values"]
+    indptr = arrays[f"{name}.indptr"]
+    return [values[start:end] for start, end in zip(indptr[:-1], indptr[1:])]
+
+
+def write_store(path, header, arrays):
+    """
+    Writes a json serializable header and a dict of numpy arrays to path.
+    """
+    arrays = {name: np.ascontiguousarray(value) for name, value in arrays.items()}
+
+    # Offsets are relative to the end of the header, so that they don't depend on its length
+    layout = {}
+    offset = 0
+    for name, value in arrays.items():
+        offset = _aligned(offset)
+        layout[name] = {
+            "dtype": value.dtype.str,
+            "shape": list(value.shape),
+            "offset": offset,
+        }
+        offset += value.nbytes
+
+    header_bytes = json.dumps(
+        {"header": header, "arrays": layout}, separators=(",", ":")
+    ).encode("utf-8")
+    data_start = _aligned(len(MAGIC) + 8 + len(header_bytes))
+
+    with open(path, "wb") as f:
+        f.write(MAGIC)
+        f.write(struct.pack("<Q", len(header_bytes)))
+        f.write(header_bytes)
+        for name, value in arrays.items():
+            f.seek(data_start + layout[name]["offset"])
+            f.write(value.tobytes())
+
+
+def read_store(path, mmap_mode="r"):
+    """
+    Reads the header and arrays written by write_store.
+
+    mmap_mode = "r" maps the arrays read only instead of reading them, None reads them in memory.
+
+    returns: header, dict of arrays
+    """
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a HierarchicalTagger model file")
+        (header_length,) = struct.unpack("<Q", f.read(8))
+        content = json.loads(f.read(header_length).decode("utf-8"))
+    data_start = _aligned(len(MAGIC) + 8 + header_length)
+
+    arrays = {}
+    for name, spec in content["arrays"].items():
+        dtype = np.dtype(spec["dtype"])
+        shape = tuple(spec["shape"])
+        count = int(np.prod(shape, dtype=np.int64))
+        offset = data_start + spec["offset"]
+        if count == 0:
+            arrays[name] = np.empty(shape, dtype=dtype)
+        elif mmap_mode is not None:
+            arrays[name] = np.memmap(
+                path, dtype=dtype, mode=mmap_mode, offset=offset, shape=shape
+            )
+        else:
+            arrays[name] = np.fromfile(
+                path, dtype=dtype, count=count, offset=offset
+            ).reshape(shape)
+    return content["header"], arrays
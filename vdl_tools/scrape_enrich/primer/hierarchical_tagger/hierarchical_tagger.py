@@ -1,4 +1,6 @@
 import copy
+import functools
+import itertools
 import json
 import os
 from collections import Counter, defaultdict, namedtuple
@@ -6,15 +8,23 @@ from dataclasses import dataclass, field
 from typing import AnyStr, Dict, List
 
 import numpy as np
-from scipy.sparse import csr_matrix
+from scipy.sparse import csr_matrix, vstack
 from sentence_transformers import SentenceTransformer
 from sklearn.cluster import AgglomerativeClustering
 from sklearn.feature_extraction.text import TfidfTransformer
-from sklearn.metrics.pairwise import cosine_similarity
 from sklearn.preprocessing import normalize
 from sknetwork.clustering import Louvain
 from treelib import Tree
 
+from vdl_tools.scrape_enrich.primer.hierarchical_tagger.binary_store import (
+    csr_from_arrays,
+    csr_to_arrays,
+    ragged_from_arrays,
+    ragged_to_arrays,
+    read_store,
+    write_store,
+)
+
 
 def make_empty_array():
     return np.ndarray([])
@@ -24,6 +34,12 @@ def make_empty_csr_matrix():
     return csr_matrix([])
 
 
+# Number of rows of a similarity matrix computed at a time. Each block holds
+# block size x number of terms similarities before sparsification.
+SIMILARITY_BLOCK_SIZE = 512
+# Number of documents tagged at a time
+DOCUMENT_BATCH_SIZE = 10000
+
 DataProperty = namedtuple(
     "DataProperty", ["n_terms", "n_occurrences", "core_terms", "term_set", "label"]
 )
@@ -68,6 +84,15 @@ class HierarchicalTagger:
         hydrate_tags=True
     )
 
+    # Saving to / loading from a binary model file, which is much faster to load. The arrays are
+    # memory mapped and the tree and tags are restored when first used, not recomputed.
+    hierarchical_tagger.save("tagger.htag")
+    hierarchical_tagger = HierarchicalTagger.load(
+        "tagger.htag",
+        hydrate_tree=True,
+        hydrate_tags=True
+    )
+
     Advanced options:
 
     # Upon document ingestion
@@ -131,6 +156,8 @@ class HierarchicalTagger:
     document_attributes: Dict[AnyStr, Dict] = field(default_factory=dict)
     term_suggestions: List[AnyStr] = field(default_factory=list)
     filter_geo_terms: bool = False
+    # Similarities below it are not kept, None when ingested before it was recorded
+    term_similarity_minimum: float = None
 
     # DERIVED UPON INGEST
     n_docs: int = 0
@@ -139,7 +166,7 @@ class HierarchicalTagger:
     term_counts: Counter = field(default_factory=Counter)
     term_doc_freq: Dict[AnyStr, float] = field(default_factory=dict)
     _term_embeddings: np.array = field(default_factory=make_empty_array)
-    _filtered_term_similarity: np.array = field(default_factory=make_empty_array)
+    _filtered_term_similarity: csr_matrix = field(default_factory=make_empty_csr_matrix)
 
     # FIT TREE INPUT
     term_exclusion_list: List[AnyStr] = field(default_factory=list)
@@ -162,6 +189,9 @@ class HierarchicalTagger:
     min_abstraction_similarity: float = 0.2
     min_tag_score: float = 0.15
 
+    # Loaders of the attributes restored on first use by HierarchicalTagger.load
+    _lazy_loaders: Dict = field(default_factory=dict, repr=False, compare=False)
+
     # CONSTANTS
     TERM_DROP_KEY: str = "---DROP---"
     # From https://www.sbert.net/
@@ -175,6 +205,7 @@ class HierarchicalTagger:
             "term_exclusion_list",
             "term_suggestions",
             "filter_geo_terms",
+            "term_similarity_minimum",
             "n_docs",
             "filtered_terms",
             "term_pipeline",
@@ -213,15 +244,13 @@ class HierarchicalTagger:
                     obj_dict[attr] = np.array(obj_dict[attr])
             elif attr_group == "csr_matrix":
                 for attr in attrs:
-                    # csr_matrix is used for serialization, but obj is transformed to dense array
-                    # for calculations
                     obj_dict[attr] = csr_matrix(
                         (
                             obj_dict[attr]["data"],
                             (obj_dict[attr]["row"], obj_dict[attr]["col"]),
                         ),
                         shape=obj_dict[attr]["shape"],
-                    ).toarray()
+                    )
             elif attr_group == "set":
                 for attr in attrs:
                     obj_dict[attr] = set(obj_dict[attr])
@@ -230,35 +259,26 @@ class HierarchicalTagger:
                 continue
 
         ht_instance = cls(**obj_dict)
+        ht_instance._hydrate(hydrate_tree=hydrate_tree, hydrate_tags=hydrate_tags)
+        return ht_instance
 
+    def _hydrate(self, hydrate_tree=False, hydrate_tags=False):
         if any([hydrate_tree, hydrate_tags]):
             # Recalculate tree with parameter values from serialized object
-            ht_instance.fit_tag_tree(
-                **{
-                    attr: value
-                    for attr, value in obj_dict.items()
-                    if attr
-                    in [
-                        "term_suggestions_doc_freq",
-                        "term_similarity_threshold",
-                        "min_term_cluster_count",
-                        "random_state",
-                    ]
-                }
+            self.fit_tag_tree(
+                term_suggestions_doc_freq=self.term_suggestions_doc_freq,
+                term_similarity_threshold=self.term_similarity_threshold,
+                min_term_cluster_count=self.min_term_cluster_count,
+                random_state=self.random_state,
             )
 
         if hydrate_tags:
             # Recalculate document tags with parameter values from serialized object
-            ht_instance.tag_documents(
-                **{
-                    attr: value
-                    for attr, value in obj_dict.items()
-                    if attr in ["min_abstraction_similarity", "min_tag_score"]
-                }
+            self.tag_documents(
+                min_abstraction_similarity=self.min_abstraction_similarity,
+                min_tag_score=self.min_tag_score,
             )
 
-        return ht_instance
-
     def to_json(self):
 
         obj_dict = {
@@ -267,12 +287,274 @@ class HierarchicalTagger:
             for attr in attrs
         }
 
-        # Use smaller csr_matrix for serialization
-        obj_dict["_filtered_term_similarity"] = csr_matrix(
-            obj_dict["_filtered_term_similarity"]
+        return json.dumps(obj_dict, cls=CustomEncoder)
+
+    def save(self, path):
+        """
+        Saves the tagger to a binary model file, see HierarchicalTagger.load.
+
+        Arrays and sparse matrices are stored as raw buffers that can be memory mapped, documents,
+        the tree and the term sets of its nodes as arrays of term indexes, and the remaining
+        attributes as a compact json header.
+        """
+        header = {
+            attr: getattr(self, attr)
+            for attr in self.SERIALIZED_ATTRS["json_ready"]
+            if attr != "document_terms"
+        }
+        arrays = {
+            "_term_embeddings": np.asarray(self._term_embeddings),
+            **csr_to_arrays(
+                "_filtered_term_similarity", csr_matrix(self._filtered_term_similarity)
+            ),
+        }
+
+        # Documents as indexes in a vocabulary of their terms
+        header["document_ids"] = list(self.document_terms.keys())
+        vocabulary = {}
+        for terms in self.document_terms.values():
+            for term in terms:
+                vocabulary.setdefault(term, len(vocabulary))
+        header["document_vocabulary"] = list(vocabulary)
+        arrays.update(
+            ragged_to_arrays(
+                "document_terms",
+                [[vocabulary[t] for t in terms] for terms in self.document_terms.values()],
+                np.int32,
+            )
         )
 
-        return json.dumps(obj_dict, cls=CustomEncoder)
+        header["fitted"] = "tree" in self.__dict__ or "tree" in self._lazy_loaders
+        if header["fitted"]:
+            header.update(
+                {
+                    attr: getattr(self, attr)
+                    for attr in [
+                        "grouped_terms",
+                        "selected_terms",
+                        "selected_term_counts",
+                        "selected_term_doc_freq",
+                    ]
+                }
+            )
+            selected_term_idxs = {t: i for i, t in enumerate(self.selected_terms)}
+            processed_ids = list(self.processed_document_terms.keys())
+            if processed_ids != header["document_ids"]:
+                header["processed_document_ids"] = processed_ids
+            arrays.update(
+                ragged_to_arrays(
+                    "processed_document_terms",
+                    [
+                        [selected_term_idxs[t] for t in terms]
+                        for terms in self.processed_document_terms.values()
+                    ],
+                    np.int32,
+                )
+            )
+            arrays["_selected_terms_idxs"] = np.array(self._selected_terms_idxs, dtype=np.int64)
+            arrays["_selected_terms_unit_embeddings"] = self._selected_terms_unit_embeddings
+
+            # Tree nodes, in the order of the core nodes which is also the order they were added in
+            core_nodes = self._core_nodes
+            parents = [node.predecessor(self.tree.identifier) for node in core_nodes]
+            arrays["tree.identifier"] = np.array([n.identifier for n in core_nodes], dtype=np.int64)
+            arrays["tree.parent"] = np.array(
+                [-1 if p is None else p for p in parents], dtype=np.int64
+            )
+            arrays["tree.tag"] = np.array(
+                [selected_term_idxs[n.tag] for n in core_nodes], dtype=np.int64
+            )
+            arrays["tree.n_terms"] = np.array([n.data.n_terms for n in core_nodes], dtype=np.int64)
+            arrays["tree.n_occurrences"] = np.array(
+                [n.data.n_occurrences for n in core_nodes], dtype=np.int64
+            )
+            term_sets = [n.data.term_set for n in core_nodes]
+            arrays.update(
+                ragged_to_arrays(
+                    "tree.term_ids",
+                    [[selected_term_idxs[t] for t, _ in ts] for ts in term_sets],
+                    np.int64,
+                )
+            )
+            arrays.update(
+                ragged_to_arrays(
+                    "tree.term_scores", [[x for _, x in ts] for ts in term_sets], np.float64
+                )
+            )
+
+        header["tagged"] = header["fitted"] and (
+            "document_tags" in self.__dict__ or "document_tags" in self._lazy_loaders
+        )
+        if header["tagged"]:
+            for attr in [
+                "_node_term_matrix",
+                "_node_similarity_matrix",
+                "_node_abstraction_matrix",
+                "document_tags_tfidf",
+            ]:
+                arrays.update(csr_to_arrays(attr, getattr(self, attr)))
+            arrays["_node_embeddings"] = np.asarray(self._node_embeddings)
+            arrays["_term_to_node_idx"] = np.array(
+                [self._term_to_node_idx[t] for t in self.selected_terms], dtype=np.int64
+            )
+
+        write_store(path, json.loads(json.dumps(header, cls=CustomEncoder)), arrays)
+
+    @classmethod
+    def load(cls, path, hydrate_tree=False, hydrate_tags=False, mmap_mode="r"):
+        """
+        Loads a tagger saved with HierarchicalTagger.save.
+
+        With mmap_mode="r" the arrays are memory mapped read only, so that processes loading the
+        same file share them. Use mmap_mode=None to read them in memory.
+
+        If the saved tagger was fitted (tagged), hydrate_tree (hydrate_tags) restores the saved
+        tree (document tags) when they are first used. Otherwise they are recalculated as in
+        HierarchicalTagger.from_json.
+        """
+        header, arrays = read_store(path, mmap_mode=mmap_mode)
+
+        document_ids = header.pop("document_ids")
+        vocabulary = header.pop("document_vocabulary")
+        document_terms = {
+            doc_id: [vocabulary[i] for i in term_ids]
+            for doc_id, term_ids in zip(
+                document_ids, ragged_from_arrays("document_terms", arrays)
+            )
+        }
+        fitted = header.pop("fitted")
+        tagged = header.pop("tagged")
+
+        obj_dict = {
+            attr: header[attr]
+            for attr in cls.SERIALIZED_ATTRS["json_ready"]
+            if attr in header
+        }
+        obj_dict["term_counts"] = Counter(obj_dict["term_counts"])
+        obj_dict["document_terms"] = document_terms
+        obj_dict["_term_embeddings"] = arrays["_term_embeddings"]
+        obj_dict["_filtered_term_similarity"] = csr_from_arrays(
+            "_filtered_term_similarity", arrays
+        )
+
+        if not fitted or not any([hydrate_tree, hydrate_tags]):
+            ht_instance = cls(**obj_dict)
+            ht_instance._hydrate(hydrate_tree=hydrate_tree, hydrate_tags=hydrate_tags)
+            return ht_instance
+
+        selected_terms = header["selected_terms"]
+        processed_ids = header.get("processed_document_ids", document_ids)
+        ht_instance = cls(
+            **obj_dict,
+            grouped_terms=header["grouped_terms"],
+            processed_document_terms={
+                doc_id: [selected_terms[i] for i in term_ids]
+                for doc_id, term_ids in zip(
+                    processed_ids, ragged_from_arrays("processed_document_terms", arrays)
+                )
+            },
+            selected_terms=selected_terms,
+            _n_selected_terms=len(selected_terms),
+            _selected_terms_idxs=arrays["_selected_terms_idxs"].tolist(),
+            selected_term_counts=Counter(header["selected_term_counts"]),
+            selected_term_doc_freq=header["selected_term_doc_freq"],
+        )
+        ht_instance._collapse_term_pipeline()
+        ht_instance._selected_terms_unit_embeddings = arrays["_selected_terms_unit_embeddings"]
+        ht_instance._lazy_loaders["_selected_terms_embeddings"] = (
+            ht_instance._load_selected_terms_embeddings
+        )
+        load_tree = functools.partial(ht_instance._load_tree, arrays)
+        for attr in ["tree", "_core_nodes", "_node_id_to_idx", "_node_idx_to_id"]:
+            ht_instance._lazy_loaders[attr] = load_tree
+
+        if not hydrate_tags:
+            return ht_instance
+        if not tagged:
+            ht_instance.tag_documents(
+                min_abstraction_similarity=ht_instance.min_abstraction_similarity,
+                min_tag_score=ht_instance.min_tag_score,
+            )
+            return ht_instance
+
+        for attr in [
+            "_node_term_matrix",
+            "_node_similarity_matrix",
+            "_node_abstraction_matrix",
+            "document_tags_tfidf",
+        ]:
+            setattr(ht_instance, attr, csr_from_arrays(attr, arrays))
+        ht_instance._node_embeddings = arrays["_node_embeddings"]
+        ht_instance._term_to_node_idx = dict(
+            zip(selected_terms, arrays["_term_to_node_idx"].tolist())
+        )
+        ht_instance._lazy_loaders["document_tags"] = ht_instance._set_document_tags
+        for attr in ["_term_abstraction_matrix", "_selected_term_to_idx"]:
+            ht_instance._lazy_loaders[attr] = ht_instance._load_term_abstraction_matrix
+        ht_instance._lazy_loaders["document_tag_matrix"] = ht_instance._load_document_tag_matrix
+        return ht_instance
+
+    def _load_selected_terms_embeddings(self):
+        self._selected_terms_embeddings = self._term_embeddings[self._selected_terms_idxs]
+
+    def _load_tree(self, arrays):
+        """Restores the tree and core nodes saved with HierarchicalTagger.save."""
+        for attr in ["tree", "_core_nodes", "_node_id_to_idx", "_node_idx_to_id"]:
+            self._lazy_loaders.pop(attr, None)
+
+        term_ids = ragged_from_arrays("tree.term_ids", arrays)
+        term_scores = ragged_from_arrays("tree.term_scores", arrays)
+        self.tree = Tree()
+        self._core_nodes = []
+        for i, identifier in enumerate(arrays["tree.identifier"].tolist()):
+            parent = int(arrays["tree.parent"][i])
+            node_term = self.selected_terms[arrays["tree.tag"][i]]
+            n_occurrences = int(arrays["tree.n_occurrences"][i])
+            ranked_terms = [self.selected_terms[t] for t in term_ids[i]]
+            node = self.tree.create_node(
+                node_term,
+                identifier,
+                parent=None if parent == -1 else parent,
+                data=DataProperty(
+                    int(arrays["tree.n_terms"][i]),
+                    n_occurrences,
+                    ranked_terms[:3],
+                    list(zip(ranked_terms, np.array(term_scores[i]))),
+                    f"{node_term} - {n_occurrences}",
+                ),
+            )
+            self._core_nodes.append(node)
+
+        # Mapping of node identifier to node index, as set when tagging documents
+        self._node_id_to_idx = {node.identifier: i for i, node in enumerate(self._core_nodes)}
+        self._node_idx_to_id = {i: node.identifier for i, node in enumerate(self._core_nodes)}
+
+    def _load_term_abstraction_matrix(self):
+        """Rebuilds the terms X nodes matrix of a tagger loaded with its document tags."""
+        for attr in ["_term_abstraction_matrix", "_selected_term_to_idx"]:
+            self._lazy_loaders.pop(attr, None)
+        self._build_term_abstraction_matrix()
+
+    def _load_document_tag_matrix(self):
+        self.document_tag_matrix = self._build_document_tag_matrix()
+
+    def __getstate__(self):
+        # Restore the lazily loaded attributes, so that a pickled tagger does not depend on the
+        # model file it was loaded from
+        for name in list(self._lazy_loaders):
+            if name in self._lazy_loaders:
+                getattr(self, name)
+        return self.__dict__.copy()
+
+    def __getattr__(self, name):
+        # Only called for attributes that are not set, restores the lazily loaded ones
+        lazy_loaders = self.__dict__.get("_lazy_loaders")
+        if lazy_loaders and name in lazy_loaders:
+            lazy_loaders.pop(name)()
+            return getattr(self, name)
+        raise AttributeError(
+            f"'{type(self).__name__}' object has no attribute '{name}'"
+        )
 
     def ingest(
         self,
@@ -281,6 +563,7 @@ class HierarchicalTagger:
         term_suggestions: List[AnyStr] = None,
         filter_geo_terms: bool = False,
         term_similarity_minimum: float = 0.6,
+        term_similarity_top_k: int = None,
     ):
         """
         The ingest step involves going from the terms as they appear in the documents, to a filtered
@@ -289,14 +572,21 @@ class HierarchicalTagger:
         We attempt to reduces the term set by combining plurals with singulars and, optionally,
         removing geographical names. We then map all the remining filtered_terms into an embedding
         space using a large language model.
+
+        Only term similarities of at least term_similarity_minimum, and optionally only the
+        term_similarity_top_k highest similarities of each term, are kept in a sparse matrix.
+        term_similarity_threshold must not be lower than term_similarity_minimum when fitting.
         """
 
         # Set up starting values
         self._intialize_ingest(document_terms, document_attributes, term_suggestions)
+        self.term_similarity_minimum = term_similarity_minimum
 
         # Create a clean term set from documents and suggestions
         self._clean_up_terms(
-            filter_geo_terms, term_similarity_minimum=term_similarity_minimum
+            filter_geo_terms,
+            term_similarity_minimum=term_similarity_minimum,
+            term_similarity_top_k=term_similarity_top_k,
         )
 
     def _intialize_ingest(self, document_terms, document_attributes, term_suggestions):
@@ -314,7 +604,9 @@ class HierarchicalTagger:
         self.document_attributes = document_attributes
         self.n_docs = len(document_terms)
 
-    def _clean_up_terms(self, filter_geo_terms, term_similarity_minimum=0.6):
+    def _clean_up_terms(
+        self, filter_geo_terms, term_similarity_minimum=0.6, term_similarity_top_k=None
+    ):
         # Create term set from documents and suggestions
         self._create_term_set()
         # Remove plurals
@@ -327,7 +619,8 @@ class HierarchicalTagger:
         self._semantic_term_map()
         # Create a term similarity matrix, subject to minimum similarity
         self._create_filtered_term_similarity(
-            term_similarity_minimum=term_similarity_minimum
+            term_similarity_minimum=term_similarity_minimum,
+            term_similarity_top_k=term_similarity_top_k,
         )
 
     def _create_term_set(self):
@@ -408,14 +701,16 @@ class HierarchicalTagger:
         self.filtered_terms = list(self.filtered_terms)
         self._term_embeddings = self.ENCODER.encode(self.filtered_terms)
 
-    def _create_filtered_term_similarity(self, term_similarity_minimum=0.6):
-        self._filtered_term_similarity = cosine_similarity(self._term_embeddings)
-        # To reduce memory footprint we set all 'low' similarities to zero and convert to csr_matrix
-        # upon serialization
-        if term_similarity_minimum:
-            self._filtered_term_similarity[
-                self._filtered_term_similarity < term_similarity_minimum
-            ] = 0
+    def _create_filtered_term_similarity(
+        self, term_similarity_minimum=0.6, term_similarity_top_k=None
+    ):
+        # To reduce memory footprint the similarities are computed in blocks of terms and only the
+        # 'high' similarities are kept, in a csr_matrix
+        self._filtered_term_similarity = sparse_cosine_similarity(
+            self._term_embeddings,
+            min_similarity=term_similarity_minimum or None,
+            top_k=term_similarity_top_k,
+        )
 
     #
     # EXTRACT THE HIERARCHICAL TAG TREE
@@ -462,6 +757,16 @@ class HierarchicalTagger:
     ):
         """Resets attributes to empty containers and/or user arguments."""
 
+        if (
+            self.term_similarity_minimum is not None
+            and term_similarity_threshold < self.term_similarity_minimum
+        ):
+            # The similarities in between were not kept when ingesting
+            raise ValueError(
+                f"term_similarity_threshold ({term_similarity_threshold}) must not be lower than "
+                f"the term_similarity_minimum the documents were ingested with "
+                f"({self.term_similarity_minimum})."
+            )
         self.term_exclusion_list = (
             list({t.lower() for t in term_exclusion_list})
             if term_exclusion_list is not None
@@ -516,9 +821,9 @@ class HierarchicalTagger:
         """
 
         louvain = Louvain(random_state=self.random_state)
-        adjacency = copy.deepcopy(self._filtered_term_similarity)
-        adjacency[adjacency < self.term_similarity_threshold] = 0
-        adjacency = csr_matrix(adjacency)
+        adjacency = self._filtered_term_similarity.copy()
+        adjacency.data[adjacency.data < self.term_similarity_threshold] = 0
+        adjacency.eliminate_zeros()
         labels = louvain.fit_transform(adjacency)
 
         # Store clustering in dict mapping cluster_label to list of terms
@@ -586,20 +891,20 @@ class HierarchicalTagger:
 
         term_to_representative_term_step = {}
         selected_terms = []
+        filtered_term_idxs = {t: i for i, t in enumerate(self.filtered_terms)}
 
         for terms in self.grouped_terms.values():
             if len(terms) > 1:
-                term_ids = [self.filtered_terms.index(t) for t in terms]
+                term_ids = [filtered_term_idxs[t] for t in terms]
                 # Numerical errors were leading to non-reproducibility of results.
                 # Use slower dtype=float64 as in Notes here
                 # https://numpy.org/doc/stable/reference/generated/numpy.sum.html
-                central_term_id = term_ids[
-                    np.argsort(
-                        -self._filtered_term_similarity[term_ids, :][:, term_ids].sum(
-                            axis=1, dtype="float64"
-                        )
-                    )[0]
-                ]
+                term_similarity_sums = np.asarray(
+                    self._filtered_term_similarity[term_ids][:, term_ids].sum(
+                        axis=1, dtype="float64"
+                    )
+                ).ravel()
+                central_term_id = term_ids[np.argsort(-term_similarity_sums)[0]]
                 central_term = self.filtered_terms[central_term_id]
                 selected_terms.append(central_term)
                 for term in terms:
@@ -617,11 +922,7 @@ class HierarchicalTagger:
         representation using terms that have been fully processed.
         """
 
-        # Collapse all pipeline steps to generate a single DAG showing how each term is transformed
-        # at each step.
-        self._collapsed_term_pipeline = dict()
-        for pipeline_step in self.term_pipeline.values():
-            self._collapsed_term_pipeline.update(pipeline_step)
+        self._collapse_term_pipeline()
 
         # Run all document terms through term pipeline
         processed_document_terms = {}
@@ -637,6 +938,13 @@ class HierarchicalTagger:
 
         self.processed_document_terms = processed_document_terms
 
+    def _collapse_term_pipeline(self):
+        # Collapse all pipeline steps to generate a single DAG showing how each term is transformed
+        # at each step.
+        self._collapsed_term_pipeline = dict()
+        for pipeline_step in self.term_pipeline.values():
+            self._collapsed_term_pipeline.update(pipeline_step)
+
     def _run_term_through_pipeline(self, term):
         """
         Recursively traverse the term transformation DAG and yield the final term, or None if term
@@ -697,17 +1005,17 @@ class HierarchicalTagger:
                 )
 
         # Slice embeddings matrix to focus on selected terms
+        filtered_term_idxs = {t: i for i, t in enumerate(self.filtered_terms)}
         self._selected_terms_idxs = [
-            self.filtered_terms.index(t) for t in self.selected_terms
+            filtered_term_idxs[t] for t in self.selected_terms
         ]
         self._selected_terms_embeddings = copy.deepcopy(
             self._term_embeddings[self._selected_terms_idxs]
         )
 
-        # Calculate similarity across selected terms
-        self._selected_terms_similarity = cosine_similarity(
-            self._selected_terms_embeddings
-        )
+        # Similarity across selected terms is the dot product of the normalized embeddings. It is
+        # computed for the needed subsets of terms instead of as a full terms X terms matrix.
+        self._selected_terms_unit_embeddings = normalize(self._selected_terms_embeddings)
 
     def _extract_tag_tree(self):
 
@@ -720,7 +1028,7 @@ class HierarchicalTagger:
     def _build_term_hierarchy(self):
         self.hierarchy = AgglomerativeClustering(
             n_clusters=None,
-            affinity="cosine",
+            metric="cosine",
             memory=None,
             connectivity=None,
             compute_full_tree="auto",
@@ -858,14 +1166,15 @@ class HierarchicalTagger:
         more.
         """
 
-        # Similarities in the term set
-        sim_subgraph = self._selected_terms_similarity[term_ids, :][:, term_ids]
+        # Embeddings of the term set
+        unit_embeddings = self._selected_terms_unit_embeddings[term_ids]
         # Term document frequencies
         weights = np.array(
             [self.selected_term_doc_freq[self.selected_terms[i]] for i in term_ids]
         )
-        # Weighted average term similarity
-        term_scores = (sim_subgraph * weights.T).sum(axis=1)
+        # Weighted average term similarity, ie term similarities X weights without computing the
+        # terms X terms similarities
+        term_scores = unit_embeddings @ (unit_embeddings.T @ weights)
 
         # Rankings
         ranked_term_ids = [term_ids[i] for i in np.argsort(-term_scores)]
@@ -922,7 +1231,10 @@ class HierarchicalTagger:
     #
 
     def tag_documents(
-        self, min_abstraction_similarity: float = 0.2, min_tag_score: float = 0.15
+        self,
+        min_abstraction_similarity: float = 0.2,
+        min_tag_score: float = 0.15,
+        batch_size: int = DOCUMENT_BATCH_SIZE,
     ):
         """
         Maps document topics to hierarchical tags.
@@ -954,6 +1266,10 @@ class HierarchicalTagger:
                 document X node matrix.
             6. To account for the fact that higher level abstractions are going to show up more
                 often, we run this final matrix through a tfidf transformation.
+
+        Steps 4 and 5 are sparse matrix products: each term is mapped to the thresholded
+        abstractions of its closest node once, and batches of batch_size documents X terms
+        matrices are multiplied by this terms X nodes matrix.
         """
         # Set values
         self.min_abstraction_similarity = min_abstraction_similarity
@@ -964,22 +1280,23 @@ class HierarchicalTagger:
         self._build_node_similarity_matrix()  # Step 2; nodes X nodes matrix
         self._build_node_abstraction_matrix()  # Step 3 node X nodes matrix
         self._match_terms_to_nodes()  # Step 4a; dict term -> closest node
+        self._build_term_abstraction_matrix()  # Step 4b; terms X nodes matrix
 
         # Match all documents to tags and abstractions
-        self.document_tag_matrix = np.vstack(
-            [
-                self._document_topics_to_tags(document_terms)  # Step 4a, 4b and 5
-                for document_terms in self.processed_document_terms.values()
-            ]
-        )  # documents x nodes matrix
+        self.document_tag_matrix = self._build_document_tag_matrix(
+            batch_size=batch_size
+        )  # Step 5; sparse documents x nodes matrix
 
         tfidf = TfidfTransformer()  # Step 6
         self.document_tags_tfidf = tfidf.fit_transform(self.document_tag_matrix)
 
+        self._set_document_tags()
+
+    def _set_document_tags(self):
+        """Convert documents x nodes matrix to document_id -> tags dictionary"""
         self.document_tags = defaultdict(list)
         doc_ids = list(self.processed_document_terms.keys())
 
-        # Convert documents x nodes matrix to document_id -> tags dictionary
         cx = self.document_tags_tfidf.tocoo()
         for idx, i, v in zip(cx.row, cx.col, cx.data):
             if v > self.min_tag_score:
@@ -997,6 +1314,8 @@ class HierarchicalTagger:
         measure of centrality.
         """
 
+        selected_term_idxs = {term: i for i, term in enumerate(self.selected_terms)}
+
         # Populate as sparse matrix
         rows = list()
         cols = list()
@@ -1006,7 +1325,7 @@ class HierarchicalTagger:
                 [i] * core_node.data.n_terms
             )  # Rows in same order as _core_nodes
             terms, datum = zip(*core_node.data.term_set)
-            col = np.array([self.selected_terms.index(term) for term in terms])
+            col = np.array([selected_term_idxs[term] for term in terms])
             rows.extend(row)
             cols.extend(col)
             data.extend(datum)
@@ -1092,68 +1411,65 @@ class HierarchicalTagger:
             raw_similarity_matrix[normalization_denominator>0] /
             normalization_denominator[normalization_denominator>0]
         )
+
+        With term_similarity = unit_term_embeddings * unit_term_embeddings.T, the raw similarity
+        is the dot product of the node embeddings entity_set_features * unit_term_embeddings and
+        the normalized similarity is their cosine similarity. We compute it in blocks of nodes,
+        keeping only the similarities above min_abstraction_similarity (lower similarities are
+        silenced when tagging anyway) in a sparse nodes X nodes matrix.
+        Nodes with 0 for all features have 0 similarity with all nodes, as above.
         """
 
-        raw_node_sim = (
-            self._node_term_matrix
-            * self._selected_terms_similarity
-            * self._node_term_matrix.T
-        )
-        normalization_denominator = np.sqrt(
-            raw_node_sim.diagonal()[:, None] * raw_node_sim.diagonal()
-        )
-        node_similarity_matrix = copy.deepcopy(raw_node_sim)
-        node_similarity_matrix[normalization_denominator > 0] = (
-            raw_node_sim[normalization_denominator > 0]
-            / normalization_denominator[normalization_denominator > 0]
+        self._node_embeddings = self._node_term_matrix @ self._selected_terms_unit_embeddings
+        self._node_similarity_matrix = sparse_cosine_similarity(
+            self._node_embeddings, min_similarity=self.min_abstraction_similarity
         )
 
-        self._node_similarity_matrix = node_similarity_matrix
-
     def _build_node_abstraction_matrix(self):
         """Matrix mapping nodes (rows) to all related higher-order nodes (ie abstractions)."""
 
         rows = list()
         cols = list()
-        data = list()
         for i in range(len(self._core_nodes)):
-            _, col, scores = zip(*self._get_node_abstractions(i))
-            row = np.array([i] * len(scores))
-            rows.extend(row)
+            col = self._get_node_lineage_idxs(i)
+            rows.extend([i] * len(col))
             cols.extend(col)
-            data.extend(scores)
 
-        rows = np.array(rows)
-        cols = np.array(cols)
-        data = np.array(data)
+        rows = np.array(rows, dtype=int)
+        cols = np.array(cols, dtype=int)
+        # Look up all the node to abstraction similarities at once in the sparse similarity matrix
+        data = np.asarray(self._node_similarity_matrix[rows, cols]).ravel()
 
         node_abstraction_matrix = csr_matrix(
             (data, (rows, cols)), shape=(len(self._core_nodes), len(self._core_nodes))
         )
+        node_abstraction_matrix.eliminate_zeros()
 
         self._node_abstraction_matrix = node_abstraction_matrix
 
+    def _get_node_lineage_idxs(self, node_idx):
+        """Look up the indexes of the node and all its higher-order nodes."""
+        lineage = self._show_term_lineage(self._core_nodes[node_idx].identifier)
+        return [
+            self._node_id_to_idx[l.identifier]
+            for l in lineage
+            if self._node_id_to_idx.get(l.identifier) is not None
+        ]
+
     def _get_node_abstractions(self, node_idx):
         """
         Look up all higher-order nodes for given node_id and collect node.identifier and similarity
         score.
         """
-        lineage = self._show_term_lineage(self._core_nodes[node_idx].identifier)
-
-        abstractions = [
+        return [
             (
-                l.tag,
-                self._node_id_to_idx[l.identifier],
-                self._node_similarity_matrix[
-                    node_idx, self._node_id_to_idx[l.identifier]
-                ],
+                self._core_nodes[idx].tag,
+                idx,
+                self._node_similarity_matrix[node_idx, idx],
             )
-            for l in lineage
-            if self._node_id_to_idx.get(l.identifier) is not None
+            for idx in self._get_node_lineage_idxs(node_idx)
         ]
 
-        return abstractions
-
     def _show_term_lineage(self, node_id):
         # Return all the parent nodes up to the top
 
@@ -1170,49 +1486,95 @@ class HierarchicalTagger:
         # Refer to discussion in _build_node_similarity_matrix
         # Here we are matching the terms themselves to the nodes. The matrix in the left of
         # selected_term_similarity would just be the identity matrix.
-        raw_term_to_node_sim = (
-            self._selected_terms_similarity * self._node_term_matrix.T
-        )
-
-        # non_normalized_single_term_similarity_matrix =
-        # identity x selected_term_similarity x identity -->
-        # selected_term_similarity (diagonal is one...)
-        non_normalized_node_similarity_matrix = (
-            self._node_term_matrix
-            * self._selected_terms_similarity
-            * self._node_term_matrix.T
-        )
-        normalization_denominator = np.sqrt(
-            self._selected_terms_similarity.diagonal()[:, None]
-            * non_normalized_node_similarity_matrix.diagonal()
-        )
-        term_to_node_sim = copy.deepcopy(raw_term_to_node_sim)
-        term_to_node_sim[normalization_denominator > 0] = (
-            raw_term_to_node_sim[normalization_denominator > 0]
-            / normalization_denominator[normalization_denominator > 0]
-        )
-        # Closest node to term. Matrix to dictionary.
-        term_to_node_matches = np.argmax(term_to_node_sim, axis=1)
+        # The normalized similarity is then the cosine similarity of the term and node embeddings
+        # (the self-similarity of the terms is one), computed in blocks of terms.
+        unit_node_embeddings = normalize(self._node_embeddings)
+        term_to_node_matches = np.concatenate(
+            [
+                # Closest node to term.
+                np.argmax(
+                    self._selected_terms_unit_embeddings[start:start + SIMILARITY_BLOCK_SIZE]
+                    @ unit_node_embeddings.T,
+                    axis=1,
+                )
+                for start in range(0, self._n_selected_terms, SIMILARITY_BLOCK_SIZE)
+            ]
+        ).astype(int)
+        # Matrix to dictionary.
         self._term_to_node_idx = {
             term: node_idx
             for term, node_idx in zip(self.selected_terms, term_to_node_matches)
         }
 
+    def _build_term_abstraction_matrix(self):
+        """
+        Matrix mapping selected terms (rows) to their closest node and its abstractions, with all
+        abstractions below threshold similarity silenced.
+        """
+        node_abstractions = self._node_abstraction_matrix.copy()
+        node_abstractions.data[
+            node_abstractions.data <= self.min_abstraction_similarity
+        ] = 0
+        node_abstractions.eliminate_zeros()
+
+        term_node_idxs = np.array(
+            [self._term_to_node_idx[term] for term in self.selected_terms], dtype=int
+        )
+        self._term_abstraction_matrix = node_abstractions[term_node_idxs]
+        self._selected_term_to_idx = {term: i for i, term in enumerate(self.selected_terms)}
+
+    def _build_document_term_matrix(self, documents_terms):
+        """Sparse documents X selected terms matrix of term occurrences."""
+        selected_term_idxs = self._selected_term_to_idx
+        indptr = np.zeros(len(documents_terms) + 1, dtype=np.int64)
+        np.cumsum([len(terms) for terms in documents_terms], out=indptr[1:])
+        indices = np.fromiter(
+            (selected_term_idxs[term] for terms in documents_terms for term in terms),
+            dtype=np.int64,
+            count=int(indptr[-1]),
+        )
+        return csr_matrix(
+            (np.ones(len(indices)), indices, indptr),
+            shape=(len(documents_terms), self._n_selected_terms),
+        )
+
+    def _build_document_tag_matrix(self, batch_size=DOCUMENT_BATCH_SIZE):
+        """
+        Sum the abstractions of the terms of each document, one batch of documents at a time.
+        Returns a sparse documents X nodes matrix.
+        """
+        documents_terms = iter(self.processed_document_terms.values())
+        batches = []
+        while True:
+            batch = list(itertools.islice(documents_terms, batch_size))
+            if not batch:
+                break
+            batches.append(
+                self._build_document_term_matrix(batch) @ self._term_abstraction_matrix
+            )
+
+        if not batches:
+            return csr_matrix((0, len(self._core_nodes)))
+        document_tag_matrix = vstack(batches, format="csr")
+        # Same order of the tags within a document as in a matrix built from dense rows
+        document_tag_matrix.sort_indices()
+        return document_tag_matrix
+
     def _document_topics_to_tags(self, document_terms):
-        # For all document terms find matching closest node ids
-        node_ids = [self._term_to_node_idx[term] for term in document_terms]
-        # Look up nodes and their abstractions in node_abstraction_matrix
-        node_abstractions = self._node_abstraction_matrix[node_ids]
-        # Silence all abstractions below threshold similarity value
-        node_abstractions[node_abstractions <= self.min_abstraction_similarity] = 0
-        # Sum across to get document to tags match with weights
-        return node_abstractions.sum(axis=0)
+        # For all document terms look up their closest node and its abstractions, and sum across
+        # to get document to tags match with weights, as a row of document_tag_matrix
+        return (
+            self._build_document_term_matrix([document_terms])
+            @ self._term_abstraction_matrix
+        ).toarray()
 
 
 class CustomEncoder(json.JSONEncoder):
     def default(self, obj):
         if isinstance(obj, np.ndarray):
             return obj.tolist()
+        elif isinstance(obj, np.generic):
+            return obj.item()
         elif isinstance(obj, csr_matrix):
             obj_coo = obj.tocoo()
             return {
@@ -1227,6 +1589,45 @@ class CustomEncoder(json.JSONEncoder):
             return json.JSONEncoder.default(self, obj)
 
 
+def sparse_cosine_similarity(
+    embeddings, min_similarity=None, top_k=None, block_size=SIMILARITY_BLOCK_SIZE
+):
+    """
+    Cosine similarity across the rows of embeddings, as a sparse csr_matrix.
+
+    The similarities are computed in blocks of block_size rows and, for each block, only the
+    similarities of at least min_similarity and the top_k highest similarities of each row are
+    kept, so that the dense rows X rows matrix is never built. Rows of zeros have 0 similarity.
+    Note that keeping the top_k similarities can make the matrix non symmetric.
+    """
+    unit_embeddings = normalize(embeddings)
+    n_rows = unit_embeddings.shape[0]
+
+    rows, cols, data = [], [], []
+    for start in range(0, n_rows, block_size):
+        block = unit_embeddings[start:start + block_size] @ unit_embeddings.T
+        if top_k is not None and top_k < n_rows:
+            # Silence all but the top_k similarities of each row
+            below_top_k = np.argpartition(-block, top_k, axis=1)[:, top_k:]
+            np.put_along_axis(block, below_top_k, 0, axis=1)
+        if min_similarity is not None:
+            keep = block >= min_similarity
+            keep &= block != 0
+        else:
+            keep = block != 0
+        block_rows, block_cols = np.nonzero(keep)
+        rows.append(block_rows + start)
+        cols.append(block_cols)
+        data.append(block[block_rows, block_cols])
+
+    if not rows:
+        return csr_matrix((n_rows, n_rows), dtype=unit_embeddings.dtype)
+    return csr_matrix(
+        (np.concatenate(data), (np.concatenate(rows), np.concatenate(cols))),
+        shape=(n_rows, n_rows),
+    )
+
+
 def get_locations_set():
     """
     Collects a standard set of locations to allow filtering these from the term set.
@@ -0,0 +1,106 @@
+import hashlib
+import pickle
+
+import numpy as np
+import pytest
+from sklearn.metrics.pairwise import cosine_similarity
+
+from vdl_tools.scrape_enrich.primer.hierarchical_tagger.hierarchical_tagger import (
+    HierarchicalTagger,
+    sparse_cosine_similarity,
+)
+
+BASES = ["solar", "wind", "battery", "hydrogen"]
+MODIFIERS = ["power", "storage", "policy"]
+DOCS = {
+    str(i): [f"{BASES[i % 4]} {MODIFIERS[i % 3]}", f"{BASES[(i + 1) % 4]} {MODIFIERS[(i + 2) % 3]}"]
+    for i in range(40)
+}
+
+
+class _HashEncoder:
+    """Encodes terms sharing their first word close to each other, without a language model."""
+
+    def encode(self, terms):
+        def _vector(text, size=16):
+            seed = int(hashlib.md5(text.encode()).hexdigest()[:8], 16)
+            return np.random.default_rng(seed).normal(size=size)
+
+        return np.array([_vector(t.split()[0]) + 0.4 * _vector(t) for t in terms])
+
+
+@pytest.fixture
+def encoder(monkeypatch):
+    monkeypatch.setattr(HierarchicalTagger, "ENCODER", _HashEncoder())
+
+
+@pytest.mark.parametrize("min_similarity", [None, 0.2])
+def test_sparse_cosine_similarity_matches_dense(min_similarity):
+    embeddings = np.random.default_rng(0).normal(size=(50, 8))
+    embeddings[7] = 0
+
+    expected = cosine_similarity(embeddings)
+    if min_similarity is not None:
+        expected[expected < min_similarity] = 0
+
+    result = sparse_cosine_similarity(embeddings, min_similarity=min_similarity, block_size=16)
+    np.testing.assert_allclose(result.toarray(), expected, atol=1e-12)
+
+
+def test_fit_tag_tree_rejects_threshold_below_ingested_minimum(encoder):
+    ht = HierarchicalTagger()
+    ht.ingest(DOCS, term_similarity_minimum=0.7)
+    with pytest.raises(ValueError):
+        ht.fit_tag_tree(term_similarity_threshold=0.5)
+
+
+@pytest.fixture
+def tagger(encoder):
+    ht = HierarchicalTagger()
+    ht.ingest(DOCS)
+    ht.fit_tag_tree(random_state=1, min_term_cluster_count=1)
+    ht.tag_documents()
+    return ht
+
+
+def test_save_load_restores_tree_and_tags(tagger, tmp_path):
+    path = tmp_path / "tagger.htag"
+    tagger.save(path)
+
+    loaded = HierarchicalTagger.load(path, hydrate_tree=True, hydrate_tags=True)
+    # restored when first used
+    assert "tree" not in loaded.__dict__
+    assert loaded.tree.to_dict(with_data=True) == tagger.tree.to_dict(with_data=True)
+    np.testing.assert_array_equal(
+        loaded._selected_terms_embeddings, tagger._selected_terms_embeddings
+    )
+    assert dict(loaded.document_tags) == dict(tagger.document_tags)
+
+
+def test_loaded_tagger_can_be_pickled(tagger, tmp_path):
+    path = tmp_path / "tagger.htag"
+    tagger.save(path)
+
+    loaded = HierarchicalTagger.load(path, hydrate_tree=True, hydrate_tags=True)
+    unpickled = pickle.loads(pickle.dumps(loaded))
+    assert unpickled._lazy_loaders == {}
+    assert unpickled.tree.to_dict(with_data=True) == tagger.tree.to_dict(with_data=True)
+    assert dict(unpickled.document_tags) == dict(tagger.document_tags)
+
+
+def test_loaded_tagger_tags_documents(tagger, tmp_path):
+    path = tmp_path / "tagger.htag"
+    tagger.save(path)
+
+    loaded = HierarchicalTagger.load(path, hydrate_tree=True, hydrate_tags=True)
+    np.testing.assert_allclose(
+        loaded.document_tag_matrix.toarray(), tagger.document_tag_matrix.toarray()
+    )
+    first_doc_terms = next(iter(tagger.processed_document_terms.values()))
+    np.testing.assert_allclose(
+        loaded._document_topics_to_tags(first_doc_terms), tagger.document_tag_matrix[[0]].toarray()
+    )
+
+    loaded = HierarchicalTagger.load(path, hydrate_tree=True)
+    loaded.tag_documents()
+    assert dict(loaded.document_tags) == dict(tagger.document_tags)
@@ -12,6 +12,7 @@ import vdl_tools.scrape_enrich.scraper.page_scraper as ps
 import vdl_tools.scrape_enrich.scraper.website_processor as wp
 from vdl_tools.shared_tools.web_summarization.make_page_text import make_group_text, MIN_TEXT_LENGTH
 from vdl_tools.shared_tools.tools.logger import logger
+from vdl_tools.shared_tools.database_cache.bulk_upsert import bulk_upsert
 from vdl_tools.shared_tools.database_cache.database_models.web_scraping import WebPagesScraped, WebPagesParsed
 from vdl_tools.shared_tools.database_cache.database_utils import get_session
 from vdl_tools.shared_tools.tools.text_cleaning import clean_scraped_text
@@ -415,12 +416,8 @@ def scrape_websites_psql(
                         logger.info(f"Scraping chunk {i+1} / {len(scrapping_chunks)}")
                         results = list(executor.map(__get_page_data_parallel, chunk))
                         flat_results = [page for pagelist in results if pagelist  for page in pagelist]
-                        for row in flat_results:
-                            if row['num_errors']:
-                                row['num_errors'] += existing_scraped_keys.get(row['cleaned_key'], 0)
-                            webpage_obj = WebPagesScraped(**row)
-                            session.merge(webpage_obj)
-                            newly_scraped_data.append(webpage_obj.to_dict())
+                        # num_errors are added to the stored count by the upsert
+                        newly_scraped_data.extend(bulk_upsert(session, WebPagesScraped, flat_results))
                         session.commit()
                     except KeyboardInterrupt:
                         logger.warn("Received KeyboardInterrupt, returning the currently scraped data...")
@@ -485,14 +482,16 @@ def scrape_websites_psql(
                     results = list(executor.map(__combine_texts_parallel, chunk_args))
 
                     # Process results and clear them one by one
+                    combined_objs = []
                     for result in results:
                         index_key, source, combined_text = result
                         if not combined_text:
+                            # Added to the stored num_errors by the upsert
                             combined_obj = WebPagesParsed(
                                 cleaned_home_key=index_key,
                                 home_url=source,
                                 combined_text=combined_text,
-                                num_errors=parsed_key_to_num_errors.get(index_key, 0) + 1,
+                                num_errors=1,
                             )
                         else:
                             combined_obj = WebPagesParsed(
@@ -500,10 +499,11 @@ def scrape_websites_psql(
                                 home_url=source,
                                 combined_text=combined_text,
                             )
-                        session.merge(combined_obj)
-                        combined_data.append(combined_obj.to_dict())
+                        combined_objs.append(combined_obj)
                         # Clear individual result
                         del result
+                    combined_data.extend(bulk_upsert(session, WebPagesParsed, combined_objs))
+                    combined_objs = None
 
                     # Clear the entire results list
                     results = None
@@ -7,14 +7,15 @@ Created on Tue Sep 15 18:07:35 2020
 """
 import regex
 import ast
-import multiprocessing as mp
 import numpy as np
 import pandas as pd
 import pathlib as pl
 from ast import literal_eval
 from collections import defaultdict
+from functools import lru_cache
 from vdl_tools.shared_tools.common_functions import create_folders, join_strings_no_missing, write_excel_no_hyper
 from vdl_tools.shared_tools.tools.logger import logger
+from vdl_tools.shared_tools.tools.parallel import parallel_apply_frame, parallel_map
 
 
 def blacklist_wtd_tags(df, tagcol, blacklist):
@@ -33,48 +34,67 @@ def parallel_apply_pandas(data, func, n_cores=8):
     """
     apply a function to a Series or DataFrame in parallel
     splits the data into 1/n_cores chunks and calls func on each chunk
-    map is synchronous so output data is same order as input data
+    output data is same order as input data
     returns a DataFrame (concatenated from each call to func)
+    see vdl_tools.shared_tools.tools.parallel to send large objects once per process
     """
     if n_cores == -1:
-        n_cores = mp.cpu_count()
-    split_data = np.array_split(data, n_cores)
-    pool = mp.Pool(n_cores)
-    results = pd.concat(pool.map(func, split_data))
-    pool.close()
-    pool.join()
-    return results
+        n_cores = None  # all cpus
+    return parallel_apply_frame(data, func, n_chunks=n_cores, max_workers=n_cores)
 
 
-def _get_ngrams_nltk(text, maxwords=5, remove_conjunctions=False):
-    """
-    get 1-, 2-,... up to maxwords from text
-    keep words with hyphens, apostrophes, and phrases with & or 'and'
-    option to clean conjunctions and determinant words
-    then removing all unigram stopwords
+# split into phrases (note: don't split on "-" "&"  "'" or "/")
+_PHRASE_SPLIT = regex.compile('[`\=~!@#$%^*()_+\[\]{};\\\:"<,.|<>?]')  # [-&'/]
 
-    params: text = text block
-    returns: set of unique ngrams
-    """
-    from nltk import everygrams, pos_tag
+
+@lru_cache(maxsize=None)
+def _stopwords():
     from nltk.corpus import stopwords
 
-    stop = set(stopwords.words("english"))
+    return frozenset(stopwords.words("english"))
+
 
-    # split into phrases (note: don't split on "-" "&"  "'" or "/")
-    phrases = regex.split(
-        '[`\=~!@#$%^*()_+\[\]{};\\\:"<,.|<>?]', text.lower()
-    )  # [-&'/]
+def _tokenize(text, remove_conjunctions=False):
+    """
+    lowercased list of words of a text block, as used for the ngrams
+    option to clean conjunctions and determinant words
+    """
+    phrases = _PHRASE_SPLIT.split(text.lower())
     words = [p.split() for p in phrases]  # list of word lists
-    wordlist = sum(words, [])  # combine into list of words
-    wordlist = [word.strip() for word in wordlist]  # strip trailing empty spaces
+    wordlist = [word.strip() for p in words for word in p]  # combine into list of words
 
     if remove_conjunctions:
+        from nltk import pos_tag
+
         # remove 'determiner' (the, a, some, most, every, no) and 'conjunction'
         # (and, or, but, if, while and all) parts of speech words
         STOP_TYPES = ["DT", "CC"]
         words_POS = pos_tag(wordlist)  # add part of speech tags
         wordlist = [w for w, wtype in words_POS if wtype not in STOP_TYPES]
+    return wordlist
+
+
+def _count_ngrams(n_words, maxwords):
+    """number of 1- to maxwords-grams in a list of n_words words"""
+    if n_words <= maxwords:
+        return n_words * (n_words + 1) // 2
+    return maxwords * n_words - maxwords * (maxwords - 1) // 2
+
+
+def _get_ngrams_nltk(text, maxwords=5, remove_conjunctions=False):
+    """
+    get 1-, 2-,... up to maxwords from text
+    keep words with hyphens, apostrophes, and phrases with & or 'and'
+    option to clean conjunctions and determinant words
+    then removing all unigram stopwords
+
+    params: text = text block
+    returns: set of unique ngrams
+    """
+    from nltk import everygrams
+
+    stop = _stopwords()
+    wordlist = _tokenize(text, remove_conjunctions=remove_conjunctions)
 
     # get list of all 1-, maxwords-grams from cleaned wordlist
     # ngrams = list(set(list((' '.join(w) for w in list(everygrams(wordlist, 1, maxwords))))))
@@ -102,7 +122,142 @@ def get_tags_from_ngrams(ngrams_col, tagmap_df):
     Helper fn for parallelization
     ngrams is a Series
     """
-    return ngrams_col.apply(lambda x: find_tags(x, tagmap_df))
+    return KeywordMatcher(tagmap_df).tag_ngrams(ngrams_col)
+
+
+def _as_term_list(terms):
+    """
+    master_term / add_related value as a list of terms
+    strings are comma separated lists, missing values are empty lists
+    """
+    if isinstance(terms, str):
+        terms = terms.replace(", ", ",")
+        return terms.split(",") if terms != "" else []
+    if isinstance(terms, (list, tuple, set, np.ndarray, pd.Series)):
+        return list(terms)
+    return []
+
+
+class KeywordMatcher:
+    """
+    Compiled tag corpus for keyword tagging.
+
+    Maps every search term to the ids of its master terms (and add_related
+    terms) once, so that tagging a document is one dict lookup per ngram
+    instead of a lookup in the indexed corpus.
+
+    tagmap_df = df 'corpus' to map unique search term to LIST of Master Terms
+                and option to add LIST of broader 'Add Related' terms
+                (comma separated strings are accepted too)
+    add_related = whether to add the 'Add Related' terms to the matches
+    """
+
+    def __init__(self, tagmap_df, add_related=True):
+        self.terms = []  # term names by id
+        term_ids = {}
+        self._search_terms = {}  # search term -> tuple of term ids
+        columns = ["master_term", "add_related"] if add_related else ["master_term"]
+        for row in tagmap_df[["search_term"] + columns].itertuples(index=False):
+            ids = list(self._search_terms.get(row[0], ()))
+            for terms in row[1:]:
+                for term in _as_term_list(terms):
+                    if term not in term_ids:
+                        term_ids[term] = len(self.terms)
+                        self.terms.append(term)
+                    ids.append(term_ids[term])
+            self._search_terms[row[0]] = tuple(ids)
+        # words of the search terms and longest search term, ngrams with other
+        # words or more words can't match
+        self._vocabulary = {word for term in self._search_terms for word in str(term).split()}
+        self.max_words = max((len(str(term).split()) for term in self._search_terms), default=0)
+
+    def __len__(self):
+        return len(self._search_terms)
+
+    def __contains__(self, ngram):
+        return ngram in self._search_terms
+
+    def match(self, ngrams):
+        """
+        ngrams = list of ngrams (val, count) tuples for a document
+        returns: list of master term (and associated related terms) tuples with counts
+        """
+        search_terms = self._search_terms
+        counts = {}
+        for ngram, cnt in ngrams:
+            ids = search_terms.get(ngram)
+            if not ids:
+                continue
+            for term_id in ids:
+                counts[term_id] = counts.get(term_id, 0) + cnt
+        return [(self.terms[term_id], cnt) for term_id, cnt in counts.items()]
+
+    def tag_ngrams(self, ngrams_col):
+        """
+        ngrams_col = Series of ngram (val, count) lists
+        returns: Series of (term, count) lists with the same index
+        """
+        return pd.Series(
+            [self.match(ngrams) for ngrams in ngrams_col],
+            index=ngrams_col.index,
+            dtype=object,
+        )
+
+    def match_text(self, text, maxwords=5, remove_conjunctions=False):
+        """
+        keyword matches of a text block, same as matching _get_ngrams_nltk(text)
+
+        the text is tokenized once and only the ngrams of corpus words, up to
+        the longest search term, are built and counted
+        the counts are still fractions of all the 1- to maxwords-grams
+        returns: list of master term (and associated related terms) tuples with counts
+        """
+        stop = _stopwords()
+        words = _tokenize(text, remove_conjunctions=remove_conjunctions)
+        # unigram stopwords are not counted
+        n_ngrams = _count_ngrams(len(words), maxwords) - sum(word in stop for word in words)
+        if n_ngrams <= 0:
+            return []
+
+        search_terms = self._search_terms
+        vocabulary = self._vocabulary
+        max_words = min(maxwords, self.max_words)
+        ngram_counts = {}  # matched ngrams, in order of first occurrence
+        for start in range(len(words)):
+            ngram = None
+            for word in words[start:start + max_words]:
+                if word not in vocabulary:
+                    break
+                if ngram is None:
+                    ngram = word
+                    if word in stop:
+                        continue
+                else:
+                    ngram = f"{ngram} {word}"
+                if ngram in search_terms:
+                    ngram_counts[ngram] = ngram_counts.get(ngram, 0) + 1
+        return self.match((ngram, cnt / n_ngrams) for ngram, cnt in ngram_counts.items())
+
+    def tag_texts(self, text_column, n_cores=1):
+        """
+        get ngrams and keyword matches for each text, without keeping the ngrams
+        text_column = Series of texts
+        n_cores = number of processes, -1 to use all cpus
+                  the matcher is sent once to each process
+        returns: Series of (term, count) lists with the same index
+        """
+        if n_cores == 1:
+            tags = [self.match_text(text) for text in text_column]
+        else:
+            tags = parallel_map(
+                KeywordMatcher.match_text,
+                text_column.tolist(),
+                max_workers=n_cores,
+                shared=self,
+                progress=True,
+                desc="keyword matches",
+            )
+        return pd.Series(tags, index=text_column.index, dtype=object)
 
 
 def find_tags(ngrams, tagmap_df, addRelated=True):
@@ -111,37 +266,10 @@ def find_tags(ngrams, tagmap_df, addRelated=True):
     tagmap_df = df 'corpus' to map unique search term to LIST of Master Terms
                 and option to add  LIST of broader 'Add Related' terms
     returns: list of master term (and associated related terms) tuples with counts
-    """
-    # check if master and add-related are lists
-    for col in ["master_term", "add_related"]:
-        coltype = tagmap_df[col].map(type).mode(0).astype(str) == "<class 'list'>"
-        if coltype is False:
-            # convert to lists if not already
-            tagmap_df[col].fillna("", inplace=True)
-            tagmap_df[col] = tagmap_df[col].str.replace(", ", ",")
-            # convert from string to list
-            tagmap_df[col] = tagmap_df[col].apply(
-                lambda x: x.split(",") if x != "" else list()
-            )
 
-    tagmap = tagmap_df.set_index("search_term")  # index search term for mapping
-    taglist = defaultdict(int)
-    for ng_count in ngrams:  # for each ngram in the text for a given recipient
-        ngram = ng_count[0]
-        cnt = ng_count[1]
-        if ngram in tagmap.index:  # find matching search term
-            mapto = tagmap.loc[ngram].master_term  # get master term from search term
-            for term in mapto:
-                taglist[term] += cnt  # add master term match to list of tags
-            if addRelated:
-                add_ = tagmap.loc[
-                    ngram
-                ].add_related  # get add_related matches from search term
-                if len([add_]) > 0 and add_ == add_:  # append add_related if not empty
-                    for term in add_:
-                        taglist[term] += cnt
-    # list of unique master term and add related term matches as tuples [(term, count)]
-    return list(zip(taglist.keys(), taglist.values()))
+    compiles the corpus on each call, use KeywordMatcher to tag many records
+    """
+    return KeywordMatcher(tagmap_df, add_related=addRelated).match(ngrams)
 
 
 def string2list(df, cols):
@@ -242,6 +370,7 @@ def _search_tags(
     kwds,
     textcols,
     blacklist,
+    n_cores=1,
 ):
     """
     Search tags.
@@ -252,6 +381,7 @@ def _search_tags(
     idCol = unique id or name for merging tag metadata to original data
     kwds = name of new column to create for the keyword tags
     textcols = columns with text to join and use for searching.
+    n_cores = number of processes to search with, -1 to use all cpus
 
     RETURNS =  dataframe with merging id, text, and  added tags
     Also writes this file so it doesn't have to be re-run
@@ -265,21 +395,14 @@ def _search_tags(
     df["text"] = df["text"].fillna("").astype(str)  # make sure it's a string
     df_text = df[[idCol, "text"]]  # trim dataset to id and text block
     df_text = df_text.reset_index(drop=True)  # reset index
-    # get list of ngrams from text for each row
-    logger.info("getting ngrams from text (nltk method)")
-    df_text["ngrams"] = ngrams_from_text(df_text["text"])
-
-    # get keyword matches for manually curated dictionary
-    logger.info("find keyword  matches")
-    df_text[kwds] = df_text["ngrams"].apply(
-        lambda x: find_tags(x, tagcorp_df, addRelated=True)
-    )
+
+    # get list of ngrams (nltk method) and keyword matches for manually curated dictionary
+    logger.info("find keyword matches")
+    matcher = KeywordMatcher(tagcorp_df, add_related=True)
+    df_text[kwds] = matcher.tag_texts(df_text["text"], n_cores=n_cores)
     # remove any blacklisted tags
     df_text[kwds] = df_text[kwds].apply(lambda x: [s for s in x if s[0] not in blacklist])
 
-    # clean columns
-    df_text.drop(["ngrams"], axis=1, inplace=True)
-
     return df_text  # dataframe with merging id, text, and tags
 
 
@@ -296,6 +419,7 @@ def add_kwd_tags(
     add_related="broad_tags",  # name of col with manual list of add_related
     add_unigrams=False,  # add unigrams within 2 or more grams.
     add_bigrams=False,  # add bigrams within 3 or more grams
+    n_cores=1,  # number of processes to search with, -1 to use all cpus
 ):
     """
     add tags from text using curated keyword dictionary
@@ -328,6 +452,7 @@ def add_kwd_tags(
         kwds,
         textcols,
         blacklist,
+        n_cores=n_cores,
     )
 
     # merge tags to main data file
@@ -371,9 +496,7 @@ if __name__ == "__main__":
     df["ngrams"] = df["text"].apply(lambda x: _get_ngrams_nltk(x))
 
     logger.info("find keyword matches")
-    df["keywords"] = df["ngrams"].apply(
-        lambda x: find_tags(x, df_tagmap, addRelated=True)
-    )
+    df["keywords"] = KeywordMatcher(df_tagmap, add_related=True).tag_ngrams(df["ngrams"])
     df["new_kwds"] = df.apply(
         lambda x: list(set(x["keywords"]) - set(x["terms"])), axis=1
     )
@@ -0,0 +1,83 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from vdl_tools.scrape_enrich.tags_from_text import KeywordMatcher, _get_ngrams_nltk, find_tags
+
+
+TEXTS = pd.Series([
+    "Solar panels and solar farms: the green deal for solar energy.",
+    "The Green Deal funds wind power; wind-power co-ops & community solar!",
+    "We build our own heat pumps for the heat pump market.",
+    "Nothing to see here",
+    "",
+])
+
+
+def _tagmap():
+    return pd.DataFrame({
+        "search_term": [
+            "solar",
+            "solar panels",
+            "solar",  # duplicate search term
+            "the green",  # starts with a stopword
+            "the green deal",
+            "wind power",
+            "wind-power",
+            "heat pump",
+            "own",  # stopword unigram, never matched
+        ],
+        "master_term": [
+            ["solar energy"],
+            ["solar energy", "solar panels"],
+            ["community energy"],
+            "climate policy",
+            "climate policy, green deal",  # comma separated master terms
+            ["wind energy"],
+            ["wind energy"],
+            ["heat pumps"],
+            ["ownership"],
+        ],
+        "add_related": [
+            ["renewable energy"],
+            np.nan,
+            ["renewable energy"],
+            np.nan,
+            "policy",
+            ["renewable energy"],
+            np.nan,
+            ["efficiency"],
+            np.nan,
+        ],
+    })
+
+
+def _as_dict(tags):
+    return {term: pytest.approx(cnt) for term, cnt in tags}
+
+
+@pytest.mark.parametrize("add_related", [True, False])
+def test_keyword_matcher_matches_find_tags(add_related):
+    tagmap = _tagmap()
+    matcher = KeywordMatcher(tagmap, add_related=add_related)
+    ngrams = TEXTS.apply(_get_ngrams_nltk)
+    expected = [_as_dict(find_tags(ng, tagmap, addRelated=add_related)) for ng in ngrams]
+
+    assert [_as_dict(matcher.match(ng)) for ng in ngrams] == expected
+    tags = matcher.tag_ngrams(ngrams)
+    assert tags.index.equals(ngrams.index)
+    assert [_as_dict(x) for x in tags] == expected
+    assert [_as_dict(matcher.match_text(text)) for text in TEXTS] == expected
+
+
+def test_keyword_matcher_terms():
+    matcher = KeywordMatcher(_tagmap())
+    tags = [dict(x) for x in matcher.tag_texts(TEXTS)]
+
+    # the duplicate search term adds the master terms of both rows
+    assert {"solar energy", "community energy", "renewable energy"} <= set(tags[0])
+    # comma separated master terms are split, ngrams starting with a stopword are matched
+    assert {"climate policy", "green deal", "policy"} <= set(tags[1])
+    assert tags[1]["climate policy"] == pytest.approx(2 * tags[1]["green deal"])
+    assert "ownership" not in tags[2]
+    assert tags[3] == {} and tags[4] == {}
@@ -1,3 +1,5 @@
+import datetime as dt
+
 import numpy as np
 import pandas as pd
 
@@ -16,6 +18,8 @@ from vdl_tools.shared_tools.org_type_classifier import org_type_classifier
 from vdl_tools.shared_tools.tools.config_utils import get_configuration
 from vdl_tools.shared_tools.tools.falsey_checks import coerced_bool
 from vdl_tools.shared_tools.tools.logger import logger
+from vdl_tools.shared_tools.tools.pipeline import Pipeline, Stage
+from vdl_tools.shared_tools.tools.run_report import RunReport
 from vdl_tools.shared_tools.web_summarization.website_summarization_cache_psql import (
     GENERIC_ORG_WEBSITE_PROMPT_TEXT,
 )
@@ -34,6 +38,18 @@ GLOBAL_CONFIG = get_configuration()
 MAX_WORKERS = 10
 MIN_DESCRIPTION_LENGTH = 100
 TEXT_FIELDS = ["Description", "Description_990", "Website Summary", "About LinkedIn"]
+# The columns written by the geotags and climate_keywords stages, they replace the existing
+# ones when merged. The keyword search rewrites `text` (read by the org type classifier)
+# and fills the missing Sector_String
+GEOTAG_COLUMNS = ["Geo_Tags_Dicts", "Geo_Tags"]
+CLIMATE_KEYWORD_COLUMNS = [
+    "text",
+    "Sector_String",
+    "climate_kwds",
+    "Equity-Justice Mentions",
+    "Approach Tags",
+    "Any Equity-Justice Mention",
+]
 
 
 def get_website_summaries(
@@ -303,10 +319,11 @@ def add_geotags(
     max_workers=MAX_WORKERS,
     id_col='id',
 ):
-    ids_texts = []
-    for _, row in df[[id_col] + text_fields].iterrows():
-        text = "\n".join([row[col] for col in text_fields if row[col] and isinstance(row[col], str)])
-        ids_texts.append((row[id_col], text))
+    texts = [
+        "\n".join([value for value in values if value and isinstance(value, str)])
+        for values in zip(*(df[col] for col in text_fields))
+    ]
+    ids_texts = list(zip(df[id_col], texts))
 
     with get_session(GLOBAL_CONFIG) as session:
         ids_to_geotags = geotag_texts_bulk(
@@ -316,11 +333,13 @@ def add_geotags(
             max_workers=max_workers,
         )
 
+    # flatten the location values once per id rather than once per row
+    ids_to_tags = {
+        id_: [v for geo_dict in geo_dicts_list for v in geo_dict.values() if v]
+        for id_, geo_dicts_list in ids_to_geotags.items()
+    }
     df['Geo_Tags_Dicts'] = df[id_col].map(ids_to_geotags)
-    df['Geo_Tags'] = df['Geo_Tags_Dicts'].apply(
-        lambda geo_dicts_list: [v for geo_dict in geo_dicts_list for v in geo_dict.values() if v]
-        if isinstance(geo_dicts_list, list) else []
-    )
+    df['Geo_Tags'] = [ids_to_tags.get(id_, []) for id_ in df[id_col]]
     return df
 
 
@@ -403,23 +422,9 @@ def log_major_step(text):
     logger.info(full_text)
 
 
-def run_pipeline(
-    paths,
-    relevance_model_name=gpt.cb_cd_model_4omini,
-    relevance_model_system_prompt=None,
-    relevance_model_prompt_format=None,
-    adaptation_model_id=adp.CPI_ADAPTATION_MODEL_2024_ID,
-    num_records=None,
-    run_process_images=False,
-    id_col='id',
-    run_one_earth_taxonomy=True,
-    text_fields=TEXT_FIELDS,
-    label_override_filepath=None,
-    max_workers=MAX_WORKERS,
-):
-
+def load_input(enrich_input_file, num_records=None):
     log_major_step("loading pre-processed combined crunchbase + candid data")
-    df_cb_cd_full = pd.read_json(paths['enrich_input_file'])
+    df_cb_cd_full = pd.read_json(enrich_input_file)
     logger.info("Loaded %s organizations", len(df_cb_cd_full))
 
     if num_records:
@@ -431,10 +436,19 @@ def run_pipeline(
         ])
     else:
         df_cb_cd = df_cb_cd_full
+    return df_cb_cd
 
-    log_major_step("Preparing DF for relevance model")
-    df_cb_cd = prepare_for_relevance_model(df_cb_cd, max_workers=max_workers)
 
+def filter_relevant(
+    df_cb_cd,
+    relevance_model_name,
+    predictions_path,
+    results_path,
+    id_col='id',
+    relevance_model_system_prompt=None,
+    relevance_model_prompt_format=None,
+    label_override_filepath=None,
+):
     # Run Model for CB
     log_major_step("Running relevance model")
     df_cb_cd, df_cb_cd_errors = run_relevance_model(
@@ -444,10 +458,10 @@ def run_pipeline(
         prompt_format=relevance_model_prompt_format,
         column_text='text_for_relevance_model',
         idn=id_col,
-        save_path=paths['relevance_model_predictions_path'],
+        save_path=predictions_path,
         label_override_filepath=label_override_filepath,
     )
-    df_cb_cd.to_json(paths['relevance_model_results'], orient='records')
+    df_cb_cd.to_json(results_path, orient='records')
 
     df_relevant = df_cb_cd[df_cb_cd['prediction_relevant'] == 1].copy()
     logger.info(
@@ -455,7 +469,10 @@ def run_pipeline(
         df_cb_cd.shape[0],
         df_relevant.shape[0],
     )
+    return df_relevant
+
 
+def add_website_summaries(df_relevant, max_workers=MAX_WORKERS):
     log_major_step("Generating website summaries")
 
     # Reset the canonical website column and let `get_website_summaries` fill it in
@@ -474,8 +491,10 @@ def run_pipeline(
     )
     summaries = {extract_website_name(k): v for k, v in summaries.items()}
     df_relevant['Website Summary'] = df_relevant['extracted_website_key'].map(summaries, None)
+    return df_relevant
+
 
-    # LinkedIn
+def add_linkedin(df_relevant):
     log_major_step("Scraping LinkedIn")
     with get_session() as session:
         df_linkedin = li.scrape_organizations_psql(
@@ -504,7 +523,15 @@ def run_pipeline(
         lambda x: x['Original LinkedIn'] if coerced_bool(x['Original LinkedIn']) and coerced_bool(x['datasource']) else None,
         axis=1,
     )
+    return df_relevant
+
 
+def filter_adaptation_mitigation(
+    df_relevant,
+    adaptation_model_id,
+    adaptation_model_path,
+    text_fields=TEXT_FIELDS,
+):
     log_major_step("Cleaning Text Fields")
     # Clean Text of Line Breaks, Tabs, Double Spaces
     for col in text_fields:
@@ -517,7 +544,6 @@ def run_pipeline(
     # Adaptation/Mitigation/Dual
     df_relevant['text'] = cf.join_strings_no_missing(df_relevant, text_fields)
 
-    adaptation_model_path = paths['adaptation_mitigation_results_path']
     adapt_model_name_safe = adaptation_model_id.replace("-", "_").replace(":", "_")
     adaptation_model_path = adaptation_model_path.with_name(
         adaptation_model_path.name.replace("MODEL_NAME_HOLDER", adapt_model_name_safe)
@@ -547,7 +573,15 @@ def run_pipeline(
     )
     log_major_step(f"Removing any organizations without Description, Website Summary, or LinkedIn About: {df_relevant['missing_all_texts'].sum()}")
     df_relevant = df_relevant[~df_relevant['missing_all_texts']].copy()
+    return df_relevant
+
 
+def prepare_for_tagging(
+    df_relevant,
+    results_path,
+    text_fields=TEXT_FIELDS,
+    max_workers=MAX_WORKERS,
+):
     # ADD SUMMARY OF SUMMARIES
     log_major_step("Adding summary of summaries")
     df_relevant = add_summary_of_summaries(
@@ -558,13 +592,21 @@ def run_pipeline(
         max_workers=max_workers,
     )
 
+    df_relevant['text_for_one_earth'] = df_relevant.apply(choose_longer_text, axis=1)
+    df_relevant.to_json(results_path / "df_relevant_pre_taxonomy.json", orient='records')
 
-    # OneEarth
-    log_major_step("Adding One Earth Taxonomy")
+    # PROCESS DIVERSITY TAGS
+    log_major_step("Adding Diversity Tags")
+    cf.string2list(df_relevant, ['diversity'])  # format as lists
+
+    # fill missing values in TEXT_FIELDS with empty strings
+    df_relevant.fillna({col: "" for col in text_fields}, inplace=True)
+    return df_relevant
 
-    df_relevant['text_for_one_earth'] = df_relevant.apply(choose_longer_text, axis=1)
-    df_relevant.to_json(paths['results_path'] / "df_relevant_pre_taxonomy.json", orient='records')
 
+def add_taxonomy(df_relevant, run_one_earth_taxonomy=True, max_workers=MAX_WORKERS):
+    # OneEarth
+    log_major_step("Adding One Earth Taxonomy")
     if run_one_earth_taxonomy:
         df_relevant = add_one_earth_taxonomy(
             df_relevant,
@@ -574,40 +616,41 @@ def run_pipeline(
             max_workers=max_workers,
             force_parents=True,
         )
+    return df_relevant
+
+
+def _stage_columns(df, columns, id_col='id'):
+    """The id column and the columns of df that a stage outputs"""
+    return df[[id_col] + [col for col in columns if col in df.columns]]
+
+
+def _merge_stage_columns(df, df_stage, id_col='id'):
+    """Merges the columns of a stage into df, replacing the ones df already has"""
+    replaced = [col for col in df_stage.columns if col != id_col and col in df.columns]
+    merged = df.drop(columns=replaced).merge(df_stage, on=id_col, how='left')
+    return merged[list(df.columns) + [col for col in df_stage.columns if col not in df.columns]]
 
-    # PROCESS DIVERSITY TAGS
-    log_major_step("Adding Diversity Tags")
-    cf.string2list(df_relevant, ['diversity'])  # format as lists
 
-    # Run Geotagging
+def get_geotags(df_relevant, text_fields=TEXT_FIELDS, max_workers=MAX_WORKERS, id_col='id'):
     log_major_step("Geotagging")
-    # fill missing values in TEXT_FIELDS with empty strings
-    df_relevant.fillna({col: "" for col in text_fields}, inplace=True)
-    df_relevant = add_geotags(df_relevant, text_fields=text_fields, max_workers=max_workers)
+    df_relevant = add_geotags(df_relevant, text_fields=text_fields, max_workers=max_workers, id_col=id_col)
+    return _stage_columns(df_relevant, GEOTAG_COLUMNS, id_col=id_col)
 
-    # Geocode the HQ
-    log_major_step("Geocoding")
-    df_relevant = geocode.add_geo_lat_long(
-        df_relevant,  # use file trimmed of <min search terms
-        idCol="id",  # unique id column
-        address="Location",  # address column
-    )
-    df_relevant = geocode.clean_geo(df_relevant, summarize_new_geo=False)
 
+def add_climate_keyword_tags(df_relevant, keyword_path, text_fields=TEXT_FIELDS, id_col='id'):
     # ADD CLIMATE KEYWORDS
     log_major_step("Adding climate keywords using simple n-gram match")
     # load kwd mapping table (here it is master_term: [list of search terms])
     # terms used in database search
-    df_climate_kwds = pd.read_excel(
-        paths['common_kwds'] / "climate_kwd_map_byTag.xlsx", engine='openpyxl'
-    )
+    df_climate_kwds = pd.read_excel(keyword_path, engine='openpyxl')
     cf.string2list(
         df_climate_kwds,
         ['broad_tags', 'bigram', 'unigram', 'search_terms']  # format as lists
     )
     df_relevant = add_climate_keywords(
         df=df_relevant,
-        keyword_path=paths['common_kwds'] / "climate_kwd_map_byTag.xlsx",
+        keyword_path=keyword_path,
+        id_col=id_col,
         df_climate_kwds=df_climate_kwds,
         # Add the Sector_String column as a column to search
         text_fields=text_fields + ["Sector_String"],
@@ -638,11 +681,37 @@ def run_pipeline(
     df_relevant["Any Equity-Justice Mention"] = df_relevant[equity].apply(
         lambda x: "no equity-justice mention" if len(x) == 0 else "equity-justice mention"
     )
+    return df_relevant
+
+
+def get_climate_keywords(df_relevant, keyword_path, text_fields=TEXT_FIELDS, id_col='id'):
+    df_relevant = add_climate_keyword_tags(
+        df_relevant, keyword_path, text_fields=text_fields, id_col=id_col
+    )
+    return _stage_columns(df_relevant, CLIMATE_KEYWORD_COLUMNS, id_col=id_col)
+
+
+def add_geocodes_and_org_types(df_relevant, df_geotags, df_keywords, id_col='id'):
+    # Geotags and keywords are computed concurrently with the taxonomy, add their columns
+    df_relevant = _merge_stage_columns(df_relevant, df_geotags, id_col=id_col)
+    df_relevant = _merge_stage_columns(df_relevant, df_keywords, id_col=id_col)
+
+    # Geocode the HQ
+    log_major_step("Geocoding")
+    df_relevant = geocode.add_geo_lat_long(
+        df_relevant,  # use file trimmed of <min search terms
+        idCol=id_col,  # unique id column
+        address="Location",  # address column
+    )
+    df_relevant = geocode.clean_geo(df_relevant, summarize_new_geo=False)
 
     # Run Prediction for Organization Type
     log_major_step("Running Prediction for Organization Type")
     df_relevant = org_type_classifier.predict(df_relevant)
+    return df_relevant
+
 
+def add_images(df_relevant, paths, run_process_images=False):
     if run_process_images:
         # Add Logos
         log_major_step("Adding Logos")
@@ -667,13 +736,204 @@ def run_pipeline(
         df_relevant['Image_URL'] = ""
 
     df_relevant['uid'] = df_relevant.id
+    return df_relevant
 
-    logger.info(
-        "\nWriting final file of %s US-based organizations enriched with metadata",
-        len(df_relevant),
+
+def build_pipeline(
+    paths,
+    relevance_model_name=gpt.cb_cd_model_4omini,
+    relevance_model_system_prompt=None,
+    relevance_model_prompt_format=None,
+    adaptation_model_id=adp.CPI_ADAPTATION_MODEL_2024_ID,
+    run_process_images=False,
+    id_col='id',
+    run_one_earth_taxonomy=True,
+    text_fields=TEXT_FIELDS,
+    label_override_filepath=None,
+    max_workers=MAX_WORKERS,
+    checkpoint_dir=None,
+    max_concurrent_stages=3,
+    report=None,
+):
+    """
+    The stages of run_pipeline. Geotagging and climate keywords run concurrently with the
+    One Earth taxonomy, they only output the columns they write (GEOTAG_COLUMNS and
+    CLIMATE_KEYWORD_COLUMNS) which then replace the existing ones.
+
+    The checkpoints are saved in checkpoint_dir, by default `pipeline_checkpoints` in the
+    results path. Bump the version of a stage when changing its code.
+    """
+    checkpoint_dir = checkpoint_dir or paths['results_path'] / "pipeline_checkpoints"
+    stages = [
+        Stage(
+            "load",
+            load_input,
+            inputs=["enrich_input_file", "num_records"],
+        ),
+        Stage(
+            "relevance_input",
+            prepare_for_relevance_model,
+            inputs=["load"],
+            params={"max_workers": max_workers},
+        ),
+        Stage(
+            "relevant",
+            filter_relevant,
+            inputs=["relevance_input"],
+            params={
+                "relevance_model_name": relevance_model_name,
+                "predictions_path": paths['relevance_model_predictions_path'],
+                "results_path": paths['relevance_model_results'],
+                "id_col": id_col,
+                "relevance_model_system_prompt": relevance_model_system_prompt,
+                "relevance_model_prompt_format": relevance_model_prompt_format,
+                "label_override_filepath": label_override_filepath,
+            },
+        ),
+        Stage(
+            "website_summaries",
+            add_website_summaries,
+            inputs=["relevant"],
+            params={"max_workers": max_workers},
+        ),
+        Stage("linkedin", add_linkedin, inputs=["website_summaries"]),
+        Stage(
+            "adaptation_mitigation",
+            filter_adaptation_mitigation,
+            inputs=["linkedin"],
+            params={
+                "adaptation_model_id": adaptation_model_id,
+                "adaptation_model_path": paths['adaptation_mitigation_results_path'],
+                "text_fields": text_fields,
+            },
+        ),
+        Stage(
+            "prepared",
+            prepare_for_tagging,
+            inputs=["adaptation_mitigation"],
+            params={
+                "results_path": paths['results_path'],
+                "text_fields": text_fields,
+                "max_workers": max_workers,
+            },
+        ),
+        Stage(
+            "taxonomy",
+            add_taxonomy,
+            inputs=["prepared"],
+            params={"run_one_earth_taxonomy": run_one_earth_taxonomy, "max_workers": max_workers},
+        ),
+        Stage(
+            "geotags",
+            get_geotags,
+            inputs=["prepared"],
+            params={"text_fields": text_fields, "max_workers": max_workers, "id_col": id_col},
+            # 2: organizations without text are no longer sent for geotagging
+            version="2",
+        ),
+        Stage(
+            "climate_keywords",
+            get_climate_keywords,
+            inputs=["prepared"],
+            params={
+                "keyword_path": paths['common_kwds'] / "climate_kwd_map_byTag.xlsx",
+                "text_fields": text_fields,
+                "id_col": id_col,
+            },
+            # 2: outputs the text and Sector_String columns rewritten by the keyword search
+            version="2",
+        ),
+        Stage(
+            "geocoded",
+            add_geocodes_and_org_types,
+            inputs=["taxonomy", "geotags", "climate_keywords"],
+            params={"id_col": id_col},
+        ),
+        Stage(
+            "final",
+            add_images,
+            inputs=["geocoded"],
+            params={"paths": paths, "run_process_images": run_process_images},
+        ),
+    ]
+    return Pipeline(stages, checkpoint_dir, max_workers=max_concurrent_stages, report=report)
+
+
+def run_pipeline(
+    paths,
+    relevance_model_name=gpt.cb_cd_model_4omini,
+    relevance_model_system_prompt=None,
+    relevance_model_prompt_format=None,
+    adaptation_model_id=adp.CPI_ADAPTATION_MODEL_2024_ID,
+    num_records=None,
+    run_process_images=False,
+    id_col='id',
+    run_one_earth_taxonomy=True,
+    text_fields=TEXT_FIELDS,
+    label_override_filepath=None,
+    max_workers=MAX_WORKERS,
+    checkpoint_dir=None,
+    max_concurrent_stages=3,
+    force_stages=(),
+    report_path=None,
+):
+    """
+    Runs the enrichment stages (see build_pipeline), loading the ones that completed in a
+    previous run with the same inputs and parameters from their checkpoints.
+    force_stages are run again along with the stages that depend on them.
+
+    The wall time, memory, rows, cache hits / misses, API calls and tokens of each stage are
+    written to report_path (.json or .parquet), by default
+    `run_reports/enrichment_<start time>.json` in the results path, even if the run fails.
+    """
+    started_at = dt.datetime.now()
+    report = RunReport(
+        run_name=f"enrichment_{started_at:%Y%m%d_%H%M%S}",
+        metadata={
+            "enrich_input_file": str(paths['enrich_input_file']),
+            "relevance_model_name": relevance_model_name,
+            "adaptation_model_id": adaptation_model_id,
+            "num_records": num_records,
+            "run_one_earth_taxonomy": run_one_earth_taxonomy,
+            "run_process_images": run_process_images,
+            "max_workers": max_workers,
+        },
     )
-    logger.info('\n df_relevant final\n%s', df_relevant['Data Source'].value_counts())
-    cf.write_excel_no_hyper(df_relevant, paths['results_path']/'cb_cd_li_meta.xlsx')
-    df_relevant.to_json(paths['results_path'] / "cb_cd_li_meta.json", orient='records')
+    report_path = report_path or paths['results_path'] / "run_reports" / f"{report.run_name}.json"
+
+    pipeline = build_pipeline(
+        paths,
+        relevance_model_name=relevance_model_name,
+        relevance_model_system_prompt=relevance_model_system_prompt,
+        relevance_model_prompt_format=relevance_model_prompt_format,
+        adaptation_model_id=adaptation_model_id,
+        run_process_images=run_process_images,
+        id_col=id_col,
+        run_one_earth_taxonomy=run_one_earth_taxonomy,
+        text_fields=text_fields,
+        label_override_filepath=label_override_filepath,
+        max_workers=max_workers,
+        checkpoint_dir=checkpoint_dir,
+        max_concurrent_stages=max_concurrent_stages,
+        report=report,
+    )
+    try:
+        df_relevant = pipeline.run(
+            targets=["final"],
+            force=force_stages,
+            enrich_input_file=paths['enrich_input_file'],
+            num_records=num_records,
+        )["final"]
+
+        with report.stage("write_results", rows_in=df_relevant):
+            logger.info(
+                "\nWriting final file of %s US-based organizations enriched with metadata",
+                len(df_relevant),
+            )
+            logger.info('\n df_relevant final\n%s', df_relevant['Data Source'].value_counts())
+            cf.write_excel_no_hyper(df_relevant, paths['results_path']/'cb_cd_li_meta.xlsx')
+            df_relevant.to_json(paths['results_path'] / "cb_cd_li_meta.json", orient='records')
+    finally:
+        report.write(report_path)
 
     return df_relevant
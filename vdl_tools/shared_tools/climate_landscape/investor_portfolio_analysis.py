@@ -27,6 +27,71 @@ AGGREGATION_DICT = {
     "median_money_raised{metric_suffix}": ('money_raised', 'median'),
 }
 
+def flatten_investor_funding_rounds(funding_rounds, investor_ids=None):
+    """
+    One row per (funding round, investor) from Crunchbase funding rounds payloads.
+
+    The same round is returned by the query of each of its investors, so rounds are
+    deduplicated by uuid before their investor_identifiers are exploded.
+
+    Args:
+        funding_rounds (pd.DataFrame): Funding rounds, as returned by funding_rounds_query_by_investor_id.
+        investor_ids (iterable, optional): If given, only the rows of these investors are kept.
+
+    Returns:
+        pd.DataFrame: A DataFrame with the funding round, investor and company of each investment.
+    """
+    rounds = funding_rounds.drop_duplicates(subset='uuid').reset_index(drop=True)
+    funded_organization = rounds['funded_organization_identifier'].str
+    round_columns = pd.DataFrame({
+        'funding_round_id': rounds['uuid'],
+        'funding_round_permalink': rounds['permalink'] if 'permalink' in rounds else None,
+        'money_raised': rounds['money_raised'].map(
+            lambda x: x.get('value_usd') if coerced_bool(x) else None
+        ),
+        'company_id': funded_organization.get('uuid'),
+        'company_name': funded_organization.get('value'),
+        'company_permalink': funded_organization.get('permalink'),
+        'investment_type': rounds['investment_type'],
+        'investment_stage': rounds['investment_type'].map(ROUND_TO_STAGE).fillna('unknown'),
+        'date_announced': rounds['announced_on'],
+    })
+
+    investors = rounds['investor_identifiers'].explode().dropna()
+    investor_columns = pd.DataFrame({
+        'round_idx': investors.index,
+        'investor_id': investors.str.get('uuid'),
+        'investor_name': investors.str.get('value'),
+        'investor_permalink': investors.str.get('permalink'),
+        'investor_entity_type': investors.str.get('entity_def_id'),
+    })
+    if investor_ids is not None:
+        investor_columns = investor_columns[investor_columns['investor_id'].isin(set(investor_ids))]
+    investor_columns = investor_columns.drop_duplicates(subset=['round_idx', 'investor_id'])
+
+    flattened = (
+        round_columns
+        .iloc[investor_columns['round_idx']]
+        .reset_index(drop=True)
+        .join(investor_columns.drop(columns='round_idx').reset_index(drop=True))
+    )
+    return flattened.reindex(columns=[
+        'funding_round_id',
+        'funding_round_permalink',
+        'money_raised',
+        'investor_id',
+        'investor_name',
+        'investor_permalink',
+        'investor_entity_type',
+        'company_id',
+        'company_name',
+        'company_permalink',
+        'investment_type',
+        'investment_stage',
+        'date_announced',
+    ])
+
+
 class InvestorAnalysis:
     def __init__(
         self,
@@ -192,46 +257,10 @@ class InvestorAnalysis:
         })
 
         all_investor_funding_rounds = self._query_crunchbase_for_investor_portfolios(investor_ids)
-
-        investor_funding_round_company_rows = []
-        for _, company_funding_round in all_investor_funding_rounds.iterrows():
-
-            company_id = company_funding_round['funded_organization_identifier']['uuid']
-            company_name = company_funding_round['funded_organization_identifier']['value']
-            company_permalink = company_funding_round['funded_organization_identifier'].get('permalink')
-
-            if coerced_bool(company_funding_round['money_raised']):
-                money_raised = company_funding_round['money_raised'].get('value_usd')
-            else:
-                money_raised = None
-            investment_type = company_funding_round['investment_type']
-            investment_stage = ROUND_TO_STAGE.get(investment_type, 'unknown')
-            date_announced = company_funding_round['announced_on']
-            for investor_data in company_funding_round['investor_identifiers']:
-                if filter_out_other_investors and investor_data['uuid'] not in investor_ids:
-                    continue
-                if coerced_bool(company_funding_round['money_raised']):
-                    money_raised = company_funding_round['money_raised'].get('value_usd')
-                else:
-                    money_raised = None
-                investor_funding_round_company_rows.append({
-                    'funding_round_id': company_funding_round['uuid'],
-                    'funding_round_permalink': company_funding_round.get('permalink'),
-                    'money_raised': money_raised,
-                    'investor_id': investor_data['uuid'],
-                    'investor_name': investor_data['value'],
-                    'investor_permalink': investor_data.get('permalink'),
-                    'investor_entity_type': investor_data.get('entity_def_id'),
-                    'company_id': company_id,
-                    'company_name': company_name,
-                    'company_permalink': company_permalink,
-                    'investment_type': investment_type,
-                    'investment_stage': investment_stage,
-                    "date_announced": date_announced,
-                    "money_raised": money_raised,
-                })
-
-        self.investor_funding_round_company_df = pd.DataFrame(investor_funding_round_company_rows)
+        self.investor_funding_round_company_df = flatten_investor_funding_rounds(
+            all_investor_funding_rounds,
+            investor_ids=investor_ids if filter_out_other_investors else None,
+        )
         self.investor_funding_round_company_df['date_announced_dt'] = pd.to_datetime(self.investor_funding_round_company_df['date_announced'])
         self.investor_funding_round_company_df['quarter_announced'] = (
             self.investor_funding_round_company_df['date_announced_dt']
@@ -255,12 +284,6 @@ class InvestorAnalysis:
             self.investor_funding_round_company_df['company_id']
             .isin(self.company_df['uuid'])
         )
-
-        # Why are we seeing duplicates?
-        self.investor_funding_round_company_df.drop_duplicates(
-            subset=self.investor_funding_round_company_df.columns,
-            inplace=True,
-        )
         return self.investor_funding_round_company_df
 
     def add_original_data(self, columns_to_count=None):
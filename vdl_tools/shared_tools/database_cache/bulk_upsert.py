@@ -0,0 +1,272 @@
+"""Bulk writers for the cache tables in `database_models`.
+
+`session.merge` issues a SELECT for every object before its INSERT or UPDATE, so
+committing N rows costs 2N round trips. `bulk_upsert` writes a whole batch with
+`INSERT ... ON CONFLICT DO UPDATE` on the table's primary key, and `copy_upsert`
+streams very large loads through `COPY` into a temporary table first.
+
+Both follow the `session.merge` conventions the cache writers rely on:
+
+* Only the columns present on a row are written; missing columns keep their
+  stored value on update (rows are grouped by their column set).
+* If the same primary key appears more than once in a batch, the last row wins.
+* `num_errors` is incremented: a row with `num_errors > 0` adds to the stored
+  count, a row with `num_errors` of 0 or None resets it.
+"""
+import datetime as dt
+import io
+import json
+
+from more_itertools import chunked
+from sqlalchemy import Column, MetaData, Table, case, func, inspect, select
+from sqlalchemy.dialects.postgresql import ARRAY, JSON, JSONB, insert
+
+from vdl_tools.shared_tools.tools.logger import logger
+
+
+ERRORS_COLUMN = "num_errors"
+COPY_PAGE_SIZE = 10000
+
+
+def _to_row(table, item):
+    """Converts an ORM object or a dict into a dict of the table columns it sets."""
+    if isinstance(item, dict):
+        return {k: v for k, v in item.items() if k in table.c}
+
+    # Only the attributes that were set on the object, same as `session.merge`
+    state_dict = inspect(item).dict
+    return {c.key: state_dict[c.key] for c in table.c if c.key in state_dict}
+
+
+def _prepare_rows(table, items):
+    """Converts items to rows and drops duplicate primary keys, keeping the last one."""
+    pk_names = [c.name for c in table.primary_key.columns]
+    deduped = {}
+    for item in items:
+        row = _to_row(table, item)
+        missing = [x for x in pk_names if row.get(x) is None]
+        if missing:
+            raise ValueError(f"Row for {table.name} is missing primary key values {missing}")
+        key = tuple(row[x] for x in pk_names)
+        # Pop first so that the last occurrence also sets the position
+        deduped.pop(key, None)
+        deduped[key] = row
+
+    n_dupes = len(items) - len(deduped)
+    if n_dupes:
+        logger.debug("Dropped %s duplicate rows for %s", n_dupes, table.name)
+    return list(deduped.values())
+
+
+def _group_by_columns(rows):
+    groups = {}
+    for row in rows:
+        groups.setdefault(tuple(sorted(row)), []).append(row)
+    return groups.items()
+
+
+def _upsert_statement(table, stmt, columns, update_columns, increment_errors):
+    pk_names = [c.name for c in table.primary_key.columns]
+    if update_columns is None:
+        update_columns = [x for x in columns if x not in pk_names]
+    else:
+        update_columns = [x for x in update_columns if x in columns and x not in pk_names]
+
+    set_ = {}
+    for name in update_columns:
+        if name == ERRORS_COLUMN and increment_errors:
+            set_[name] = case(
+                (
+                    stmt.excluded[name] > 0,
+                    func.coalesce(table.c[name], 0) + stmt.excluded[name],
+                ),
+                else_=stmt.excluded[name],
+            )
+        else:
+            set_[name] = stmt.excluded[name]
+
+    if not set_:
+        return stmt.on_conflict_do_nothing(index_elements=pk_names)
+
+    # `onupdate` defaults are not applied by ON CONFLICT DO UPDATE
+    if "date_updated" in table.c:
+        set_["date_updated"] = dt.datetime.utcnow()
+    return stmt.on_conflict_do_update(index_elements=pk_names, set_=set_)
+
+
+def bulk_upsert(
+    session,
+    model,
+    items: list,
+    update_columns: list[str] = None,
+    increment_errors: bool = True,
+    return_rows: bool = True,
+    copy_threshold: int = None,
+) -> list[dict]:
+    """Inserts or updates `items` in the table of `model` in as few statements as possible.
+
+    Parameters
+    ----------
+    session : Session
+        SQLAlchemy session to write with. The caller is responsible for committing.
+    model : BaseMixin
+        One of the `database_models` classes.
+    items : list
+        ORM objects of `model` or dicts keyed by column name.
+    update_columns : list[str], optional
+        Columns to overwrite when the row already exists, by default every column
+        present on the row except the primary key.
+    increment_errors : bool, optional
+        Whether `num_errors` adds to the stored count instead of replacing it, by default True
+    return_rows : bool, optional
+        Whether to return the written rows, by default True
+    copy_threshold : int, optional
+        If given, batches with at least this many rows go through `copy_upsert`.
+
+    Returns
+    -------
+    list[dict]
+        The rows as stored in the table after the write.
+    """
+    if not items:
+        return []
+
+    if copy_threshold and len(items) >= copy_threshold:
+        return copy_upsert(
+            session,
+            model,
+            items,
+            update_columns=update_columns,
+            increment_errors=increment_errors,
+            return_rows=return_rows,
+        )
+
+    table = model.__table__
+    rows = _prepare_rows(table, items)
+
+    written = []
+    for columns, group in _group_by_columns(rows):
+        stmt = insert(table)
+        stmt = _upsert_statement(table, stmt, columns, update_columns, increment_errors)
+        if return_rows:
+            stmt = stmt.returning(*table.c, sort_by_parameter_order=True)
+            result = session.execute(stmt, group)
+            written.extend(dict(x._mapping) for x in result)
+        else:
+            session.execute(stmt, group)
+
+    logger.debug("Upserted %s rows into %s", len(rows), table.name)
+    return written
+
+
+def _copy_array_item(value):
+    if value is None:
+        return "NULL"
+    value = str(value).replace("\\", "\\\\").replace('"', '\\"')
+    return f'"{value}"'
+
+
+def _copy_value(value, column_type):
+    """Formats a value for the text format of `COPY`."""
+    if value is None:
+        return "\\N"
+
+    if isinstance(column_type, (JSON, JSONB)):
+        value = json.dumps(value)
+    elif isinstance(column_type, ARRAY):
+        value = "{" + ",".join(_copy_array_item(x) for x in value) + "}"
+    elif isinstance(value, bool):
+        value = "t" if value else "f"
+    elif isinstance(value, (dt.datetime, dt.date)):
+        value = value.isoformat()
+    else:
+        value = str(value)
+
+    return (
+        value
+        .replace("\\", "\\\\")
+        .replace("\t", "\\t")
+        .replace("\n", "\\n")
+        .replace("\r", "\\r")
+    )
+
+
+def _copy_rows(dbapi_connection, table_name, columns, column_types, rows):
+    buffer = io.StringIO()
+    for row in rows:
+        buffer.write("\t".join(_copy_value(row[x], column_types[x]) for x in columns))
+        buffer.write("\n")
+    buffer.seek(0)
+
+    column_list = ", ".join(f'"{x}"' for x in columns)
+    copy_sql = f'COPY "{table_name}" ({column_list}) FROM STDIN'
+    cursor = dbapi_connection.cursor()
+    try:
+        if hasattr(cursor, "copy_expert"):
+            # psycopg2
+            cursor.copy_expert(copy_sql, buffer)
+        else:
+            # psycopg 3
+            with cursor.copy(copy_sql) as copy:
+                copy.write(buffer.getvalue())
+    finally:
+        cursor.close()
+
+
+def copy_upsert(
+    session,
+    model,
+    items: list,
+    update_columns: list[str] = None,
+    increment_errors: bool = True,
+    return_rows: bool = True,
+    page_size: int = COPY_PAGE_SIZE,
+) -> list[dict]:
+    """Same as `bulk_upsert` but loads the rows with `COPY` into a temporary table
+    and upserts from there with a single `INSERT ... SELECT ... ON CONFLICT DO UPDATE`.
+
+    Meant for very large loads, where even batched INSERT statements are slow.
+    The rows are copied in pages of `page_size` so the buffer stays bounded.
+
+    Returns
+    -------
+    list[dict]
+        The rows as stored in the table after the write.
+    """
+    if not items:
+        return []
+
+    table = model.__table__
+    rows = _prepare_rows(table, items)
+    connection = session.connection()
+    dbapi_connection = connection.connection.dbapi_connection
+    column_types = {c.name: c.type for c in table.c}
+
+    written = []
+    for i, (columns, group) in enumerate(_group_by_columns(rows)):
+        tmp_table = Table(
+            f"_tmp_{table.name}_{i}",
+            MetaData(),
+            *[Column(x, column_types[x]) for x in columns],
+            prefixes=["TEMPORARY"],
+        )
+        tmp_table.create(bind=connection)
+        try:
+            for page in chunked(group, page_size):
+                _copy_rows(dbapi_connection, tmp_table.name, columns, column_types, page)
+
+            stmt = insert(table).from_select(
+                list(columns),
+                select(*[tmp_table.c[x] for x in columns]),
+            )
+            stmt = _upsert_statement(table, stmt, columns, update_columns, increment_errors)
+            if return_rows:
+                result = session.execute(stmt.returning(*table.c))
+                written.extend(dict(x._mapping) for x in result)
+            else:
+                session.execute(stmt)
+        finally:
+            tmp_table.drop(bind=connection)
+
+    logger.info("Copied %s rows into %s", len(rows), table.name)
+    return written
@@ -1,9 +1,11 @@
 import datetime as dt
 
 import numpy as np
+import pandas as pd
 from plotly import express as px
 
 import vdl_tools.shared_tools.common_functions as cf  # from common directory: commonly used functions
+from vdl_tools.shared_tools.tools.parallel import parallel_map
 
 
 SEED_STAGES = [
@@ -56,6 +58,12 @@ LATE_VENTURE_START = 'series_b'
 M_AND_A_SUCCESS_STAGE = 'series_a'
 LATE_STAGE_VENTURE_ROUNDS = VENTURE_ROUNDS[VENTURE_ROUNDS.index(LATE_VENTURE_START):]
 
+# Stages whose failure rates make up the expected survival rate
+SURVIVAL_STAGES = ["seed", "series_a", "late_venture"]
+
+# Number of permutation rounds evaluated at once, see permutation_survival_rates
+PERMUTATION_BLOCK_SIZE = 100
+
 
 def is_venture_company(company_funding_types):
     return any(stage in company_funding_types for stage in VENTURE_ROUNDS)
@@ -145,22 +153,98 @@ def did_company_fail(
 
 
 
-def calculate_failure_rate(
-    subset,
+def funding_round_table(df):
+    """
+    Long table of the funding rounds of the companies in df, one row per round, with the row
+    number of the company in df ("company"), the position of the round in its `Funding Types`
+    ("position") and the round type ("round").
+    """
+    rounds = pd.Series(
+        df['Funding Types'].to_numpy(), index=pd.RangeIndex(len(df)), dtype=object
+    ).explode().dropna()
+    table = pd.DataFrame({"company": rounds.index.to_numpy(), "round": rounds.to_numpy()})
+    table["position"] = table.groupby("company").cumcount()
+    return table[["company", "position", "round"]]
+
+
+def funding_features(df, now=None):
+    """
+    Funding round features of the companies in df, indexed like df, for the filters of this module.
+
+    Has a boolean column per round type telling whether the company had a round of that type,
+    "all_seed_stages" (all of its rounds are SEED_STAGES) and "days_since_last_funding"
+    (days between its last `Funding Types Dates` and now, see time_since_last_funding).
+    Compute it once and pass it to the filters to avoid re-scanning the list columns.
+    """
+    rounds = funding_round_table(df)
+    companies = pd.RangeIndex(len(df))
+    features = (
+        pd.get_dummies(rounds["round"], dtype=bool)
+        .groupby(rounds["company"].to_numpy())
+        .any()
+        .reindex(companies, fill_value=False)
+    )
+
+    non_seed_companies = rounds.loc[~rounds["round"].isin(SEED_STAGES), "company"].unique()
+    features["all_seed_stages"] = ~companies.isin(non_seed_companies)
+
+    last_funding_at = pd.to_datetime(
+        pd.Series(df['Funding Types Dates'].to_numpy(), index=companies, dtype=object).str[-1],
+        format='%Y-%m-%d',
+    )
+    features["days_since_last_funding"] = (pd.Timestamp(now or dt.datetime.now()) - last_funding_at).dt.days
+
+    features.index = df.index
+    return features
+
+
+def has_any_round(features, stages):
+    """Whether each company had a round of any of the stages, as a boolean array."""
+    return features.reindex(columns=list(stages), fill_value=False).to_numpy(dtype=bool).any(axis=1)
+
+
+def stage_outcomes(
+    df,
+    features,
     outlier_time,
     stage_name="series_a",
     late_venture_start=LATE_VENTURE_START,
     m_and_a_success_stage=M_AND_A_SUCCESS_STAGE,
-    debug=False,
 ):
-    """Calculates the rate of failure for companies that have not received funding past a certain stage."""
+    """
+    did_company_fail and did_company_succeed at a stage for all the companies in df at once.
+
+    returns: failed, succeeded boolean arrays
+    """
+    focal_stage_names, subsequent_stages = get_stage_names(stage_name, late_venture_start)
+
+    status = df['Funding Status'].to_numpy()
+    is_m_and_a = status == 'm_and_a'
+    is_venture = has_any_round(features, VENTURE_ROUNDS)
+    m_and_a_success = has_any_round(
+        features, DISCLOSED_STAGES_ORDERED[DISCLOSED_STAGES_ORDERED.index(m_and_a_success_stage):]
+    )
+
+    succeeded = is_venture & (
+        (status == 'ipo') |
+        (is_m_and_a & m_and_a_success) |
+        (~is_m_and_a & has_any_round(features, subsequent_stages))
+    )
+    failed = is_venture & has_any_round(features, focal_stage_names) & ~succeeded & (
+        (df['operating_status'].to_numpy() == 'closed') |
+        (is_m_and_a & ~m_and_a_success) |
+        (~is_m_and_a & (features['days_since_last_funding'].to_numpy() >= outlier_time))
+    )
+    return failed, succeeded
+
+
+def get_stage_names(stage_name, late_venture_start=LATE_VENTURE_START):
+    """Returns the focal stage names and the subsequent stages used to calculate a failure rate."""
 
     if stage_name not in DISCLOSED_STAGES_ORDERED + ["late_venture"]:
         raise Exception("Invalid stage name")
 
     if stage_name == "late_venture":
-        stage_order_idx = DISCLOSED_STAGES_ORDERED.index(late_venture_start)
-
         # Late Venture should be considered anything between late_venture_start and IPO
         focal_stage_names = DISCLOSED_STAGES_ORDERED[
             DISCLOSED_STAGES_ORDERED.index(late_venture_start):
@@ -178,27 +262,29 @@ def calculate_failure_rate(
         focal_stage_names = [stage_name]
         subsequent_stages = DISCLOSED_STAGES_ORDERED[stage_order_idx + 1:]
 
-    df_success = subset[
-        subset.apply(
-            lambda x: did_company_succeed(
-                company_row=x,
-                subsequent_stages=subsequent_stages,
-                m_and_a_success_stage=m_and_a_success_stage,
-            ),
-        axis=1)
-    ].copy()
+    return focal_stage_names, subsequent_stages
 
-    df_failed = subset[
-        subset.apply(
-            lambda x: did_company_fail(
-                company_row=x,
-                focal_stage_names=focal_stage_names,
-                subsequent_stages=subsequent_stages,
-                outlier_time=outlier_time,
-                m_and_a_success_stage=m_and_a_success_stage,
-            ),
-        axis=1)
-    ].copy()
+
+def calculate_failure_rate(
+    subset,
+    outlier_time,
+    stage_name="series_a",
+    late_venture_start=LATE_VENTURE_START,
+    m_and_a_success_stage=M_AND_A_SUCCESS_STAGE,
+    debug=False,
+):
+    """Calculates the rate of failure for companies that have not received funding past a certain stage."""
+
+    failed, succeeded = stage_outcomes(
+        subset,
+        funding_features(subset),
+        outlier_time,
+        stage_name,
+        late_venture_start=late_venture_start,
+        m_and_a_success_stage=m_and_a_success_stage,
+    )
+    df_success = subset[succeeded].copy()
+    df_failed = subset[failed].copy()
 
     failure_rate = df_failed.shape[0] / (df_failed.shape[0] + df_success.shape[0])
 
@@ -226,44 +312,65 @@ def calculate_expected_survivals(
     outlier_time : int
         Number of days since last funding to be considered as an outlier
     """
-    seed_failure_rate = calculate_failure_rate(
-        base_df,
-        outlier_time,
-        "seed",
-        late_venture_start=late_venture_start,
-        m_and_a_success_stage=m_and_a_success_stage,
-    )
-    series_a_failure_rate = calculate_failure_rate(
-        base_df,
-        outlier_time,
-        "series_a",
-        late_venture_start=late_venture_start,
-        m_and_a_success_stage=m_and_a_success_stage,
-    )
-    # series_b_failure_rate = calculate_failure_rate(
-    #     base_df,
-    #     outlier_time,
-    #     "series_b",
-    #     late_venture_start=late_venture_start,
-    #     m_and_a_success_stage=m_and_a_success_stage,
-    # )
-    late_venture_failure_rate = calculate_failure_rate(
-        base_df,
-        outlier_time,
-        "late_venture",
-        late_venture_start=late_venture_start,
-        m_and_a_success_stage=m_and_a_success_stage,
-    )
+    base_features = funding_features(base_df)
+    failure_rates = {}
+    for stage_name in SURVIVAL_STAGES:
+        failed, succeeded = stage_outcomes(
+            base_df,
+            base_features,
+            outlier_time,
+            stage_name,
+            late_venture_start=late_venture_start,
+            m_and_a_success_stage=m_and_a_success_stage,
+        )
+        failure_rates[stage_name] = failed.sum() / (failed.sum() + succeeded.sum())
+    seed_failure_rate = failure_rates["seed"]
+    series_a_failure_rate = failure_rates["series_a"]
+    # series_b_failure_rate = failure_rates["series_b"]
+    late_venture_failure_rate = failure_rates["late_venture"]
 
+    n_seed_preseed, n_series_a = count_alive_stages(alive_df)
+
+    return {
+        "n_seed_preseed": int(n_seed_preseed),
+        "n_series_a": int(n_series_a),
+        # "n_series_b": int(n_series_b),
+        "n_total": int(n_seed_preseed + n_series_a),
+        **expected_survivals_from_failure_rates(
+            seed_failure_rate,
+            series_a_failure_rate,
+            late_venture_failure_rate,
+            n_seed_preseed,
+            n_series_a,
+        ),
+    }
+
+
+def count_alive_stages(alive_df, features=None):
+    """Number of living companies at seed / pre-seed stages and at series A."""
+    features = funding_features(alive_df) if features is None else features
+    n_seed_preseed = features["all_seed_stages"].sum()
+    n_series_a = (alive_df['Equity Stage'] == 'series_a').sum()
+    # n_series_b = (alive_df['Equity Stage'] == 'series_b').sum()
+    return n_seed_preseed, n_series_a
+
+
+def expected_survivals_from_failure_rates(
+    seed_failure_rate,
+    series_a_failure_rate,
+    late_venture_failure_rate,
+    n_seed_preseed,
+    n_series_a,
+):
+    """
+    Expected survivals of the living companies given the failure rates at each stage.
+    Works on single rates as well as on arrays of rates.
+    """
     seed_survival_rate = 1 - seed_failure_rate
     series_a_survival_rate = 1 - series_a_failure_rate
     # series_b_survival_rate = 1 - series_b_failure_rate
     late_venture_survival_rate = 1 - late_venture_failure_rate
 
-    n_seed_preseed = (alive_df['Funding Types'].apply(lambda x: all(round_name in SEED_STAGES for round_name in x))).sum()
-    n_series_a = (alive_df['Equity Stage'] == 'series_a').sum()
-    # n_series_b = (alive_df['Equity Stage'] == 'series_b').sum()
-
     expected_survived_seed = seed_survival_rate * n_seed_preseed
     expected_survived_a = series_a_survival_rate * (n_series_a + expected_survived_seed)
     # expected_survived_b = series_b_survival_rate * (n_series_b + expected_survived_a)
@@ -274,10 +381,6 @@ def calculate_expected_survivals(
     overall_expected_survival_rate = expected_survived_late_venture / n_total
 
     return {
-        "n_seed_preseed": int(n_seed_preseed),
-        "n_series_a": int(n_series_a),
-        # "n_series_b": int(n_series_b),
-        "n_total": int(n_total),
         'expected_survived_seed': expected_survived_seed,
         'expected_survived_a': expected_survived_a,
         # 'expected_survived_b': expected_survived_b,
@@ -361,61 +464,38 @@ def trim_funding_rounds(funding_rounds, ipo_states):
 
 # todo review the grant and loan flags function
 def grant_loan_flags(df):
-    # Initialize lists to store the boolean flags for each company
-    before_seed_flags = []
-    between_seed_seriesA_flags = []
-    between_seriesA_seriesB_flags = []
-    after_seriesB_flags = []
-
     # Define the funding types of interest
     funding_interest = {'grant', 'debt_financing'}
 
-    for funding_list in df['Funding Types']:
-        # Reset flags for each company
-        before_seed = False
-        between_seed_seriesA = False
-        between_seriesA_seriesB = False
-        after_seriesB = False
-
-        # Flags to mark if Seed and Series A have been found
-        found_seed = False
-        found_seriesA = False
-        found_seriesB = False
-        found_otherFR = False
-
-        for round_type in funding_list:
-            if round_type in POST_IPO_TYPES:
-                break
-            elif round_type == 'seed':
-                found_seed = True
-            elif round_type == 'series_a':
-                found_seriesA = True
-            elif round_type == 'series_b':
-                found_seriesB = True
-            elif round_type in LATE_STAGE_VENTURE_ROUNDS:
-                found_otherFR = True
-
-            if round_type in funding_interest:
-                if not found_seed and not (found_seriesA or found_seriesB or found_otherFR):
-                    before_seed = True
-                elif found_seed and not (found_seriesA or found_seriesB or found_otherFR):
-                    between_seed_seriesA = True
-                elif found_seriesA and not (found_seriesB or found_otherFR):
-                    between_seriesA_seriesB = True
-                elif found_otherFR and found_seriesB:
-                    after_seriesB = True
-
-        # Append flags to lists
-        before_seed_flags.append(before_seed)
-        between_seed_seriesA_flags.append(between_seed_seriesA)
-        between_seriesA_seriesB_flags.append(between_seriesA_seriesB)
-        after_seriesB_flags.append(after_seriesB)
+    rounds = funding_round_table(df)
+    # Rounds from the first post IPO round on are ignored
+    is_post_ipo = rounds["round"].isin(POST_IPO_TYPES)
+    rounds = rounds[is_post_ipo.groupby(rounds["company"]).cumsum() == 0]
+    by_company = rounds["company"]
+
+    # Whether Seed, Series A, ... have been found up to each round
+    found_seed = (rounds["round"] == 'seed').groupby(by_company).cummax()
+    found_seriesA = (rounds["round"] == 'series_a').groupby(by_company).cummax()
+    found_seriesB = (rounds["round"] == 'series_b').groupby(by_company).cummax()
+    found_otherFR = (
+        rounds["round"].isin(LATE_STAGE_VENTURE_ROUNDS) & (rounds["round"] != 'series_b')
+    ).groupby(by_company).cummax()
+    found_later = found_seriesA | found_seriesB | found_otherFR
+
+    is_interest = rounds["round"].isin(funding_interest)
+    before_seed = is_interest & ~found_seed & ~found_later
+    between_seed_seriesA = is_interest & found_seed & ~found_later
+    between_seriesA_seriesB = is_interest & found_later & found_seriesA & ~(found_seriesB | found_otherFR)
+    after_seriesB = is_interest & found_later & ~between_seriesA_seriesB & found_otherFR & found_seriesB
+
+    def _any_round(flags):
+        return flags.groupby(by_company).any().reindex(range(len(df)), fill_value=False).to_numpy(dtype=bool)
 
     # Add boolean columns to the DataFrame
-    df['Before Seed'] = before_seed_flags
-    df['Between Seed and Series A'] = between_seed_seriesA_flags
-    df['Between Series A and Series B'] = between_seriesA_seriesB_flags
-    df['After Series B'] = after_seriesB_flags
+    df['Before Seed'] = _any_round(before_seed)
+    df['Between Seed and Series A'] = _any_round(between_seed_seriesA)
+    df['Between Series A and Series B'] = _any_round(between_seriesA_seriesB)
+    df['After Series B'] = _any_round(after_seriesB)
 
     return df
 
@@ -462,24 +542,172 @@ def calculate_random_surival_round(df, comparison_column, outlier_time):
     return true_column_survival_rate, false_column_survival_rate
 
 
+def survival_indicators(
+    df,
+    outlier_time,
+    late_venture_start=LATE_VENTURE_START,
+    m_and_a_success_stage=M_AND_A_SUCCESS_STAGE,
+):
+    """
+    Whether each company failed and whether it succeeded at each of the SURVIVAL_STAGES.
+
+    Returns a (companies x 2 * stages) array of 0 / 1, with a failed and a succeeded column
+    per stage. Summing the rows of a group of companies gives the counts that
+    calculate_failure_rate would use for that group.
+    """
+    features = funding_features(df)
+    columns = []
+    for stage_name in SURVIVAL_STAGES:
+        columns.extend(stage_outcomes(
+            df,
+            features,
+            outlier_time,
+            stage_name,
+            late_venture_start=late_venture_start,
+            m_and_a_success_stage=m_and_a_success_stage,
+        ))
+    return np.column_stack(columns).astype(np.float64)
+
+
+def survival_rates_from_counts(stage_counts, n_seed_preseed, n_series_a):
+    """
+    Expected survivals dicts, as returned by calculate_expected_survivals, from the failed and
+    succeeded counts of groups of companies (one row of survival_indicators columns per group).
+    """
+    stage_counts = np.asarray(stage_counts).reshape(-1, len(SURVIVAL_STAGES), 2)
+    failed = stage_counts[..., 0]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        failure_rates = failed / (failed + stage_counts[..., 1])
+
+    survivals = expected_survivals_from_failure_rates(
+        failure_rates[:, 0],
+        failure_rates[:, 1],
+        failure_rates[:, 2],
+        n_seed_preseed,
+        n_series_a,
+    )
+    survivals = {key: value.tolist() for key, value in survivals.items()}
+    return [
+        {
+            "n_seed_preseed": int(n_seed_preseed),
+            "n_series_a": int(n_series_a),
+            "n_total": int(n_seed_preseed + n_series_a),
+            **{key: values[i] for key, values in survivals.items()},
+        }
+        for i in range(stage_counts.shape[0])
+    ]
+
+
+def _permuted_stage_counts(shared, block):
+    """Counts of the companies labelled True in each random permutation of the labels of a block."""
+    labels, indicators = shared
+    seed, n_rounds = block
+    rng = np.random.default_rng(seed)
+    permuted_labels = rng.permuted(np.tile(labels, (n_rounds, 1)), axis=1)
+    return permuted_labels @ indicators
+
+
+def permuted_stage_counts(
+    indicators,
+    labels,
+    n_rounds=1000,
+    random_state=None,
+    block_size=PERMUTATION_BLOCK_SIZE,
+    max_workers=1,
+):
+    """
+    Failed and succeeded counts of the companies labelled True, for random permutations of the labels.
+
+    The permutations are evaluated as a (rounds x companies) matrix of permuted labels times the
+    indicators, block_size rounds at a time. Each block draws from its own seed spawned from
+    random_state, so the results only depend on random_state and not on max_workers.
+
+    Parameters
+    ----------
+    indicators : np.ndarray
+        Output of survival_indicators
+    labels : array-like of bool
+        Label of each company
+    n_rounds : int
+        Number of permutations
+    random_state : int, optional
+        Seed of the permutations, by default a fresh one
+    block_size : int
+        Number of permutations evaluated at once
+    max_workers : int
+        Number of processes evaluating the blocks, -1 for the number of CPUs
+
+    Returns
+    -------
+    np.ndarray
+        (rounds x 2 * stages) counts, the counts of the companies labelled False are the column
+        sums of the indicators minus these.
+    """
+    labels = np.asarray(labels, dtype=np.float64)
+    block_sizes = [min(block_size, n_rounds - start) for start in range(0, n_rounds, block_size)]
+    seeds = np.random.SeedSequence(random_state).spawn(len(block_sizes))
+    blocks = list(zip(seeds, block_sizes))
+    shared = (labels, indicators)
+
+    if max_workers == 1:
+        counts = []
+        for block in blocks:
+            counts.append(_permuted_stage_counts(shared, block))
+            print(f"Round {sum(len(x) for x in counts)} complete")
+    else:
+        counts = parallel_map(
+            _permuted_stage_counts,
+            blocks,
+            shared=shared,
+            max_workers=max_workers,
+            chunk_size=1,
+            progress=True,
+            desc="survival rate permutations",
+        )
+
+    if not counts:
+        return np.zeros((0, indicators.shape[1]))
+    return np.vstack(counts)
+
+
 def run_compare_survival_rates_rounds(
     df,
     comparison_column,
     outlier_time,
     n_rounds=1000,
+    random_state=None,
+    max_workers=1,
 ):
-    comparison_column_is_true = df[comparison_column]
-    true_comparison_df = df[comparison_column_is_true]
+    """
+    Expected survivals of the companies where comparison_column is True and of the rest,
+    along with the ones of n_rounds random permutations of comparison_column.
 
-    observed_survival_rate_column = calculate_expected_survivals(true_comparison_df, df, outlier_time)
-    observed_survival_rate_rest = calculate_expected_survivals(df[~comparison_column_is_true], df, outlier_time)
+    Whether each company failed or succeeded at each stage doesn't depend on the labels, so it
+    is evaluated once and the permutations are evaluated in blocks, see permuted_stage_counts.
+    """
+    indicators = survival_indicators(df, outlier_time)
+    n_seed_preseed, n_series_a = count_alive_stages(df)
+    labels = df[comparison_column].to_numpy(dtype=bool)
+    total_counts = indicators.sum(axis=0)
+
+    observed_true_counts = labels.astype(np.float64) @ indicators
+    observed_survival_rate_column, observed_survival_rate_rest = survival_rates_from_counts(
+        [observed_true_counts, total_counts - observed_true_counts],
+        n_seed_preseed,
+        n_series_a,
+    )
 
-    random_survival_rates = []
-    for i in range(n_rounds):
-        true_column_survival_rate, false_column_survival_rate = calculate_random_surival_round(df, comparison_column, outlier_time)
-        random_survival_rates.append((true_column_survival_rate, false_column_survival_rate))
-        if i % 10 == 0:
-            print(f"Round {i} complete")
+    true_counts = permuted_stage_counts(
+        indicators,
+        labels,
+        n_rounds=n_rounds,
+        random_state=random_state,
+        max_workers=max_workers,
+    )
+    random_survival_rates = list(zip(
+        survival_rates_from_counts(true_counts, n_seed_preseed, n_series_a),
+        survival_rates_from_counts(total_counts - true_counts, n_seed_preseed, n_series_a),
+    ))
     return observed_survival_rate_column, observed_survival_rate_rest, random_survival_rates
 
 
@@ -492,8 +720,17 @@ def compare_survival_rates(
     title=None,
     annotation_title=None,
     absolute_difference=True,
+    random_state=None,
+    max_workers=1,
 ):
-    observed_survival_rate_column, observed_survival_rate_rest, random_survival_rates = run_compare_survival_rates_rounds(df, comparison_column, outlier_time, n_rounds)
+    observed_survival_rate_column, observed_survival_rate_rest, random_survival_rates = run_compare_survival_rates_rounds(
+        df,
+        comparison_column,
+        outlier_time,
+        n_rounds,
+        random_state=random_state,
+        max_workers=max_workers,
+    )
     if absolute_difference:
         observed_difference = observed_survival_rate_column['overall_expected_survival_rate'] - observed_survival_rate_rest['overall_expected_survival_rate']
         random_differences = [true_rate['overall_expected_survival_rate'] - false_rate['overall_expected_survival_rate'] for true_rate, false_rate in random_survival_rates]
@@ -646,53 +883,53 @@ def create_plot_get_metrics(
 
 
 
-def get_active_companies(df, outlier_time):
-    return (
-        df[(df['operating_status'] == 'active') &
-            (
-                    (df['Funding Types'].apply(lambda x: any(
-                        ipo_type in x for ipo_type in POST_IPO_TYPES))) |  # include companies that have had an ipo funding round
-                    (df['Funding Status'] == 'ipo') | # sometimes there's this but no ipo funding round
-                    (
-                            (df['Funding Types Dates'].apply(lambda x: time_since_last_funding(
-                                x) < outlier_time)) &  # include companies that have had funding within the outlier time but not m and a
-                            ((df['Funding Types'].apply(
-                                lambda x: all(ipo_type not in x for ipo_type in POST_IPO_TYPES)) | (
-                                        df['Funding Status'] != 'ipo')) & (
-                                        df['Funding Status'] != 'm_and_a'))
-                    )  # include companies that have had a grant or loan
-                # include companies that have had a series B and then an M&A
-            )
-            ].copy()
+def _active_mask(df, features, outlier_time):
+    has_post_ipo_round = has_any_round(features, POST_IPO_TYPES)
+    status = df['Funding Status'].to_numpy()
+    return (df['operating_status'].to_numpy() == 'active') & (
+        has_post_ipo_round |  # include companies that have had an ipo funding round
+        (status == 'ipo') |  # sometimes there's this but no ipo funding round
+        (
+            # include companies that have had funding within the outlier time but not m and a
+            (features['days_since_last_funding'].to_numpy() < outlier_time) &
+            (~has_post_ipo_round | (status != 'ipo')) &
+            (status != 'm_and_a')
+        )
     )
 
 
-def get_late_commercial_companies(df, outlier_time):
-    df_alive = get_active_companies(df, outlier_time)
-    return df_alive[
-        (df_alive['operating_status'] == 'active') &
+def get_active_companies(df, outlier_time, features=None):
+    """features : output of funding_features(df), computed if not given"""
+    features = funding_features(df) if features is None else features
+    return df[_active_mask(df, features, outlier_time)].copy()
+
+
+def get_late_commercial_companies(df, outlier_time, features=None):
+    """features : output of funding_features(df), computed if not given"""
+    features = funding_features(df) if features is None else features
+    status = df['Funding Status'].to_numpy()
+    return df[
+        _active_mask(df, features, outlier_time) &
         (
-            (df_alive['Funding Types'].apply(lambda x: any(item in POST_IPO_TYPES for item in x))) |
-            (df_alive['Funding Status'] == 'ipo')  |
+            has_any_round(features, POST_IPO_TYPES) |
+            (status == 'ipo') |
             (
-                (df_alive['Funding Types'].apply(lambda x: any(item in x for item in ['series_a','series_b'] + OTHER_FR[:8]))) &
-                (df_alive['Funding Status'] == 'm_and_a')
+                has_any_round(features, ['series_a', 'series_b'] + OTHER_FR[:8]) &
+                (status == 'm_and_a')
             )
         )
     ].copy()
 
 
-def get_late_venture_companie(df, outlier_time):
-    df_alive = get_active_companies(df, outlier_time)
-    return df_alive[
-        (df_alive['operating_status'] == 'active') &
-        (
-            # include companies that have had funding within the outlier time but not m and a
-            (df_alive['Funding Types Dates'].apply(lambda x: time_since_last_funding(x) < outlier_time)) &
-            (
-                df_alive['Funding Types'].apply(lambda x: any(item in LATE_STAGE_VENTURE_ROUNDS for item in x))
-            )
-        ) &
-        (df_alive['Funding Status'] != 'ipo') &
-        (df_alive['Funding Status'] != 'm_and_a')
+def get_late_venture_companie(df, outlier_time, features=None):
+    """features : output of funding_features(df), computed if not given"""
+    features = funding_features(df) if features is None else features
+    status = df['Funding Status'].to_numpy()
+    return df[
+        _active_mask(df, features, outlier_time) &
+        # include companies that have had funding within the outlier time but not m and a
+        (features['days_since_last_funding'].to_numpy() < outlier_time) &
+        has_any_round(features, LATE_STAGE_VENTURE_ROUNDS) &
+        (status != 'ipo') &
+        (status != 'm_and_a')
     ].copy()
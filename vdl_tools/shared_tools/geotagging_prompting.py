@@ -1,12 +1,15 @@
 import json
+from collections import defaultdict
 from json import JSONDecodeError
 
 from sqlalchemy.orm.session import Session
 
 from vdl_tools.shared_tools.openai.openai_api_utils import get_completion
-from vdl_tools.shared_tools.database_cache.database_utils import get_session
 from vdl_tools.shared_tools.openai.prompt_response_cache_sql import PromptResponseCacheSQL
+from vdl_tools.shared_tools.database_cache.database_models.prompt import PromptResponse
+from vdl_tools.shared_tools.database_cache.database_utils import get_session
 from vdl_tools.shared_tools.tools.logger import logger
+from vdl_tools.shared_tools.tools.run_report import add_counts
 
 
 def parse_results_to_dict(response):
@@ -39,13 +42,15 @@ def geotag_texts_bulk(
     session: Session,
     max_workers: int=8,
     use_cached_result: bool=True,
+    max_errors: int=1,
 ):
     """Runs Geotagging on a set of texts. Uses cached results when set.
 
     The Geotagging is a done with a long formed prompt that was "tuned" prompt using DsPy.
     https://github.com/vibrant-data-labs/zein-hack-box/blob/main/notebooks/dspy_location_extraction.ipynb
 
-    It is 
+    Identical texts are geotagged once, the response is cached for each of
+    their ids, and empty texts are not sent.
 
     Parameters
     ----------
@@ -55,6 +60,8 @@ def geotag_texts_bulk(
         SQLAlchemy session
     use_cached_results : bool, optional
         Whether to use cached results for previously run results, by default True
+    max_errors : int, optional
+        Texts that failed this many times for one of their ids are not run again, by default 1
 
     Returns
     -------
@@ -63,21 +70,87 @@ def geotag_texts_bulk(
         {id: list[dict]}
             {"city": str, "state_region": str, "country": str}
     """
+    # One request per distinct text, organizations often share their descriptions
+    text_to_ids = defaultdict(list)
+    id_to_locations = {}
+    for id_, text in ids_texts:
+        if text and isinstance(text, str):
+            text_to_ids[text].append(id_)
+        else:
+            id_to_locations[id_] = []
+    if not text_to_ids:
+        return id_to_locations
+
     geotagger = GeoTaggingPromptCache(
         session=session
     )
-    ids_to_response = geotagger.bulk_get_cache_or_run(
-        given_ids_texts=ids_texts,
-        session=session,
-        use_cached_result=use_cached_result,
-        max_workers=max_workers,
-    )
 
-    id_to_locations = {}
-
-    for id_, response in ids_to_response.items():
+    text_to_response = {}
+    to_run = []
+    found_rows = []
+    if use_cached_result:
+        # A single lookup for all the (id, text) pairs, a response cached for
+        # any of the ids of a text is used for all of them
+        found_rows, unfound_ids_errors = geotagger.get_prompt_response_obj_bulk(
+            [(id_, text) for text, ids in text_to_ids.items() for id_ in ids]
+        )
+        text_id_to_response = {str(row.text_id): row.to_dict() for row in found_rows}
+        for text, ids in text_to_ids.items():
+            text_id = PromptResponse.create_text_id(text)
+            if str(text_id) in text_id_to_response:
+                text_to_response[text] = text_id_to_response[str(text_id)]
+            elif all(unfound_ids_errors.get((id_, text_id), 0) < max_errors for id_ in ids):
+                to_run.append((ids[0], text))
+        add_counts(cache_hits=len(text_to_response))
+    else:
+        to_run = [(ids[0], text) for text, ids in text_to_ids.items()]
+
+    logger.info(
+        "Geotagging %s texts of %s ids: %s cached, %s to run",
+        len(text_to_ids),
+        len(ids_texts),
+        len(text_to_response),
+        len(to_run),
+    )
+    if to_run:
+        ids_to_response = geotagger.bulk_get_cache_or_run(
+            given_ids_texts=to_run,
+            session=session,
+            use_cached_result=False,
+            max_workers=max_workers,
+        )
+        for id_, text in to_run:
+            if id_ in ids_to_response:
+                text_to_response[text] = ids_to_response[id_]
+
+    # Store the response under the other ids of the text too, so that they are
+    # found by (id, text) in the next runs
+    cached_pairs = {(str(row.given_id), str(row.text_id)) for row in found_rows}
+    run_ids = {id_ for id_, _ in to_run}
+    copies = []
+    for text, response in text_to_response.items():
+        text_id = str(PromptResponse.create_text_id(text))
+        for id_ in text_to_ids[text]:
+            if id_ in run_ids or (str(id_), text_id) in cached_pairs:
+                continue
+            copies.append(
+                PromptResponse(
+                    prompt_id=geotagger.prompt.id,
+                    given_id=id_,
+                    input_text=text,
+                    response_full=response["response_full"],
+                    response_text=response["response_text"],
+                    num_errors=None,
+                )
+            )
+    if copies:
+        geotagger.store_items(copies)
+        session.commit()
+
+    for text, response in text_to_response.items():
         organization_locations = get_organization_locations_from_response(response)
-        id_to_locations[id_] = organization_locations
+        for id_ in text_to_ids[text]:
+            id_to_locations[id_] = organization_locations
 
     return id_to_locations
 
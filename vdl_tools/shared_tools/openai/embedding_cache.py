@@ -5,9 +5,11 @@ from more_itertools import chunked
 import numpy as np
 from sqlalchemy.orm import Session
 
+from vdl_tools.shared_tools.database_cache.bulk_upsert import bulk_upsert
 from vdl_tools.shared_tools.database_cache.database_models.embedding import Embedding
 from vdl_tools.shared_tools.openai.openai_api_utils import get_embedding_response
 from vdl_tools.shared_tools.tools.logger import logger
+from vdl_tools.shared_tools.tools.run_report import add_counts, in_current_context
 
 
 EMBEDDING_MODEL = 'text-embedding-3-large'
@@ -104,34 +106,36 @@ class EmbeddingCache():
         response_full: dict,
         given_id: str,
     ):
-        text_id = Embedding.create_text_id(text)
         logger.info("Storing error for %s, %s", self.model_name, given_id)
-        previous_response = (
-            self.session.query(Embedding)
-            .filter(
-                Embedding.model_name == self.model_name,
-                Embedding.text_id == text_id,
-            )
-            .first()
-        )
-        if previous_response:
-            previous_response.response_full = response_full
-            if previous_response.num_errors:
-                previous_response.num_errors += 1
-            else:
-                previous_response.num_errors = 1
-            self.session.merge(previous_response)
-            return previous_response
-        else:
-            embedding_obj = Embedding(
+        return self.store_errors(
+            texts_given_ids=[(text, given_id)],
+            response_full=response_full,
+        )[0]
+
+    def store_errors(
+        self,
+        texts_given_ids: list[tuple[str, str]],
+        response_full: dict,
+    ) -> list[Embedding]:
+        """Stores an error for each text, adding to `num_errors` of the ones already stored."""
+        embedding_objs = [
+            Embedding(
                 model_name=self.model_name,
                 given_id=given_id,
                 input_text=text,
                 response_full=response_full,
                 num_errors=1,
             )
-            self.session.merge(embedding_obj)
-        return embedding_obj
+            for text, given_id in texts_given_ids
+        ]
+        # Previously stored rows only get their response and error count updated
+        rows = bulk_upsert(
+            self.session,
+            Embedding,
+            embedding_objs,
+            update_columns=["response_full", "num_errors"],
+        )
+        return [Embedding(**row) for row in rows]
 
     def store_item(
         self,
@@ -139,16 +143,25 @@ class EmbeddingCache():
         text: str,
         response,
     ):
-        embedding_obj = Embedding(
-            model_name=self.model_name,
-            given_id=given_id,
-            input_text=text,
-            response_full={"data": response},
-            embedding=np.array(response),
-        )
+        return self.store_items([(given_id, text, response)])[0]
 
-        self.session.merge(embedding_obj)
-        return embedding_obj
+    def store_items(
+        self,
+        given_ids_texts_responses: list[tuple[str, str, list[float]]],
+    ) -> list[Embedding]:
+        """Stores the embeddings for `(given_id, text, response)` tuples with a single upsert."""
+        embedding_objs = [
+            Embedding(
+                model_name=self.model_name,
+                given_id=given_id,
+                input_text=text,
+                response_full={"data": response},
+                embedding=np.array(response),
+            )
+            for given_id, text, response in given_ids_texts_responses
+        ]
+        bulk_upsert(self.session, Embedding, embedding_objs, return_rows=False)
+        return embedding_objs
 
     def get_cache_or_run(
         self,
@@ -164,8 +177,10 @@ class EmbeddingCache():
             data = self.get_embedding_obj(text=text)
             if data:
                 logger.info("Found cached response for %s", given_id)
+                add_counts(cache_hits=1)
                 return data.to_dict()
 
+        add_counts(cache_misses=1, api_calls=1)
         try:
             response = self.get_embedding(
                 texts=[text],
@@ -247,6 +262,7 @@ class EmbeddingCache():
         len_unfound = len(unfound_rows)
         logger.info("Found %s cached responses", len(found_rows))
         logger.info("Need to run %s responses", len_unfound)
+        add_counts(cache_hits=len(found_rows), cache_misses=len(unique_unfound_rows))
 
         def _run_chunk(i_chunk):
             i, chunk = i_chunk
@@ -270,9 +286,12 @@ class EmbeddingCache():
             chunks = enumerate(chunked(commit_chunk, n_per_commit//max_workers))
             i_chunks = [(i+1 * y+1, x) for y, x in chunks]
             with ThreadPool(processes=max_workers) as executor:
-                chunk_results = list(executor.map(_run_chunk, i_chunks))
+                chunk_results = list(executor.map(in_current_context(_run_chunk), i_chunks))
+            add_counts(api_calls=len(i_chunks))
 
             added_to_commit = 0
+            to_store = []
+            to_store_errors = []
             for result_chunk in chunk_results:
                 text_id_to_embeddings.update(result_chunk)
                 added_to_commit += len(result_chunk)
@@ -280,32 +299,27 @@ class EmbeddingCache():
                 for text_id, embedding in result_chunk.items():
                     text = text_id_to_text[text_id]
                     if embedding is not None:
-                        data = self.store_item(
-                            given_id=None,
-                            text=text,
-                            response=embedding,
-                        )
-                        given_ids = text_id_to_given_ids[text_id]
-                        for given_id in given_ids:
-                            res[given_id] = {
-                                "given_id": data.given_id,
-                                "text_id": data.text_id,
-                                "embedding": data.embedding,
-                            }
+                        to_store.append((None, text, embedding))
                     else:
                         logger.error("No response for %s", text_id)
-                        data = self.store_error(
-                            text=text,
-                            response_full={"message": "No response"},
-                            given_id=None,
-                        )
-                        given_ids = text_id_to_given_ids[text_id]
-                        for given_id in given_ids:
-                            res[given_id] = {
-                                "given_id": data.given_id,
-                                "text_id": data.text_id,
-                                "embedding": data.embedding,
-                            }
+                        to_store_errors.append((text, None))
+
+            stored = self.store_items(to_store)
+            if to_store_errors:
+                stored.extend(
+                    self.store_errors(
+                        texts_given_ids=to_store_errors,
+                        response_full={"message": "No response"},
+                    )
+                )
+            for data in stored:
+                given_ids = text_id_to_given_ids[data.text_id]
+                for given_id in given_ids:
+                    res[given_id] = {
+                        "given_id": data.given_id,
+                        "text_id": data.text_id,
+                        "embedding": data.embedding,
+                    }
             logger.info("Committing chunk %s of len %s", i, added_to_commit)
             logger.info("Total committed %s", len(res))
             self.session.commit()
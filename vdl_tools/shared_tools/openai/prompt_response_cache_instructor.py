@@ -79,13 +79,13 @@ class InstructorPRC(PromptResponseCacheSQL):
 
         return response
 
-    def store_item(
+    def make_item(
         self,
         given_id: str,
         text,
         response,
     ):
-        prompt_response_obj = PromptResponse(
+        return PromptResponse(
             prompt_id=self.prompt.id,
             given_id=given_id,
             input_text=text,
@@ -93,6 +93,3 @@ class InstructorPRC(PromptResponseCacheSQL):
             response_text=json.dumps(response.dict()),
             num_errors=0,
         )
-
-        self.session.merge(prompt_response_obj)
-        return prompt_response_obj
@@ -4,10 +4,12 @@ from concurrent.futures import ThreadPoolExecutor as ThreadPool
 from sqlalchemy import select, tuple_
 from more_itertools import chunked
 
+from vdl_tools.shared_tools.database_cache.bulk_upsert import bulk_upsert
 from vdl_tools.shared_tools.database_cache.database_models.prompt import Prompt, PromptResponse
 from vdl_tools.shared_tools.database_cache.database_utils import get_session
 from vdl_tools.shared_tools.openai.openai_api_utils import get_completion
 from vdl_tools.shared_tools.tools.logger import logger
+from vdl_tools.shared_tools.tools.run_report import add_counts, add_token_usage, in_current_context
 
 import logging
 logger.setLevel(logging.DEBUG)
@@ -33,6 +35,8 @@ def register_prompt(prompt: Prompt, session):
 
 
 class PromptResponseCacheSQL():
+    # How a new error finds the stored row it updates, see `store_errors`
+    error_match_column = "text_id"
 
     def __init__(
         self,
@@ -156,6 +160,67 @@ class PromptResponseCacheSQL():
         logger.info("%s previous found, %s unfound", len(found_rows), len(unfound_ids_or_errors))
         return found_rows, unfound_ids_or_errors
 
+    def make_error(
+        self,
+        given_id: str,
+        text,
+        response_full,
+    ) -> PromptResponse:
+        """Builds the error row stored for a failed completion. Subclasses can override this
+        to change how the input text is stored."""
+        return PromptResponse(
+            prompt_id=self.prompt.id,
+            given_id=given_id,
+            input_text=text,
+            response_full=response_full,
+            num_errors=1,
+        )
+
+    def _match_stored_errors(self, prompt_response_objs: list[PromptResponse]):
+        """Points each error row at the row already stored for the same text, if any.
+
+        An error on a text that is stored under another `given_id` updates that row
+        rather than adding one for the new `given_id`.
+        """
+        text_ids = list({x.text_id for x in prompt_response_objs})
+        text_id_to_given_id = {}
+        for chunk in chunked(text_ids, 4000):
+            stored = self.session.execute(
+                select(PromptResponse.text_id, PromptResponse.given_id)
+                .where(
+                    PromptResponse.prompt_id == self.prompt.id,
+                    PromptResponse.text_id.in_(chunk),
+                )
+            )
+            for text_id, given_id in stored:
+                text_id_to_given_id.setdefault(text_id, given_id)
+
+        for prompt_response_obj in prompt_response_objs:
+            prompt_response_obj.given_id = text_id_to_given_id.get(
+                prompt_response_obj.text_id,
+                prompt_response_obj.given_id,
+            )
+
+    def store_errors(self, prompt_response_objs: list[PromptResponse]):
+        """Upserts error rows, adding to `num_errors` of the ones already stored.
+
+        Errors are matched to stored rows by `error_match_column`: "text_id" updates
+        the row stored for the same text whatever its `given_id`, "given_id" the row
+        with the same primary key.
+        """
+        if not prompt_response_objs:
+            return
+        if self.error_match_column == "text_id":
+            self._match_stored_errors(prompt_response_objs)
+        # Previously stored rows only get their response and error count updated
+        bulk_upsert(
+            self.session,
+            PromptResponse,
+            prompt_response_objs,
+            update_columns=["response_full", "num_errors"],
+            return_rows=False,
+        )
+
     def store_error(
         self,
         given_id: str,
@@ -163,42 +228,23 @@ class PromptResponseCacheSQL():
         response_full,
     ):
         logger.info("Storing error for %s, %s", self.prompt.name, given_id)
-        text_id = PromptResponse.create_text_id(text)
-        previous_response = (
-            self.session
-            .query(PromptResponse)
-            .filter(
-                PromptResponse.prompt_id == self.prompt.id,
-                PromptResponse.text_id == text_id,
-            )
-            .first()
+        prompt_response_obj = self.make_error(
+            given_id=given_id,
+            text=text,
+            response_full=response_full,
         )
-        if previous_response:
-            previous_response.response_full = response_full
-            if previous_response.num_errors:
-                previous_response.num_errors += 1
-            else:
-                previous_response.num_errors = 1
-            self.session.merge(previous_response)
-            prompt_response_obj = previous_response
-        else:
-            prompt_response_obj = PromptResponse(
-                prompt_id=self.prompt.id,
-                given_id=given_id,
-                input_text=text,
-                response_full=response_full,
-                num_errors=1,
-            )
-            self.session.merge(prompt_response_obj)
+        self.store_errors([prompt_response_obj])
         return prompt_response_obj
 
-    def store_item(
+    def make_item(
         self,
         given_id: str,
         text,
         response,
-    ):
-        prompt_response_obj = PromptResponse(
+    ) -> PromptResponse:
+        """Builds the row stored for a completion. Subclasses can override this
+        to change how the response is stored."""
+        return PromptResponse(
             prompt_id=self.prompt.id,
             given_id=given_id,
             input_text=text,
@@ -207,8 +253,23 @@ class PromptResponseCacheSQL():
             num_errors=None,
         )
 
+    def store_items(self, prompt_response_objs: list[PromptResponse]):
+        bulk_upsert(self.session, PromptResponse, prompt_response_objs, return_rows=False)
+
+    def store_item(
+        self,
+        given_id: str,
+        text,
+        response,
+    ):
+        prompt_response_obj = self.make_item(
+            given_id=given_id,
+            text=text,
+            response=response,
+        )
+
         logger.debug("Storing response for %s, %s", self.prompt.name, given_id)
-        self.session.merge(prompt_response_obj)
+        self.store_items([prompt_response_obj])
         return prompt_response_obj
 
     def get_completion_catch_error(self, prompt_str, text, model="gpt-4.1-mini", **kwargs):
@@ -250,8 +311,10 @@ class PromptResponseCacheSQL():
             )
             if data:
                 logger.info("Found cached response for %s", given_id)
+                add_counts(cache_hits=1)
                 return data.to_dict()
 
+        add_counts(cache_misses=1)
         response, error = self.get_completion_catch_error(
             prompt_str=self.prompt.prompt_str,
             text=text,
@@ -260,6 +323,7 @@ class PromptResponseCacheSQL():
             **kwargs
         )
         if not error:
+            add_token_usage(response)
             data = self.store_item(
                 given_id=given_id,
                 text=text,
@@ -267,6 +331,7 @@ class PromptResponseCacheSQL():
             )
         else:
             logger.warning("No response text for %s", given_id)
+            add_counts(api_calls=1, api_errors=1)
             self.store_error(
                 given_id=given_id,
                 text=text,
@@ -361,8 +426,9 @@ class PromptResponseCacheSQL():
         len_unfound = len(unfound_rows)
         logger.info("Found %s cached responses", len(res))
         logger.info("Need to run %s responses", len_unfound)
+        add_counts(cache_hits=len(found_rows), cache_misses=len_unfound)
 
-        def _get_completion_store(given_id_text):
+        def _get_completion(given_id_text):
             given_id, text = given_id_text
             response, error = self.get_completion_catch_error(
                 prompt_str=self.prompt.prompt_str,
@@ -371,31 +437,29 @@ class PromptResponseCacheSQL():
                 return_all=True,
                 **kwargs
             )
-            if error:
-                self.store_error(
-                    given_id=given_id,
-                    text=text,
-                    response_full=response,
-                )
-                return None
-
-            data = self.store_item(
-                given_id=given_id,
-                text=text,
-                response=response,
-            )
-            return data.to_dict()
+            return given_id, text, response, error
 
         n_run = 0
         with ThreadPool(max_workers=max_workers) as executor:
             for chunk in chunked(unfound_rows, n_per_commit):
-                given_ids, _ = zip(*chunk)
                 try:
                     logger.info("Running GPT %s on chunk of %s", self.prompt.name, len(chunk))
-                    results = list(executor.map(_get_completion_store, chunk))
-                    for given_id, response in zip(given_ids, results):
-                        if response:
-                            res[given_id] = response
+                    results = list(executor.map(in_current_context(_get_completion), chunk))
+
+                    # Store the whole chunk from this thread in two statements
+                    # instead of merging each row from the workers
+                    items, errors = [], []
+                    for given_id, text, response, error in results:
+                        if error:
+                            errors.append(self.make_error(given_id, text, response))
+                            add_counts(api_calls=1, api_errors=1)
+                        else:
+                            items.append(self.make_item(given_id, text, response))
+                            add_token_usage(response)
+                    self.store_items(items)
+                    self.store_errors(errors)
+                    for prompt_response_obj in items:
+                        res[prompt_response_obj.given_id] = prompt_response_obj.to_dict()
                     self.session.commit()
                     n_run += len(results)
                 except KeyboardInterrupt:
@@ -11,7 +11,6 @@ from vdl_tools.shared_tools.database_cache.database_models.prompt import PromptR
 from vdl_tools.shared_tools.openai.openai_api_utils import CLIENT
 from vdl_tools.shared_tools.openai.openai_constants import MODEL_DATA
 from vdl_tools.shared_tools.openai.prompt_response_cache_instructor import InstructorPRC
-from vdl_tools.shared_tools.tools.logger import logger
 
 import logging
 
@@ -98,6 +97,9 @@ INTRO_SENTENCE = dedent("""
 
 
 class FewShotCache(InstructorPRC):
+    # The payloads embed the category, errors are kept per given_id
+    error_match_column = "given_id"
+
     def __init__(
         self,
         session,
@@ -286,13 +288,13 @@ class FewShotCache(InstructorPRC):
 
         return response
 
-    def store_item(
+    def make_item(
         self,
         given_id: str,
         text,
         response,
     ):
-        prompt_response_obj = PromptResponse(
+        return PromptResponse(
             prompt_id=self.prompt.id,
             given_id=given_id,
             input_text=json.dumps(text),
@@ -301,40 +303,16 @@ class FewShotCache(InstructorPRC):
             num_errors=0,
         )
 
-        self.session.merge(prompt_response_obj)
-        return prompt_response_obj
-
-
-    def store_error(
+    def make_error(
         self,
         given_id: str,
         text,
         response_full,
     ):
-        logger.info("Storing error for %s, %s", self.prompt.name, given_id)
-        previous_response = (
-            self.session.query(PromptResponse)
-            .filter(
-                PromptResponse.prompt_id == self.prompt.id,
-                PromptResponse.given_id == given_id,
-            )
-            .first()
+        return PromptResponse(
+            prompt_id=self.prompt.id,
+            given_id=given_id,
+            input_text=json.dumps(text),
+            response_full=response_full,
+            num_errors=1,
         )
-        if previous_response:
-            previous_response.response_full = response_full
-            if previous_response.num_errors:
-                previous_response.num_errors += 1
-            else:
-                previous_response.num_errors = 1
-            self.session.merge(previous_response)
-            prompt_response_obj = previous_response
-        else:
-            prompt_response_obj = PromptResponse(
-                prompt_id=self.prompt.id,
-                given_id=given_id,
-                input_text=json.dumps(text),
-                response_full=response_full,
-                num_errors=1,
-            )
-            self.session.merge(prompt_response_obj)
-        return prompt_response_obj
@@ -8,6 +8,12 @@ from vdl_tools.shared_tools.taxonomy_mapping.few_shot_cache import FewShotCache
 from vdl_tools.shared_tools.tools.logger import logger
 
 
+# entities whose similarities to all the categories are computed at once
+MAPPING_CHUNK_SIZE = 2000
+# maximum number of similarities in the reference distribution of the percentiles
+MAX_REFERENCE_SIZE = 20_000_000
+
+
 # get or compute embeddings on cft data
 def get_or_compute_embeddings(
     org_df,
@@ -55,91 +61,140 @@ def get_lineage(item, level, taxonomy, full_lineage=[]):
     return full_lineage
 
 
-def _get_similarity_percentiles(
-    sims,
-    cats,
-    id_attr,
-    uids,
-    nmax,
-    thr,
-    pct_delta,
-    taxonomy,
-    force_parents=False
-):
-    sims_distr = sims.flatten()
-    sims_distr.sort()
-
-    # max_sims = sims.max(axis=1)
+def _top_categories(sims, pcts, cats, id_attr, uids, nmax, thr, pct_delta):
+    """
+    Best matching categories of each entity: up to nmax categories over the
+    percentile threshold thr and within pct_delta of the best one, at least one.
+    """
     # get each row indices, descending sort
-    sorted_indices = np.flip(sims.argsort(axis=1), axis=1)
-    pcts = 100 * np.searchsorted(sims_distr, sims) / len(sims_distr)
+    sorted_indices = np.flip(sims.argsort(axis=1), axis=1)[:, :nmax]
     max_pct = pcts.max(axis=1)
     pct_thr = np.maximum(max_pct - pct_delta, thr)
     # get top n over thr and within pct_delta of max where n is up to nmax
     top_n = np.maximum(1, np.minimum(nmax, (pcts > pct_thr[:, np.newaxis]).sum(axis=1)))
-    top_cats = []
-    for idx, nn in enumerate(top_n):
-        cur_cats = [(cats[n] + (sims[idx, n], pcts[idx, n], uids[idx], n_idx))
-                    for n_idx, n in enumerate(sorted_indices[idx, 0:nn])]
-        top_cats.extend(cur_cats)
+    rows, ranks = np.nonzero(np.arange(sorted_indices.shape[1]) < top_n[:, np.newaxis])
+    cat_indices = sorted_indices[rows, ranks]
+    cat_names = np.array([cat[0] for cat in cats], dtype=object)
+    cat_levels = np.array([cat[1] for cat in cats])
+    return pd.DataFrame({
+        'category': cat_names[cat_indices],
+        'cat_level': cat_levels[cat_indices],
+        'sim': sims[rows, cat_indices],
+        'pct': pcts[rows, cat_indices],
+        id_attr: np.asarray(uids)[rows],
+        'rank': ranks,
+    })
+
+
+class TaxonomyLineage:
+    """
+    Ancestors of every category of a taxonomy as integer arrays, built once so
+    that the levels of many mapped categories are gathered at once.
 
-    df = pd.DataFrame(top_cats, columns=['category', 'cat_level', 'sim', 'pct', id_attr, 'rank'])
-    if force_parents:
-        groups = df.groupby(id_attr)
-        extended_cats = []
-        for group_id, group in groups:
-            extended_cats.extend(_add_all_doc_parents_categories(group, taxonomy, group_id))
-        df = pd.DataFrame(extended_cats, columns=['category', 'cat_level', 'sim', 'pct', id_attr, 'rank'])
-
-    # walk down the taxonomic hierarchy filling in labels
-    max_level = len(taxonomy) - 1
-    for level in range(max_level, -1, -1):
-        if level == max_level:  # leaf nodes
-            df[f'level{level}'] = [cat if df.cat_level[idx] == level else None for idx, cat in enumerate(df.category)]
-        elif level > 0:
-            # walk up the hierarchy - get term's solution, or get solution if no term
-            df[f'level{level}'] = [_get_parent(txt, level + 1, taxonomy) if txt is not None else
-                                   (df.category[idx] if df.cat_level[idx] == level else None)
-                                   for idx, txt in enumerate(df[f'level{level + 1}'])]
-        else:       # root
-            df[f'level{level}'] = [_get_parent(txt, level + 1, taxonomy) if txt is not None else
-                                   df.category[idx] for idx, txt in enumerate(df[f'level{level + 1}'])]
-    return df, sims_distr
-
-
-def _add_all_doc_parents_categories(doc_group, taxonomy, group_id):
+    Each category is a node id, `ancestors[node, level]` is the node id of its
+    ancestor at that level, the node itself at its own level and -1 below it
+    or when the chain of parents is broken. Parents that are not categories of
+    the level above are treated as missing.
+
+    Parameters
+    ----------
+    taxonomy : list
+        List of dicts with the 'name' and 'data' of each level, the data of a
+        level has the name of the parent category in the column of the level
+        above.
     """
-    Adds all the parents of the tagged categories to the list of categories
-    for a specific entity.
-
-    Args:
-    ------
-    doc_group: pd.DataFrame
-        DataFrame of categories for a specific entity.
-    taxonomy: list
-        List of taxonomies.
-    group_id: str
-        ID of the entity.
-
-    Returns:
-    --------
-    group_cats: list[tuple]
-        List of categories for the entity.
+
+    def __init__(self, taxonomy):
+        names, levels, parents = [], [], []
+        for level, tx in enumerate(taxonomy):
+            data = tx['data'].drop_duplicates(subset=tx['name'])
+            names.extend(data[tx['name']])
+            levels.extend([level] * len(data))
+            if level > 0:
+                parents.extend(data[taxonomy[level - 1]['name']])
+            else:
+                parents.extend([None] * len(data))
+        self.n_levels = len(taxonomy)
+        self.names = np.array(names, dtype=object)
+        self.levels = np.array(levels)
+        self.node_index = pd.MultiIndex.from_arrays([self.names, self.levels])
+
+        parent_ids = np.full(len(names), -1)
+        has_parent = self.levels > 0
+        parent_ids[has_parent] = self.node_ids(
+            np.array(parents, dtype=object)[has_parent],
+            self.levels[has_parent] - 1,
+        )
+        self.ancestors = np.full((len(names), self.n_levels), -1)
+        self.ancestors[np.arange(len(names)), self.levels] = np.arange(len(names))
+        for level in range(self.n_levels - 1, 0, -1):
+            has_ancestor = self.ancestors[:, level] != -1
+            self.ancestors[has_ancestor, level - 1] = parent_ids[self.ancestors[has_ancestor, level]]
+
+    def node_ids(self, names, levels):
+        """Node ids of the (name, level) categories, -1 for unknown ones."""
+        return self.node_index.get_indexer(pd.MultiIndex.from_arrays([names, levels]))
+
+    def names_of(self, node_ids):
+        """Names of the nodes, None for -1."""
+        node_ids = np.asarray(node_ids)
+        return np.where(node_ids != -1, self.names[node_ids], None)
+
+
+def _add_all_parents_categories(df, lineage, id_attr):
     """
-    group_cats = doc_group.values.tolist()
-
-    parents_to_add = set()
-    current_cats = set((cat[0], cat[1]) for cat in group_cats)
-    for cat in group_cats:
-        if cat[1] > 0:
-            lineage = get_lineage(cat[0], cat[1], taxonomy)
-            for parent, parent_level in lineage:
-                # Skip the parent if it's already in the list
-                if (parent, parent_level) not in current_cats:
-                    parents_to_add.add((parent, parent_level))
-    for parent, parent_level in parents_to_add:
-        group_cats.append((parent, parent_level, -1, -1, group_id, None))
-    return group_cats
+    Adds all the parents of the tagged categories of each entity that are not
+    already tagged, with sim and pct -1 and no rank. Rows are grouped by entity.
+    """
+    nodes = lineage.node_ids(df.category.values, df.cat_level.values)
+    ancestors = lineage.ancestors[nodes]
+    is_parent = (
+        (ancestors != -1) &
+        (np.arange(lineage.n_levels) < df.cat_level.values[:, np.newaxis]) &
+        (nodes != -1)[:, np.newaxis]
+    )
+    rows, _ = np.nonzero(is_parent)
+    parents = pd.DataFrame({id_attr: df[id_attr].values[rows], 'node': ancestors[is_parent]})
+    # Skip the parents that are already in the list of the entity
+    tagged = pd.DataFrame({id_attr: df[id_attr].values, 'node': nodes})
+    parents = (
+        parents
+        .drop_duplicates()
+        .merge(tagged.drop_duplicates(), how='left', indicator=True)
+        .query('_merge == "left_only"')
+        .sort_values([id_attr, 'node'], kind='stable')
+    )
+    added = pd.DataFrame({
+        'category': lineage.names[parents['node'].values],
+        'cat_level': lineage.levels[parents['node'].values],
+        'sim': -1,
+        'pct': -1,
+        id_attr: parents[id_attr].values,
+        'rank': np.nan,
+    })
+    return (
+        pd.concat([df, added], ignore_index=True)
+        .sort_values(id_attr, kind='stable')
+        .reset_index(drop=True)
+    )
+
+
+def _add_category_levels(df, lineage, id_attr, force_parents=False):
+    """Adds the parents of the categories if force_parents and the level{n} columns."""
+    if force_parents:
+        df = _add_all_parents_categories(df, lineage, id_attr)
+
+    nodes = lineage.node_ids(df.category.values, df.cat_level.values)
+    ancestors = np.where((nodes != -1)[:, np.newaxis], lineage.ancestors[nodes], -1)
+    # the categories of the leaf level, then walking up the hierarchy the
+    # parent of the level below or the category if it is at this level
+    for level in range(lineage.n_levels - 1, -1, -1):
+        level_names = lineage.names_of(ancestors[:, level])
+        if level == 0 and lineage.n_levels > 1:
+            # entities without a level 1 category keep their category as root
+            level_names = np.where(ancestors[:, 1] != -1, level_names, df.category.values)
+        df[f'level{level}'] = level_names
+    return df
 
 
 def _get_cat_level(cat, level_text):
@@ -170,6 +225,113 @@ def compute_category_embeddings(
     return definition_embeddings, cats
 
 
+class TaxonomyIndex:
+    """
+    Category embeddings and lineage of a taxonomy and a reference distribution
+    of entity-category similarities, computed once and reused to map entities.
+
+    The percentile of a similarity is its rank in the reference distribution.
+    By default the reference is all the similarities of the first entities
+    mapped with the index, a sample of them when there are more than
+    max_reference_size similarities. Entities are then mapped by chunks, so
+    the memory used doesn't grow with the number of entities.
+
+    Parameters
+    ----------
+    taxonomy : list
+        List of dicts with the 'name', 'textattr' and 'data' of each level.
+    max_workers : int, optional
+        Number of workers to embed the category definitions, by default 3.
+    """
+
+    def __init__(self, taxonomy, max_workers=3):
+        # set indices so can lookup parent categories in the hierarchy
+        for tx in taxonomy[1:]:
+            tx['data'].set_index(tx['name'], drop=False, inplace=True)
+        # get text at different taxonomic levels
+        all_text = dict()
+        level_text = []
+        for tx in taxonomy:
+            txt_dict = dict(zip(tx['data'][tx['name']], tx['data'][tx['textattr']]))
+            all_text |= txt_dict
+            level_text.append(txt_dict)
+        self.taxonomy = taxonomy
+        self.lineage = TaxonomyLineage(taxonomy)
+        definition_embeddings, self.cats = compute_category_embeddings(
+            all_text,
+            level_text,
+            max_workers=max_workers
+        )
+        # transposed once, each chunk of entities is a single matrix product
+        self.definition_embeddings_t = np.ascontiguousarray(definition_embeddings.T)
+        self.reference = None
+
+    def similarities(self, entity_embeddings):
+        return np.asarray(entity_embeddings) @ self.definition_embeddings_t
+
+    def fit_reference(
+        self,
+        entity_embeddings,
+        max_reference_size=MAX_REFERENCE_SIZE,
+        chunk_size=MAPPING_CHUNK_SIZE,
+        random_state=0,
+    ):
+        """
+        Sets the reference distribution to the sorted similarities of the
+        entities, or of a random sample of them that has at most
+        max_reference_size similarities.
+        """
+        entity_embeddings = np.asarray(entity_embeddings)
+        n_rows = len(entity_embeddings)
+        n_sample = max(1, max_reference_size // len(self.cats))
+        if n_rows > n_sample:
+            logger.info("Sampling %s of %s entities for the reference similarities", n_sample, n_rows)
+            rng = np.random.default_rng(random_state)
+            entity_embeddings = entity_embeddings[np.sort(rng.choice(n_rows, n_sample, replace=False))]
+        reference = np.concatenate([
+            self.similarities(entity_embeddings[start:start + chunk_size]).ravel()
+            for start in range(0, len(entity_embeddings), chunk_size)
+        ])
+        reference.sort()
+        self.reference = reference
+        return reference
+
+    def percentiles(self, sims):
+        return 100 * np.searchsorted(self.reference, sims) / len(self.reference)
+
+    def map_entities(
+        self,
+        entity_embeddings,
+        uids,
+        id_attr,
+        nmax,
+        thr,
+        pct_delta,
+        chunk_size=MAPPING_CHUNK_SIZE,
+    ):
+        """
+        Best matching categories of each entity, one row per entity and
+        category with its similarity, percentile and rank. Fits the reference
+        distribution on these entities if it isn't set.
+        """
+        if self.reference is None:
+            self.fit_reference(entity_embeddings, chunk_size=chunk_size)
+        chunks = []
+        for start in range(0, len(entity_embeddings), chunk_size):
+            sims = self.similarities(entity_embeddings[start:start + chunk_size])
+            chunks.append(_top_categories(
+                sims,
+                self.percentiles(sims),
+                self.cats,
+                id_attr,
+                uids[start:start + chunk_size],
+                nmax,
+                thr,
+                pct_delta,
+            ))
+        return pd.concat(chunks, ignore_index=True)
+
+
 def get_entity_categories(
     cft_df,
     taxonomy,
@@ -181,41 +343,34 @@ def get_entity_categories(
     entity_embeddings,
     max_level=None,
     max_workers=3,
-    force_parents=False
+    force_parents=False,
+    taxonomy_index=None,
+    chunk_size=MAPPING_CHUNK_SIZE,
 ):
+    """
+    Maps the entities to up to nmax categories of the taxonomy.
 
-    # set indices so can lookup parent categories in the hierarchy
-    for tx in taxonomy[1:]:
-        tx['data'].set_index(tx['name'], drop=False, inplace=True)
-    # get text at different taxonomic levels
-    all_text = dict()
-    level_text = []
-    for tx in taxonomy:
-        txt_dict = dict(zip(tx['data'][tx['name']], tx['data'][tx['textattr']]))
-        all_text |= txt_dict
-        level_text.append(txt_dict)
-    # match up to nmax categories
-    # compute category embedings
-    definition_embeddings, cats = compute_category_embeddings(
-        all_text,
-        level_text,
-        max_workers=max_workers
-    )
-    # compute similarities between entity and category embeddings
-    similarities = entity_embeddings @ definition_embeddings.T
+    taxonomy_index is a TaxonomyIndex of the taxonomy to reuse its category
+    embeddings and reference similarities across calls, it is built from the
+    taxonomy and these entities when not given.
+
+    Returns the mapping merged with cft_df and the reference distribution of
+    similarities used for the percentiles.
+    """
+    if taxonomy_index is None:
+        taxonomy_index = TaxonomyIndex(taxonomy, max_workers=max_workers)
     # get best matching caegories for each entity
     logger.info("Assigning categories")
-    rdf, sims_distr = _get_similarity_percentiles(
-        similarities,
-        cats,
-        id_attr,
+    rdf = taxonomy_index.map_entities(
+        np.asarray(entity_embeddings),
         cft_df[id_attr].values,
+        id_attr,
         nmax,
         thr,
         pct_delta,
-        taxonomy,
-        force_parents=force_parents
+        chunk_size=chunk_size,
     )
+    rdf = _add_category_levels(rdf, taxonomy_index.lineage, id_attr, force_parents=force_parents)
 
     # final category is set to max category level
     rdf['mapped_category'] = rdf.category
@@ -226,7 +381,7 @@ def get_entity_categories(
 
     all_df = cft_df.merge(rdf, on=id_attr)
     all_df = distribute_entity_funding(all_df, id_attr)
-    return all_df, sims_distr
+    return all_df, taxonomy_index.reference
 
 
 def distribute_entity_funding(df, id_attr):
@@ -234,14 +389,50 @@ def distribute_entity_funding(df, id_attr):
     if 'FundingFrac' in df.columns:
         df.drop(columns='FundingFrac', inplace=True)
 
-    # Add a temporary id column to count and index the number of rows for each entity
-    df['temp_id'] = df[id_attr]
-    cnts = df.groupby(id_attr)["temp_id"].count()
-    df['FundingFrac'] = 1 / df[id_attr].apply(lambda x: cnts[x])
-    df.drop(columns='temp_id', inplace=True)
+    # split each entity evenly across its rows
+    df['FundingFrac'] = 1 / df[id_attr].map(df[id_attr].value_counts())
     return df
 
 
+def _normalize_entity_fracs(df, id_attr, mask, frac_attr='FundingFrac'):
+    """Normalizes the fractions of the entities of the rows in mask to sum to 1 per entity."""
+    entity_mask = df[id_attr].isin(set(df.loc[mask, id_attr].unique())).values
+    fracs = df[frac_attr].values[entity_mask]
+    totals = df.loc[entity_mask].groupby(id_attr)[frac_attr].transform('sum').values
+    # entities whose rows all have a zero fraction get NaN, as with pandas
+    with np.errstate(invalid='ignore', divide='ignore'):
+        df.loc[entity_mask, frac_attr] = fracs / totals
+
+
+def _spread_to_children(parent_df, child_df, parent_col, child_cols, value_attr, keep_cols=()):
+    """
+    Splits the value_attr of each row of parent_df across the rows of child_df
+    that have the same parent_col, in proportion to their 'Fractions'.
+
+    Returns one row per parent row and child in the order of parent_df then of
+    child_df, with the child_cols of the child, the split value and the
+    keep_cols of the parent row. A parent without children gives a single row
+    without child values.
+    """
+    parents = parent_df[[parent_col, value_attr, *keep_cols]].reset_index(drop=True)
+    parents['_parent_row'] = np.arange(len(parents))
+    children = child_df[list(dict.fromkeys([parent_col, *child_cols, 'Fractions']))]
+    children = children[children[parent_col].notna()].reset_index(drop=True)
+    children['_child_row'] = np.arange(len(children))
+    spread = (
+        parents
+        .merge(children, on=parent_col, how='left', indicator=True)
+        .sort_values(['_parent_row', '_child_row'], kind='stable')
+    )
+    data = {col: spread[col].values for col in child_cols}
+    # the parent value comes from the child in the spread rows
+    data[parent_col] = np.where(spread['_merge'] == 'left_only', np.nan, spread[parent_col].values)
+    data[value_attr] = spread['Fractions'].values * spread[value_attr].values
+    for col in keep_cols:
+        data[col] = spread[col].values
+    return pd.DataFrame(data)
+
+
 def _filter_to_leaf_nodes(df: pd.DataFrame, id_attr: str, name_attr: str, n_levels=4):
     """ assess whether there's a leaf node and higher level branches
     keeps the lower level branches
@@ -358,29 +549,21 @@ def redistribute_funding_fracs(
         duplicated = df.duplicated(levels + [id_attr])
         df.loc[duplicated, 'FundingFrac'] = 0
         # normalize the FundingFrac values in each entity which had duplicate level data
-        dup_ids = set(df.loc[duplicated, id_attr].unique())
-        dup_df = df[df[id_attr].isin(dup_ids)]
-        for uid, edf in dup_df.groupby(id_attr):
-            df.loc[edf.index, 'FundingFrac'] /= df.loc[edf.index, 'FundingFrac'].sum()
+        _normalize_entity_fracs(df, id_attr, duplicated)
     if not across_levels:
         # get entities with empty level assignments
-        row_with_na = df[levels].isna().sum(axis=1) > 0
-        uid_with_na = set(df[id_attr][row_with_na].unique())
-        na_df = df[df[id_attr].isin(uid_with_na)]
-        for uid, edf in na_df.groupby(id_attr):
-            # for each entity with level_n == na, see if it matches another row in the entity
-            na_rows = edf.loc[edf[levels].isna().sum(axis=1) > 0]
-            for idx, row in na_rows.iterrows():
-                # get matches at each (non-na) level
-                match_df = edf[levels].copy()
-                for attr in levels:
-                    if not type(row[attr]) is str:
-                        break
-                    match_df = match_df[match_df[attr] == row[attr]]
-                if len(match_df) > 1:   # current row (with na's) matches more than itself
-                    df.loc[idx, 'FundingFrac'] = 0
-            # normalize the FundingFrac values
-            df.loc[edf.index, 'FundingFrac'] /= df.loc[edf.index, 'FundingFrac'].sum()
+        row_with_na = (df[levels].isna().sum(axis=1) > 0).values
+        # a row with na levels matches the rows of its entity that have the same
+        # levels down to its first na level
+        is_str = np.column_stack([df[attr].map(lambda x: type(x) is str).values for attr in levels])
+        n_matched_levels = np.cumprod(is_str, axis=1).sum(axis=1)
+        matches_other_row = np.zeros(len(df), dtype=bool)
+        for n_levels in np.unique(n_matched_levels[row_with_na]):
+            n_matches = df.groupby([id_attr] + levels[:n_levels])[frac_attr].transform('size').values
+            matches_other_row |= row_with_na & (n_matched_levels == n_levels) & (n_matches > 1)
+        df.loc[matches_other_row, 'FundingFrac'] = 0
+        # normalize the FundingFrac values
+        _normalize_entity_fracs(df, id_attr, row_with_na)
         # set the na level entries to "No_level_n"
         for idx, attr in enumerate(levels):
             mask = df[attr].isna()
@@ -410,6 +593,10 @@ def redistribute_funding_fracs(
             logger.error("max_level must be 1 or 2")
             return None
 
+        # Each level is spread with a single merge over all the entities. The levels stay in
+        # sequence: the level0-only rows spread to level1 are spread again to level2, and the
+        # order of the rows, which the concatenated higher levels follow, is the one of the
+        # level by level spread.
         if max_level >= 1:
             # first distribute level0 (pillar-level) funding across level1 (subpillars)
             #
@@ -428,17 +615,8 @@ def redistribute_funding_fracs(
             # get orgs with only pillars
             missing_l1_df = df[df.cat_level == 0]
             # distribute pillar fraction across it's subpillars based on observed subpillar fractions
-            mapped_frac = (missing_l1_df.level0.apply(lambda x: l1f_df[l1f_df.level0 == x]['Fractions'].values)
-                           * missing_l1_df[frac_attr])
-            mapped_l1 = missing_l1_df.level0.apply(lambda x: l1f_df[l1f_df.level0 == x]['level1'].values)
-            mapped_l0 = missing_l1_df.level0.apply(lambda x: l1f_df[l1f_df.level0 == x]['level0'].values)
-            mapped_index = mapped_frac.explode().index
-            mapped_df = pd.DataFrame({'level0': mapped_l0.explode().values,
-                                      'level1': mapped_l1.explode().values,
-                                      frac_attr: mapped_frac.explode().values,
-                                      'cat_level': missing_l1_df.cat_level.loc[mapped_index].values,
-                                      id_attr: missing_l1_df[id_attr].loc[mapped_index].values
-                                      })
+            mapped_df = _spread_to_children(missing_l1_df, l1f_df, 'level0', ['level0', 'level1'], frac_attr,
+                                            keep_cols=['cat_level', id_attr])
             total_l1_df = pd.concat([l1_df[[id_attr, 'cat_level', frac_attr] + all_levels], mapped_df])
             total_l1_df = total_l1_df.reset_index(drop=True)
 
@@ -464,18 +642,8 @@ def redistribute_funding_fracs(
                 missing_l2_df = no_l2_df[mask]  # these l1 values have no l2 assignment but there is l2 data in the taxonomy
                 no_l2_df = no_l2_df[~mask]  # these level1 values are leaf nodes, there is no level 2 in this part of the taxonomy
                 # distribute subpillar fractions across it's solns based on observed soln fractions
-                l2_mapped_frac = (missing_l2_df.level1.apply(lambda x: l2f_df[l2f_df.level1 == x]['Fractions'].values)
-                                  * missing_l2_df[frac_attr])
-                l2_mapped_l2s = missing_l2_df.level1.apply(lambda x: l2f_df[l2f_df.level1 == x]['level2'].values)
-                l2_mapped_l1s = missing_l2_df.level1.apply(lambda x: l2f_df[l2f_df.level1 == x]['level1'].values)
-                l2_mapped_l0s = missing_l2_df.level1.apply(lambda x: l2f_df[l2f_df.level1 == x]['level0'].values)
-                mapped_index = l2_mapped_frac.explode().index
-                l2_mapped_df = pd.DataFrame({'level0': l2_mapped_l0s.explode().values,
-                                             'level1': l2_mapped_l1s.explode().values,
-                                             'level2': l2_mapped_l2s.explode().values,
-                                             frac_attr: l2_mapped_frac.explode().values,
-                                             'cat_level': missing_l2_df.cat_level.loc[mapped_index].values,
-                                             id_attr: missing_l2_df[id_attr].loc[mapped_index].values})
+                l2_mapped_df = _spread_to_children(missing_l2_df, l2f_df, 'level1', ['level0', 'level1', 'level2'],
+                                                   frac_attr, keep_cols=['cat_level', id_attr])
                 _total_df = pd.concat([l2_df[[id_attr, 'cat_level', frac_attr] + all_levels],
                                        l2_mapped_df, no_l2_df])
             else:
@@ -514,14 +682,7 @@ def redistribute_funding(df, funding_attr, pv='Philanthropy vs Venture'):
     # get orgs with only pillars
     l0_df = df[df.cat_level == 0]
     # distribute pillar funding across it's subpillars based on observed subpillar fractions
-    mapped_funding = l0_df.level0.apply(lambda x: l1_df[l1_df.level0 == x]['Fractions'].values) * l0_df[funding_attr]
-    mapped_l1 = l0_df.level0.apply(lambda x: l1_df[l1_df.level0 == x]['level1'].values)
-    mapped_l0 = l0_df.level0.apply(lambda x: l1_df[l1_df.level0 == x]['level0'].values)
-    mapped_pv = l0_df.level0.apply(lambda x: l1_df[l1_df.level0 == x][pv].values)
-    mapped_df = pd.DataFrame({'level0': mapped_l0.explode().values,
-                              'level1': mapped_l1.explode().values,
-                              pv: mapped_pv.explode().values,
-                              funding_attr: mapped_funding.explode().values})
+    mapped_df = _spread_to_children(l0_df, l1_df, 'level0', ['level0', 'level1', pv], funding_attr)
     total_l1_df = pd.concat([ssp_df[['level0', 'level1', 'level2', pv, funding_attr]], mapped_df])
 
     # distribute subpillar-level funding across solutions
@@ -540,17 +701,8 @@ def redistribute_funding(df, funding_attr, pv='Philanthropy vs Venture'):
     missing_l2_df = no_l2_df[mask]  # these l1 values have no l2 assignment but there is l2 data in the taxonomy
     no_l2_df = no_l2_df[~mask]  # these level1 values are leaf nodes, there is no level 2 in this part of the taxonomy
     # distribute subpillar funding across it's solns based on observed soln fractions
-    l2_mapped_funding = (missing_l2_df.level1.apply(lambda x: l2f_df[l2f_df.level1 == x]['Fractions'].values)
-                         * missing_l2_df[funding_attr])
-    l2_mapped_l2s = missing_l2_df.level1.apply(lambda x: l2f_df[l2f_df.level1 == x]['level2'].values)
-    l2_mapped_l1s = missing_l2_df.level1.apply(lambda x: l2f_df[l2f_df.level1 == x]['level1'].values)
-    l2_mapped_l0s = missing_l2_df.level1.apply(lambda x: l2f_df[l2f_df.level1 == x]['level0'].values)
-    l2_mapped_pv = missing_l2_df.level1.apply(lambda x: l2f_df[l2f_df.level1 == x][pv].values)
-    l2_mapped_df = pd.DataFrame({'level0': l2_mapped_l0s.explode().values,
-                                 'level1': l2_mapped_l1s.explode().values,
-                                 'level2': l2_mapped_l2s.explode().values,
-                                 pv: l2_mapped_pv.explode().values,
-                                 funding_attr: l2_mapped_funding.explode().values})
+    l2_mapped_df = _spread_to_children(missing_l2_df, l2f_df, 'level1', ['level0', 'level1', 'level2', pv],
+                                       funding_attr)
     total_df = pd.concat([l2_df[['level0', 'level1', 'level2', pv, funding_attr]], l2_mapped_df, no_l2_df])
     return total_df
 
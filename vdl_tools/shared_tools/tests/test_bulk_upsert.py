@@ -0,0 +1,98 @@
+from types import SimpleNamespace
+
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.dialects.postgresql import insert
+
+import vdl_tools.shared_tools.database_cache.bulk_upsert as bu
+import vdl_tools.shared_tools.openai.prompt_response_cache_sql as prc
+from vdl_tools.shared_tools.database_cache.database_models import Embedding, WebPagesScraped
+from vdl_tools.shared_tools.database_cache.database_models.prompt import PromptResponse
+
+
+def _page(cleaned_key, **kwargs):
+    return dict(
+        cleaned_key=cleaned_key,
+        home_url="https://example.org",
+        subpath="",
+        page_type="PageType.INDEX",
+        **kwargs,
+    )
+
+
+def test_prepare_rows_keeps_last_duplicate():
+    table = WebPagesScraped.__table__
+    rows = bu._prepare_rows(
+        table,
+        [_page("a", num_errors=1), _page("b"), _page("a", num_errors=0)],
+    )
+    assert [x["cleaned_key"] for x in rows] == ["b", "a"]
+    assert rows[1]["num_errors"] == 0
+
+
+def test_prepare_rows_only_uses_set_attributes():
+    table = WebPagesScraped.__table__
+    rows = bu._prepare_rows(table, [WebPagesScraped(**_page("a"))])
+    assert set(rows[0]) == {"cleaned_key", "home_url", "subpath", "page_type"}
+
+
+def test_upsert_increments_num_errors():
+    table = WebPagesScraped.__table__
+    columns = tuple(sorted(_page("a", num_errors=1)))
+    stmt = bu._upsert_statement(table, insert(table), columns, None, True)
+    sql = str(stmt.compile(dialect=postgresql.dialect()))
+
+    assert "ON CONFLICT (cleaned_key) DO UPDATE" in sql
+    assert "coalesce(web_pages_scraped.num_errors" in sql
+    assert "cleaned_key = excluded.cleaned_key" not in sql
+
+
+def test_upsert_only_updates_given_columns():
+    table = WebPagesScraped.__table__
+    columns = tuple(sorted(_page("a", num_errors=1)))
+    stmt = bu._upsert_statement(table, insert(table), columns, ["num_errors"], False)
+    sql = str(stmt.compile(dialect=postgresql.dialect()))
+
+    assert "num_errors = excluded.num_errors" in sql
+    assert "home_url = excluded.home_url" not in sql
+
+
+def test_copy_value_escapes():
+    columns = Embedding.__table__.c
+    assert bu._copy_value(None, columns.input_text.type) == "\\N"
+    assert bu._copy_value("a\tb\nc", columns.input_text.type) == "a\\tb\\nc"
+    assert bu._copy_value([1.5, None], columns.embedding.type) == '{"1.5",NULL}'
+    assert bu._copy_value({"x": 1}, columns.response_full.type) == '{"x": 1}'
+
+
+class _StoredRowsSession:
+    def __init__(self, rows):
+        self.rows = rows
+
+    def execute(self, stmt):
+        return iter(self.rows)
+
+
+def _error_cache(cache_class, rows):
+    cache = object.__new__(cache_class)
+    cache.session = _StoredRowsSession(rows)
+    cache.prompt = SimpleNamespace(id="prompt", name="prompt")
+    return cache
+
+
+def test_store_errors_updates_row_stored_for_same_text(monkeypatch):
+    stored_text_id = PromptResponse.create_text_id("same text")
+    upserted = []
+    monkeypatch.setattr(prc, "bulk_upsert", lambda session, model, items, **kwargs: upserted.extend(items))
+
+    cache = _error_cache(prc.PromptResponseCacheSQL, [(stored_text_id, "old_id")])
+    cache.store_errors([
+        cache.make_error("new_id", "same text", {}),
+        cache.make_error("other_id", "other text", {}),
+    ])
+    assert [x.given_id for x in upserted] == ["old_id", "other_id"]
+
+    # caches keyed by given_id keep the given_id of the error
+    upserted.clear()
+    cache.error_match_column = "given_id"
+    cache.store_errors([cache.make_error("new_id", "same text", {})])
+    assert [x.given_id for x in upserted] == ["new_id"]
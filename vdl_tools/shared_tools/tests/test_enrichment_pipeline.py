@@ -0,0 +1,72 @@
+import contextlib
+
+import numpy as np
+import pandas as pd
+
+import vdl_tools.shared_tools.climate_landscape.enrichment_pipeline as ep
+
+
+TEXT_FIELDS = ["Description", "Website Summary"]
+
+
+def _keywords_map():
+    return pd.DataFrame({
+        "tag": ["solar energy", "climate justice", "wind energy"],
+        "search_terms": ["['solar', 'solar panels']", "['environmental justice']", "['wind']"],
+        "broad_tags": ["['renewable energy']", "", "['renewable energy']"],
+        "bigram": ["['solar panels']", "", ""],
+        "unigram": ["['solar']", "", "['wind']"],
+        "equity": [0, 1, 0],
+        "strategy": [0, 0, 0],
+        "eq_strat_keep": [0, 0, 0],
+    })
+
+
+def _relevant():
+    df = pd.DataFrame({
+        "id": ["a", "b", "c"],
+        "Data Source": ["Crunchbase"] * 3,
+        "Description": ["We install solar panels", "Environmental justice for all", ""],
+        "Website Summary": ["Community solar in Ohio", "", "Offshore wind farms"],
+        "Sector_String": ["Energy", np.nan, "Wind"],
+        "Geo_Tags": [["stale"], ["stale"], ["stale"]],
+    })
+    # the adaptation / mitigation model joins the text fields differently
+    df["text"] = df["Description"] + "|" + df["Website Summary"]
+    return df
+
+
+def _patch_services(monkeypatch):
+    monkeypatch.setattr(ep, "get_session", lambda config: contextlib.nullcontext())
+    monkeypatch.setattr(
+        ep,
+        "geotag_texts_bulk",
+        lambda ids_texts, **kwargs: {id_: [{"city": text.split()[-1]}] for id_, text in ids_texts},
+    )
+    monkeypatch.setattr(ep.pd, "read_excel", lambda *args, **kwargs: _keywords_map())
+    monkeypatch.setattr(ep.geocode, "add_geo_lat_long", lambda df, **kwargs: df)
+    monkeypatch.setattr(ep.geocode, "clean_geo", lambda df, **kwargs: df)
+    # the org type is predicted from the text column
+    monkeypatch.setattr(
+        ep.org_type_classifier,
+        "predict",
+        lambda df: df.assign(**{"OrgType Prediction": df["text"]}),
+    )
+
+
+def test_staged_enrichment_matches_linear(monkeypatch):
+    _patch_services(monkeypatch)
+
+    linear = ep.add_geotags(_relevant(), text_fields=TEXT_FIELDS)
+    linear = ep.add_climate_keyword_tags(linear, "kwds.xlsx", text_fields=TEXT_FIELDS)
+    linear = ep.org_type_classifier.predict(linear)
+
+    df_geotags = ep.get_geotags(_relevant(), text_fields=TEXT_FIELDS)
+    df_keywords = ep.get_climate_keywords(_relevant(), "kwds.xlsx", text_fields=TEXT_FIELDS)
+    staged = ep.add_geocodes_and_org_types(_relevant(), df_geotags, df_keywords)
+
+    pd.testing.assert_frame_equal(staged, linear, check_like=True)
+    assert staged["text"][1] == "Environmental justice for all"
+    assert staged["Sector_String"][1] == ""
+    assert staged["Geo_Tags"][0] == ["Ohio"]
+    assert staged["Equity-Justice Mentions"][1] == ["climate justice"]
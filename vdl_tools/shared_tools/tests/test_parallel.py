@@ -0,0 +1,82 @@
+import os
+
+import pandas as pd
+import pytest
+
+from vdl_tools.shared_tools.tools.parallel import (
+    parallel_apply_frame,
+    parallel_imap,
+    parallel_map,
+)
+
+
+def _square(x):
+    return x * x
+
+
+def _lookup(table, key):
+    return table[key], os.getpid()
+
+
+def _double_frame(df):
+    return df * 2
+
+
+@pytest.mark.parametrize("backend", ["thread", "process"])
+def test_parallel_map_keeps_order(backend):
+    items = list(range(1000))
+    assert parallel_map(_square, items, backend=backend, max_workers=3, chunk_size=7) == [
+        x * x for x in items
+    ]
+
+
+def test_parallel_imap_consumes_generators_lazily():
+    consumed = []
+
+    def _items():
+        for x in range(100):
+            consumed.append(x)
+            yield x
+
+    results = parallel_imap(_square, _items(), backend="thread", max_workers=2, chunk_size=5)
+    assert next(results) == 0
+    # only the chunks in flight were read
+    assert len(consumed) < 100
+    assert list(results) == [x * x for x in range(1, 100)]
+
+
+def test_parallel_map_sends_shared_to_workers():
+    table = {i: str(i) for i in range(50)}
+    results = parallel_map(_lookup, list(range(50)), shared=table, max_workers=2)
+    assert [value for value, _ in results] == [str(i) for i in range(50)]
+    assert os.getpid() not in {pid for _, pid in results}
+
+
+def test_parallel_map_reports_progress():
+    reported = []
+    parallel_map(
+        _square,
+        list(range(10)),
+        backend="thread",
+        chunk_size=4,
+        max_workers=1,
+        progress=lambda done, total: reported.append((done, total)),
+    )
+    assert reported == [(4, 10), (8, 10), (10, 10)]
+
+
+def test_parallel_apply_frame():
+    df = pd.DataFrame({"a": range(11)}, index=list("abcdefghijk"))
+    pd.testing.assert_frame_equal(
+        parallel_apply_frame(df, _double_frame, max_workers=2, backend="thread"), df * 2
+    )
+
+
+def test_parallel_map_with_spawned_workers():
+    # the workers import this module again instead of inheriting its state
+    assert parallel_map(_square, list(range(20)), max_workers=2, mp_context="spawn") == [
+        x * x for x in range(20)
+    ]
+    table = {i: str(i) for i in range(20)}
+    results = parallel_map(_lookup, list(range(20)), shared=table, max_workers=2, mp_context="spawn")
+    assert [value for value, _ in results] == [str(i) for i in range(20)]
@@ -0,0 +1,97 @@
+import threading
+
+import pandas as pd
+import pytest
+
+from vdl_tools.shared_tools.tools.pipeline import Pipeline, Stage, read_frame, write_frame
+
+
+def _load(n_rows):
+    return pd.DataFrame({"id": range(n_rows), "text": [f"text {i}" for i in range(n_rows)]})
+
+
+def _add_tags(df, tag):
+    df["tags"] = [[(tag, i)] for i in df["id"]]
+    return df[["id", "tags"]]
+
+
+def _add_length(df):
+    df["length"] = df["text"].str.len()
+    return df[["id", "length"]]
+
+
+def _combine(df, tags, length):
+    return df.merge(tags, on="id").merge(length, on="id")
+
+
+def _stages(calls, tag="a"):
+    def _counted(name, func):
+        def _run(*args, **kwargs):
+            calls.append(name)
+            return func(*args, **kwargs)
+        return _run
+
+    return [
+        Stage("load", _counted("load", _load), inputs=["n_rows"]),
+        Stage("tags", _counted("tags", _add_tags), inputs=["load"], params={"tag": tag}),
+        Stage("length", _counted("length", _add_length), inputs=["load"]),
+        Stage("combined", _counted("combined", _combine), inputs=["load", "tags", "length"]),
+    ]
+
+
+def test_pipeline_resumes_from_checkpoints(tmp_path):
+    calls = []
+    first = Pipeline(_stages(calls), tmp_path).run(n_rows=5)["combined"]
+    assert sorted(calls) == ["combined", "length", "load", "tags"]
+    # the inputs of the stages were copies
+    assert list(first.columns) == ["id", "text", "tags", "length"]
+
+    calls.clear()
+    second = Pipeline(_stages(calls), tmp_path).run(n_rows=5)["combined"]
+    assert calls == []
+    pd.testing.assert_frame_equal(first, second)
+    assert second["tags"][0] == [("a", 0)]
+
+    # only the stages depending on the changed parameter run again
+    calls.clear()
+    Pipeline(_stages(calls, tag="b"), tmp_path).run(n_rows=5)
+    assert sorted(calls) == ["combined", "tags"]
+
+    calls.clear()
+    Pipeline(_stages(calls), tmp_path).run(targets=["length"], force=["load"], n_rows=5)
+    assert calls == ["load", "length"]
+
+
+def test_pipeline_runs_independent_stages_concurrently(tmp_path):
+    barrier = threading.Barrier(2, timeout=5)
+
+    def _wait(df):
+        barrier.wait()
+        return df
+
+    stages = [
+        Stage("load", _load, inputs=["n_rows"]),
+        Stage("left", _wait, inputs=["load"]),
+        Stage("right", _wait, inputs=["load"]),
+    ]
+    outputs = Pipeline(stages, tmp_path, max_workers=2).run(n_rows=3)
+    assert set(outputs) == {"load", "left", "right"}
+
+
+def test_pipeline_rejects_unknown_inputs(tmp_path):
+    with pytest.raises(ValueError, match="Unknown stage or input"):
+        Pipeline([Stage("tags", _add_tags, inputs=["load"])], tmp_path).run()
+
+
+def test_write_frame_keeps_object_columns(tmp_path):
+    df = pd.DataFrame(
+        {
+            "name": ["a", None, "c"],
+            "tags": [[("x", 0.5)], [], None],
+            "geo": [{"city": "Paris"}, {}, {"city": None}],
+            "value": [1.5, None, 3.0],
+        },
+        index=[10, 20, 30],
+    )
+    write_frame(df, tmp_path / "df.parquet")
+    pd.testing.assert_frame_equal(read_frame(tmp_path / "df.parquet"), df)
@@ -0,0 +1,83 @@
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor as ThreadPool
+from types import SimpleNamespace
+
+import pandas as pd
+import pytest
+
+from vdl_tools.shared_tools.tools.parallel import parallel_map
+from vdl_tools.shared_tools.tools.pipeline import Pipeline, Stage
+from vdl_tools.shared_tools.tools.run_report import RunReport, add_counts, add_token_usage
+
+
+def test_stage_records_rows_and_counts(tmp_path):
+    report = RunReport(run_name="test")
+    add_counts(cache_hits=100)  # outside of a stage
+
+    with report.stage("tagging", rows_in=pd.DataFrame({"a": range(3)})) as metrics:
+        add_counts(cache_hits=2, cache_misses=1)
+        usage = SimpleNamespace(prompt_tokens=10, completion_tokens=4)
+        # counts from worker threads go to the only running stage
+        with ThreadPool(2) as pool:
+            list(pool.map(add_token_usage, [SimpleNamespace(usage=usage)] * 2))
+        metrics.set_rows(rows_out=[1, 2])
+
+    with pytest.raises(ValueError):
+        with report.stage("failing"):
+            raise ValueError()
+
+    stages = report.to_dict()["stages"]
+    assert stages[0]["status"] == "done"
+    assert (stages[0]["rows_in"], stages[0]["rows_out"]) == (3, 2)
+    assert stages[0]["cache_hits"] == 2
+    assert stages[0]["api_calls"] == 2
+    assert stages[0]["prompt_tokens"] == 20
+    assert stages[0]["wall_time_s"] >= 0
+    assert stages[1]["status"] == "failed"
+
+    report.write(tmp_path / "report.json")
+    with open(tmp_path / "report.json") as f:
+        assert json.load(f)["totals"]["completion_tokens"] == 8
+    report.write(tmp_path / "report.parquet")
+    assert pd.read_parquet(tmp_path / "report.parquet")["stage"].tolist() == ["tagging", "failing"]
+
+
+def test_pipeline_reports_stages(tmp_path):
+    def _load():
+        add_counts(api_calls=1)
+        return pd.DataFrame({"a": range(4)})
+
+    stages = [Stage("load", _load), Stage("head", lambda df: df.head(2), inputs=["load"])]
+    Pipeline(stages, tmp_path).run()
+
+    report = RunReport()
+    Pipeline(stages, tmp_path, report=report).run(force=["head"])
+    assert [(x["stage"], x["status"], x["rows_in"], x["rows_out"]) for x in report.to_dict()["stages"]] == [
+        ("load", "checkpoint", None, 4),
+        ("head", "done", 4, 2),
+    ]
+
+
+def _count_api_call(_):
+    add_counts(api_calls=1)
+
+
+def test_concurrent_stages_count_their_worker_threads(tmp_path):
+    both_running = threading.Barrier(2, timeout=10)
+
+    def _stage(n_calls):
+        def _run():
+            both_running.wait()
+            parallel_map(_count_api_call, range(n_calls), backend="thread", max_workers=3)
+            return n_calls
+
+        return _run
+
+    stages = [Stage("three", _stage(3)), Stage("five", _stage(5))]
+    report = RunReport()
+    Pipeline(stages, tmp_path, report=report, max_workers=2).run()
+    assert {x["stage"]: x["api_calls"] for x in report.to_dict()["stages"]} == {
+        "three": 3,
+        "five": 5,
+    }
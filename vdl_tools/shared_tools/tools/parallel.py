@@ -0,0 +1,231 @@
+"""
+Ordered, chunked parallel map over threads or processes.
+
+Large read-only objects (tag corpora, taxonomies, embedding matrices) are
+passed as `shared`: each worker process receives them once through the pool
+initializer instead of with every chunk, and threads use them directly.
+"""
+import itertools
+import multiprocessing as mp
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor as ProcessPool
+from concurrent.futures import ThreadPoolExecutor as ThreadPool
+from typing import Any, Callable, Iterable, Iterator, List, Optional, Union
+
+import numpy as np
+import pandas as pd
+
+from vdl_tools.shared_tools.tools.logger import logger
+from vdl_tools.shared_tools.tools.run_report import in_current_context
+
+BACKENDS = ("process", "thread")
+# chunks submitted ahead of the one being yielded, per worker
+CHUNKS_IN_FLIGHT = 2
+# default of `shared`, only compared against in the calling process: a copy
+# unpickled in a worker process is a different object
+_NOT_SHARED = object()
+
+# the `shared` object of the pool this process is a worker of
+_worker_has_shared = False
+_worker_shared = None
+
+
+def _init_worker(has_shared, shared, initializer, initargs):
+    global _worker_has_shared, _worker_shared
+    _worker_has_shared = has_shared
+    _worker_shared = shared
+    if initializer is not None:
+        initializer(*initargs)
+
+
+def _run_chunk(func, chunk, has_shared, shared):
+    if has_shared:
+        return [func(shared, item) for item in chunk]
+    return [func(item) for item in chunk]
+
+
+def _run_worker_chunk(func, chunk):
+    return _run_chunk(func, chunk, _worker_has_shared, _worker_shared)
+
+
+def _iter_chunks(items: Iterable, chunk_size: int) -> Iterator[List[Any]]:
+    iterator = iter(items)
+    while True:
+        chunk = list(itertools.islice(iterator, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _progress_logger(desc: str, total: Optional[int]) -> Callable[[int], None]:
+    state = {"logged": 0}
+
+    def _log(done: int):
+        if total:
+            # about every 10%
+            if done == total or (done - state["logged"]) * 10 >= total:
+                logger.info("%s: %s/%s (%.0f%%)", desc, done, total, 100 * done / total)
+                state["logged"] = done
+        else:
+            logger.info("%s: %s", desc, done)
+
+    return _log
+
+
+def parallel_imap(
+    func: Callable,
+    items: Iterable,
+    backend: str = "process",
+    max_workers: Optional[int] = None,
+    chunk_size: Optional[int] = None,
+    shared: Any = _NOT_SHARED,
+    initializer: Optional[Callable] = None,
+    initargs: tuple = (),
+    progress: Union[bool, Callable[[int, Optional[int]], None]] = False,
+    desc: str = "parallel_map",
+    mp_context: Optional[str] = None,
+) -> Iterator[Any]:
+    """
+    Applies `func` to each item in parallel and yields the results in the
+    order of the items, as soon as they are available.
+
+    Items are sent to the workers in chunks and only a few chunks per worker
+    are in flight at a time, so an items generator is consumed as the results
+    are consumed.
+
+    Parameters
+    ----------
+    func : Callable. Function applied to each item, `func(item)` or
+    `func(shared, item)` when `shared` is given. Must be picklable (defined at
+    module level) for the process backend.
+
+    items : Iterable. The items to map over.
+
+    backend : str, optional. "process" or "thread", by default "process".
+
+    max_workers : int, optional. Number of workers, by default the number of
+    CPUs. -1 is the number of CPUs too.
+
+    chunk_size : int, optional. Number of items sent to a worker at a time, by
+    default enough for about 4 chunks per worker when the number of items is
+    known, 100 otherwise.
+
+    shared : Any, optional. Read-only object passed to `func` as its first
+    argument. Sent once to each worker process.
+
+    initializer : Callable, optional. Called with `initargs` once in each
+    worker when it starts, e.g. to load a model.
+
+    initargs : tuple, optional. Arguments of the initializer.
+
+    progress : bool | Callable, optional. True logs the progress about every
+    10%, a callable is called with the number of items done and the total
+    (None if unknown) after each chunk.
+
+    desc : str, optional. Name of the task in the progress logs.
+
+    mp_context : str, optional. Start method of the worker processes, "fork",
+    "spawn" or "forkserver", by default the platform's default.
+
+    Yields
+    ------
+    Any. The result of `func` for each item, in order.
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"backend must be one of {BACKENDS}, got {backend!r}")
+    if not max_workers or max_workers == -1:
+        max_workers = mp.cpu_count()
+
+    total = len(items) if hasattr(items, "__len__") else None
+    if chunk_size is None:
+        chunk_size = max(1, -(-total // (max_workers * 4))) if total else 100
+
+    if progress is True:
+        report = _progress_logger(desc, total)
+    elif callable(progress):
+        report = lambda done: progress(done, total)
+    else:
+        report = None
+
+    has_shared = shared is not _NOT_SHARED
+    if not has_shared:
+        shared = None
+    if backend == "thread":
+        pool = ThreadPool(
+            max_workers=max_workers,
+            initializer=initializer,
+            initargs=initargs,
+        )
+        run_chunk = in_current_context(_run_chunk)
+        submit = lambda chunk: pool.submit(run_chunk, func, chunk, has_shared, shared)
+    else:
+        pool = ProcessPool(
+            max_workers=max_workers,
+            mp_context=mp.get_context(mp_context) if mp_context else None,
+            initializer=_init_worker,
+            initargs=(has_shared, shared, initializer, initargs),
+        )
+        submit = lambda chunk: pool.submit(_run_worker_chunk, func, chunk)
+
+    done = 0
+    chunks = _iter_chunks(items, chunk_size)
+    pending = deque()
+    try:
+        for chunk in itertools.islice(chunks, max_workers * CHUNKS_IN_FLIGHT):
+            pending.append(submit(chunk))
+        while pending:
+            results = pending.popleft().result()
+            next_chunk = next(chunks, None)
+            if next_chunk is not None:
+                pending.append(submit(next_chunk))
+            done += len(results)
+            if report:
+                report(done)
+            yield from results
+    finally:
+        for future in pending:
+            future.cancel()
+        pool.shutdown(wait=True)
+
+
+def parallel_map(func: Callable, items: Iterable, **kwargs) -> List[Any]:
+    """
+    `parallel_imap` collected into a list, see `parallel_imap` for the
+    parameters.
+    """
+    return list(parallel_imap(func, items, **kwargs))
+
+
+def parallel_apply_frame(
+    data: Union[pd.Series, pd.DataFrame],
+    func: Callable,
+    n_chunks: Optional[int] = None,
+    **kwargs,
+) -> Union[pd.Series, pd.DataFrame]:
+    """
+    Applies a function to slices of a Series or DataFrame in parallel and
+    concatenates the results in order.
+
+    Parameters
+    ----------
+    data : pd.Series | pd.DataFrame. The data to split by rows.
+
+    func : Callable. Function applied to each slice, returning a Series or
+    DataFrame. `func(shared, slice)` when `shared` is given.
+
+    n_chunks : int, optional. Number of slices, by default 4 per worker.
+
+    **kwargs : Arguments of `parallel_imap`.
+
+    Returns
+    -------
+    pd.Series | pd.DataFrame. The concatenated results.
+    """
+    max_workers = kwargs.get("max_workers")
+    if not max_workers or max_workers == -1:
+        max_workers = mp.cpu_count()
+    n_chunks = n_chunks or max_workers * 4
+    bounds = np.linspace(0, len(data), min(n_chunks, max(len(data), 1)) + 1, dtype=int)
+    slices = [data.iloc[start:end] for start, end in zip(bounds[:-1], bounds[1:])]
+    kwargs.setdefault("chunk_size", 1)
+    return pd.concat(parallel_map(func, slices, **kwargs))
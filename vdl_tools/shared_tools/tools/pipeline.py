@@ -0,0 +1,321 @@
+"""
+Checkpointed pipeline of stages declared with their inputs.
+
+The output of each stage is saved in the checkpoint directory under a
+fingerprint of the stage (name, version, parameters) and of the fingerprints
+of its inputs. Running the pipeline again loads the stages whose checkpoint
+exists instead of running them, so a run that failed late resumes from the
+last completed stages, and changing a parameter only re-runs the stages that
+depend on it. Stages whose inputs are ready run concurrently.
+
+DataFrames are saved as parquet. Object columns that are not plain strings
+(lists, dicts, tuples...) are pickled cell by cell into binary columns so that
+they load back exactly as they were.
+"""
+import hashlib
+import json
+import os
+import pathlib as pl
+import pickle
+from concurrent.futures import FIRST_COMPLETED, wait
+from concurrent.futures import ThreadPoolExecutor as ThreadPool
+from contextlib import nullcontext
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence
+
+import pandas as pd
+
+from vdl_tools.shared_tools.tools.logger import logger
+from vdl_tools.shared_tools.tools.run_report import RunReport
+
+# key of the parquet schema metadata listing the pickled columns
+_PICKLED_COLUMNS_KEY = b"vdl_pickled_columns"
+
+
+@dataclass
+class Stage:
+    """
+    A step of a Pipeline.
+
+    Parameters
+    ----------
+    name : str. Name of the stage and of its output, used as input name by the
+    stages that depend on it.
+
+    func : Callable. Called with the values of `inputs` as positional
+    arguments and `params` as keyword arguments, returns the output of the
+    stage. DataFrame inputs are copies, so they can be modified in place.
+
+    inputs : Sequence[str], optional. Names of the stages or of the pipeline
+    inputs this stage depends on.
+
+    params : dict, optional. Keyword arguments of `func`, part of the
+    fingerprint of the stage.
+
+    version : str, optional. Part of the fingerprint, change it when the code
+    of the stage changes to invalidate its checkpoints.
+
+    checkpoint : bool, optional. Whether to save the output of the stage, by
+    default True.
+    """
+    name: str
+    func: Callable
+    inputs: Sequence[str] = ()
+    params: Dict[str, Any] = field(default_factory=dict)
+    version: str = "1"
+    checkpoint: bool = True
+
+
+def _json_default(value):
+    if isinstance(value, pl.PurePath):
+        return str(value)
+    if callable(value):
+        return f"{getattr(value, '__module__', '')}.{getattr(value, '__qualname__', repr(value))}"
+    if isinstance(value, (set, frozenset)):
+        return sorted(value, key=str)
+    return str(value)
+
+
+def fingerprint(value: Any) -> str:
+    """Stable hash of a json-like value."""
+    dumped = json.dumps(value, default=_json_default, sort_keys=True)
+    return hashlib.sha256(dumped.encode("utf-8")).hexdigest()
+
+
+def _input_fingerprint(value: Any) -> str:
+    if isinstance(value, pl.PurePath) and pl.Path(value).is_file():
+        # an input file changed in place must not match the previous checkpoints
+        stat = pl.Path(value).stat()
+        return fingerprint({"path": str(value), "mtime_ns": stat.st_mtime_ns, "size": stat.st_size})
+    return fingerprint(value)
+
+
+def _is_string_column(column: pd.Series) -> bool:
+    return pd.api.types.infer_dtype(column, skipna=True) in ("string", "empty")
+
+
+def write_frame(df: pd.DataFrame, path):
+    """Writes a DataFrame to parquet, pickling the object columns that are not strings."""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    pickled_columns = [
+        col for col in df.columns
+        if df[col].dtype == object and not _is_string_column(df[col])
+    ]
+    encoded = df.copy(deep=False)
+    for col in pickled_columns:
+        encoded[col] = [pickle.dumps(x, protocol=pickle.HIGHEST_PROTOCOL) for x in df[col]]
+
+    table = pa.Table.from_pandas(encoded, preserve_index=True)
+    metadata = dict(table.schema.metadata or {})
+    metadata[_PICKLED_COLUMNS_KEY] = json.dumps(pickled_columns).encode("utf-8")
+    pq.write_table(table.replace_schema_metadata(metadata), path)
+
+
+def read_frame(path) -> pd.DataFrame:
+    """Reads a DataFrame written by write_frame."""
+    import pyarrow.parquet as pq
+
+    table = pq.read_table(path)
+    pickled_columns = json.loads((table.schema.metadata or {}).get(_PICKLED_COLUMNS_KEY, b"[]"))
+    df = table.to_pandas()
+    for col in pickled_columns:
+        df[col] = [pickle.loads(x) for x in df[col]]
+    return df
+
+
+class Pipeline:
+    """
+    Runs Stages in dependency order, concurrently when they are independent,
+    and checkpoints their outputs.
+
+    Parameters
+    ----------
+    stages : Iterable[Stage]. The stages, with unique names.
+
+    checkpoint_dir : Path | str. Directory of the checkpoints.
+
+    max_workers : int, optional. Maximum number of stages running at the
+    same time, by default 2.
+
+    report : RunReport, optional. Records the metrics of the stages that run
+    and the stages loaded from their checkpoints.
+    """
+
+    def __init__(
+        self,
+        stages: Iterable[Stage],
+        checkpoint_dir,
+        max_workers: int = 2,
+        report: Optional[RunReport] = None,
+    ):
+        self.stages = {}
+        for stage in stages:
+            if stage.name in self.stages:
+                raise ValueError(f"Duplicate stage name {stage.name!r}")
+            self.stages[stage.name] = stage
+        self.checkpoint_dir = pl.Path(checkpoint_dir)
+        self.max_workers = max_workers
+        self.report = report
+
+    def _ordered_stages(self, targets: Sequence[str], inputs: Dict[str, Any]) -> List[Stage]:
+        """The stages needed for the targets, each after the stages it depends on."""
+        ordered = []
+        state = {}
+
+        def _visit(name, path):
+            if name in inputs:
+                return
+            if name not in self.stages:
+                raise ValueError(f"Unknown stage or input {name!r}, needed by {path[-1]!r}")
+            if state.get(name) == "done":
+                return
+            if state.get(name) == "visiting":
+                raise ValueError(f"Cycle in the pipeline: {' -> '.join(path + [name])}")
+            state[name] = "visiting"
+            for input_name in self.stages[name].inputs:
+                _visit(input_name, path + [name])
+            state[name] = "done"
+            ordered.append(self.stages[name])
+
+        for target in targets:
+            _visit(target, ["<targets>"])
+        return ordered
+
+    def fingerprints(self, inputs: Dict[str, Any], targets: Optional[Sequence[str]] = None) -> Dict[str, str]:
+        """Fingerprint of each stage needed for the targets (all the stages by default)."""
+        targets = list(self.stages) if targets is None else list(targets)
+        fingerprints = {name: _input_fingerprint(value) for name, value in inputs.items()}
+        for stage in self._ordered_stages(targets, inputs):
+            fingerprints[stage.name] = fingerprint({
+                "stage": stage.name,
+                "version": stage.version,
+                "params": stage.params,
+                "inputs": [fingerprints[name] for name in stage.inputs],
+            })
+        return fingerprints
+
+    def checkpoint_path(self, stage: Stage, stage_fingerprint: str) -> pl.Path:
+        return self.checkpoint_dir / f"{stage.name}-{stage_fingerprint[:16]}"
+
+    def _load(self, path: pl.Path):
+        if path.with_suffix(".parquet").exists():
+            return read_frame(path.with_suffix(".parquet"))
+        with open(path.with_suffix(".pkl"), "rb") as f:
+            return pickle.load(f)
+
+    def _save(self, path: pl.Path, value):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        suffix = ".parquet" if isinstance(value, pd.DataFrame) else ".pkl"
+        # write then rename, so that an interrupted write is not taken for a checkpoint
+        tmp_path = path.with_name(f"{path.name}.tmp{suffix}")
+        if suffix == ".parquet":
+            write_frame(value, tmp_path)
+        else:
+            with open(tmp_path, "wb") as f:
+                pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path.with_suffix(suffix))
+
+    def _has_checkpoint(self, path: pl.Path) -> bool:
+        return path.with_suffix(".parquet").exists() or path.with_suffix(".pkl").exists()
+
+    def run(
+        self,
+        targets: Optional[Sequence[str]] = None,
+        force: Iterable[str] = (),
+        **inputs,
+    ) -> Dict[str, Any]:
+        """
+        Runs the stages needed for the targets, skipping the ones that have a
+        checkpoint.
+
+        Parameters
+        ----------
+        targets : Sequence[str], optional. Names of the stages to compute, by
+        default all of them.
+
+        force : Iterable[str], optional. Names of stages to run even if they
+        have a checkpoint, the stages depending on them run again too.
+
+        **inputs : Values of the pipeline inputs used by the stages, json-like
+        values or paths, they are part of the fingerprints. The fingerprint of
+        the path of a file includes its size and modification time.
+
+        Returns
+        -------
+        dict. Output of each target by name.
+        """
+        targets = list(self.stages) if targets is None else list(targets)
+        ordered = self._ordered_stages(targets, inputs)
+        force = set(force)
+        for stage in ordered:
+            if force.intersection(stage.inputs):
+                force.add(stage.name)
+        fingerprints = self.fingerprints(inputs, targets)
+        paths = {stage.name: self.checkpoint_path(stage, fingerprints[stage.name]) for stage in ordered}
+
+        # Walk back from the targets: a stage runs if it has no checkpoint, and
+        # then the stages it depends on must be loaded or run
+        to_run = set()
+        needed = set(targets)
+        for stage in reversed(ordered):
+            if stage.name not in needed:
+                continue
+            if (
+                stage.name in force or
+                not stage.checkpoint or
+                not self._has_checkpoint(paths[stage.name])
+            ):
+                to_run.add(stage.name)
+                needed.update(stage.inputs)
+
+        values = {name: value for name, value in inputs.items()}
+        for stage in ordered:
+            if stage.name in needed and stage.name not in to_run:
+                logger.info("Stage %s: loading checkpoint %s", stage.name, paths[stage.name].name)
+                values[stage.name] = self._load(paths[stage.name])
+                if self.report is not None:
+                    self.report.record(stage.name, "checkpoint", rows_out=values[stage.name])
+
+        def _run_stage(stage):
+            logger.info("Stage %s: running", stage.name)
+            args = [
+                values[name].copy() if isinstance(values[name], pd.DataFrame) else values[name]
+                for name in stage.inputs
+            ]
+            rows_in = next((arg for arg in args if isinstance(arg, pd.DataFrame)), None)
+            stage_context = (
+                nullcontext() if self.report is None
+                else self.report.stage(stage.name, rows_in=rows_in)
+            )
+            with stage_context as metrics:
+                output = stage.func(*args, **stage.params)
+                if metrics is not None:
+                    metrics.set_rows(rows_out=output)
+            if stage.checkpoint:
+                self._save(paths[stage.name], output)
+            logger.info("Stage %s: done", stage.name)
+            return output
+
+        pending = [stage for stage in ordered if stage.name in to_run]
+        running = {}
+        with ThreadPool(max_workers=self.max_workers) as pool:
+            try:
+                while pending or running:
+                    for stage in list(pending):
+                        if len(running) >= self.max_workers:
+                            break
+                        if all(name in values for name in stage.inputs):
+                            pending.remove(stage)
+                            running[pool.submit(_run_stage, stage)] = stage
+                    done, _ = wait(running, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        stage = running.pop(future)
+                        values[stage.name] = future.result()
+            except BaseException:
+                # let the running stages finish and save their checkpoints
+                pending.clear()
+                raise
+
+        return {name: values[name] for name in targets}
@@ -0,0 +1,282 @@
+"""
+Per-stage metrics of long running jobs: wall time, peak memory, rows in and
+out, and counters such as cache hits and misses, API calls and token usage.
+
+Stages are recorded with `RunReport.stage`. Code running in a stage adds to
+its counters with `add_counts`, which is a no-op outside of a stage, so
+library code (e.g. the bulk cache APIs) can be instrumented unconditionally.
+Worker threads don't inherit the stage of the thread that starts them, the
+functions they run are wrapped with `in_current_context`.
+The report is written as JSON or Parquet to be compared across runs.
+"""
+import contextvars
+import datetime as dt
+import json
+import os
+import pathlib as pl
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List, Optional
+
+import pandas as pd
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+from vdl_tools.shared_tools.tools.logger import logger
+
+# seconds between two memory samples while a stage runs
+RSS_SAMPLE_INTERVAL = 0.5
+
+_current_stage = contextvars.ContextVar("current_stage", default=None)
+# stages running in any thread, counts added from threads that did not enter
+# a stage (e.g. worker pools) go to the stage if there is only one
+_active_stages: List["StageMetrics"] = []
+_active_stages_lock = threading.Lock()
+
+
+def current_rss_mb() -> Optional[float]:
+    """Resident memory of the process in MB, None if it can't be read."""
+    try:
+        with open("/proc/self/statm") as f:
+            rss_pages = int(f.read().split()[1])
+        return rss_pages * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def max_rss_mb() -> Optional[float]:
+    """Peak resident memory of the process since it started, in MB."""
+    if resource is None:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, kilobytes on Linux
+    return max_rss / 2**20 if sys.platform == "darwin" else max_rss / 2**10
+
+
+def _n_rows(value) -> Optional[int]:
+    if isinstance(value, (pd.DataFrame, pd.Series, list, dict)):
+        return len(value)
+    return None
+
+
+class StageMetrics:
+    """Metrics of one stage, see RunReport.stage."""
+
+    def __init__(self, name: str, rows_in: Optional[int] = None):
+        self.name = name
+        self.status = "running"
+        self.started_at = dt.datetime.now(dt.timezone.utc)
+        self.wall_time_s = None
+        self.rss_start_mb = current_rss_mb()
+        self.peak_rss_mb = self.rss_start_mb
+        self.rss_end_mb = None
+        self.rows_in = rows_in
+        self.rows_out = None
+        self.counts = Counter()
+        self._lock = threading.Lock()
+
+    def add_counts(self, **counts: int):
+        with self._lock:
+            self.counts.update({key: value for key, value in counts.items() if value})
+
+    def set_rows(self, rows_in=None, rows_out=None):
+        """Sets the number of rows from ints or from the DataFrames / lists themselves."""
+        if rows_in is not None:
+            self.rows_in = rows_in if isinstance(rows_in, int) else _n_rows(rows_in)
+        if rows_out is not None:
+            self.rows_out = rows_out if isinstance(rows_out, int) else _n_rows(rows_out)
+
+    def _sample_rss(self):
+        rss = current_rss_mb()
+        if rss is not None:
+            self.peak_rss_mb = max(self.peak_rss_mb or 0, rss)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "stage": self.name,
+            "status": self.status,
+            "started_at": self.started_at.isoformat(),
+            "wall_time_s": self.wall_time_s,
+            "rss_start_mb": self.rss_start_mb,
+            "rss_end_mb": self.rss_end_mb,
+            "peak_rss_mb": self.peak_rss_mb,
+            "rows_in": self.rows_in,
+            "rows_out": self.rows_out,
+            **dict(self.counts),
+        }
+
+
+def _stage_for_counts() -> Optional[StageMetrics]:
+    stage = _current_stage.get()
+    if stage is not None:
+        return stage
+    with _active_stages_lock:
+        if len(_active_stages) == 1:
+            return _active_stages[0]
+    return None
+
+
+def in_current_context(func: Callable) -> Callable:
+    """
+    Wraps `func` to run in a copy of the current context, e.g. for
+    `executor.map(in_current_context(func), items)`, so that the counts added
+    from the worker threads go to the stage of the calling thread.
+    """
+    context = contextvars.copy_context()
+
+    def _run(*args, **kwargs):
+        # a context can only be entered by one thread at a time
+        return context.copy().run(func, *args, **kwargs)
+
+    return _run
+
+
+def add_counts(**counts: int):
+    """
+    Adds to the counters of the current stage, e.g.
+    `add_counts(cache_hits=10, cache_misses=2)`. Does nothing outside of a stage.
+    """
+    stage = _stage_for_counts()
+    if stage is not None:
+        stage.add_counts(**counts)
+
+
+def add_token_usage(response):
+    """Adds the api call and the token usage of an OpenAI response to the current stage."""
+    # instructor responses keep the completion aside
+    response = getattr(response, "_raw_response", response)
+    usage = getattr(response, "usage", None)
+    if usage is None and isinstance(response, dict):
+        usage = response.get("usage")
+    if isinstance(usage, dict):
+        prompt_tokens = usage.get("prompt_tokens")
+        completion_tokens = usage.get("completion_tokens")
+    else:
+        prompt_tokens = getattr(usage, "prompt_tokens", None)
+        completion_tokens = getattr(usage, "completion_tokens", None)
+    add_counts(
+        api_calls=1,
+        prompt_tokens=prompt_tokens or 0,
+        completion_tokens=completion_tokens or 0,
+    )
+
+
+class RunReport:
+    """
+    Metrics of the stages of a run.
+
+    Parameters
+    ----------
+    run_name : str, optional. Name of the run in the report.
+
+    metadata : dict, optional. Json serializable values describing the run
+    (parameters, input files...), written with the report.
+    """
+
+    def __init__(self, run_name: str = None, metadata: Dict[str, Any] = None):
+        self.run_name = run_name
+        self.metadata = metadata or {}
+        self.started_at = dt.datetime.now(dt.timezone.utc)
+        self.stages: List[StageMetrics] = []
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name: str, rows_in=None):
+        """
+        Records the metrics of the code run in the context, e.g.
+
+        >>> with report.stage("geotags", rows_in=df) as metrics:
+        ...     df = add_geotags(df)
+        ...     metrics.set_rows(rows_out=df)
+
+        The memory is the one of the process, it includes the stages running
+        at the same time.
+        """
+        metrics = StageMetrics(name)
+        metrics.set_rows(rows_in=rows_in)
+        with self._lock:
+            self.stages.append(metrics)
+        with _active_stages_lock:
+            _active_stages.append(metrics)
+        token = _current_stage.set(metrics)
+
+        done = threading.Event()
+
+        def _sample():
+            while not done.wait(RSS_SAMPLE_INTERVAL):
+                metrics._sample_rss()
+
+        sampler = threading.Thread(target=_sample, name=f"rss-sampler-{name}", daemon=True)
+        sampler.start()
+        start = time.perf_counter()
+        try:
+            yield metrics
+            metrics.status = "done"
+        except BaseException:
+            metrics.status = "failed"
+            raise
+        finally:
+            metrics.wall_time_s = time.perf_counter() - start
+            done.set()
+            sampler.join()
+            metrics._sample_rss()
+            metrics.rss_end_mb = current_rss_mb()
+            _current_stage.reset(token)
+            with _active_stages_lock:
+                _active_stages.remove(metrics)
+            logger.info(
+                "Stage %s %s in %.1fs, peak RSS %s MB, counts %s",
+                name,
+                metrics.status,
+                metrics.wall_time_s,
+                None if metrics.peak_rss_mb is None else round(metrics.peak_rss_mb),
+                dict(metrics.counts),
+            )
+
+    def record(self, name: str, status: str, rows_out=None):
+        """Records a stage that didn't run, e.g. loaded from a checkpoint."""
+        metrics = StageMetrics(name)
+        metrics.status = status
+        metrics.wall_time_s = 0.0
+        metrics.set_rows(rows_out=rows_out)
+        with self._lock:
+            self.stages.append(metrics)
+        return metrics
+
+    def to_frame(self) -> pd.DataFrame:
+        """One row per stage, the counters are columns."""
+        df = pd.DataFrame([stage.to_dict() for stage in self.stages])
+        if self.run_name is not None:
+            df.insert(0, "run_name", self.run_name)
+        return df
+
+    def to_dict(self) -> Dict[str, Any]:
+        totals = Counter()
+        for stage in self.stages:
+            totals.update(stage.counts)
+        return {
+            "run_name": self.run_name,
+            "started_at": self.started_at.isoformat(),
+            "metadata": self.metadata,
+            "process_peak_rss_mb": max_rss_mb(),
+            "totals": dict(totals),
+            "stages": [stage.to_dict() for stage in self.stages],
+        }
+
+    def write(self, path) -> pl.Path:
+        """Writes the report as parquet if path ends with .parquet, as json otherwise."""
+        path = pl.Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        if path.suffix == ".parquet":
+            self.to_frame().to_parquet(path, index=False)
+        else:
+            with open(path, "w") as f:
+                json.dump(self.to_dict(), f, indent=2, default=str)
+        logger.info("Wrote run report to %s", path)
+        return path